@@ -2,14 +2,21 @@
 
 import os
 import sys
-import pyautogui
+import logging
+import argparse
+import multiprocessing
 
 from PyQt5.Qt import Qt
 from PyQt5.QtWidgets import *
-from playsound import playsound
 from PyQt5 import QtCore, QtGui
 from PyQt5.QtGui import QCursor
 from core.lautils import LostArkManager
+from core.pipeutils import QueuePipeline
+from core.monutils import QueueMonitor
+from core.metutils import METRICS
+from core.ovlutils import BackgroundFrame, OverlayStats, get_rounded_mask
+from core.plugutils import get_backend
+from core.pubutils import PUBLISH_PORT
 
 # Function that handles the background image load inside the exe
 def resource_path(relative_path):
@@ -21,24 +28,71 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, record_path=None, monitor_all=False, burst_size=1, server='default', use_history=True,
+                 lite=False, publish_port=None):
         super(MainWindow, self).__init__()
 
         # Window size
-        # Get w,h of the screen (ie: 1920x1080)
-        w, h = pyautogui.size()
+        # Get w,h of the screen (ie: 1920x1080) from the capture backend of the
+        # platform, shared with the lost ark manager.
+        self.wman = get_backend('capture')()
+        w, h = self.wman.get_screen_size()
         self.res_w = w
         self.res_h = h
 
-        # Instanciating a lost ark manager
-        self.lamanager = LostArkManager(screen_res=(w,h))
-
-        # Try to fetch queue status: if returns some error,
-        # assign an empty string
-        try:
-            self.queue_status = self.lamanager.get_queue_status()
-        except:
-            self.queue_status = ''
+        # Instanciating a lost ark manager and the background pipeline that will
+        # drive it: capture, OCR and estimation never run on the GUI thread. To
+        # monitor every game client running, the pipeline gets a monitor instead:
+        # the clients share its engines and are shown one per row.
+        self.is_multi = monitor_all
+
+        # The history of the past queues gives an eta from the first frame.
+        self.history = None
+        if use_history:
+            from core.histutils import HistoryStore
+            self.history = HistoryStore()
+
+        # Readers of the status server get the results of this pipeline, instead of
+        # capturing the game themselves.
+        self.publisher = None
+        if publish_port:
+            from core.pubutils import StatusServer
+            self.publisher = StatusServer(publish_port)
+
+        if monitor_all:
+            self.monitor = QueueMonitor(screen_res=(w,h), wman=self.wman, burst_size=burst_size,
+                                        history=self.history, server=server)
+            self.lamanager = self.monitor.engine
+            self.pipeline = QueuePipeline(monitor=self.monitor, publisher=self.publisher)
+        else:
+            self.lamanager = LostArkManager(screen_res=(w,h), wman=self.wman)
+            self.lamanager.burst_size = burst_size
+            if self.history is not None:
+                self.lamanager.use_history(self.history, server)
+
+            # Record the captured regions in a session file if requested
+            if record_path:
+                from core.recutils import SessionRecorder
+                self.lamanager.recorder = SessionRecorder(record_path, (w,h))
+            self.pipeline = QueuePipeline(self.lamanager, publisher=self.publisher)
+        self.pipeline.result_ready.connect(self.update_label)
+        QApplication.instance().aboutToQuit.connect(self.pipeline.stop)
+        if record_path:
+            QApplication.instance().aboutToQuit.connect(self.lamanager.recorder.save)
+        if self.history is not None:
+            QApplication.instance().aboutToQuit.connect(self.history.close)
+        if self.publisher is not None:
+            QApplication.instance().aboutToQuit.connect(self.publisher.close)
+
+        # Fetch the initial queue status before the window shows up
+        self.queue_status = self.pipeline.fetch_initial()
+        self.last_result_timestamps = {}
+        self.is_logged = False
+        self.rows = {}
+
+        # Texts shown by the labels: a label is updated (and repainted) only when
+        # his text changes, not at every result.
+        self.label_texts = {}
 
         # Right click handling
         self.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -51,9 +105,13 @@ class MainWindow(QMainWindow):
             QtCore.Qt.X11BypassWindowManagerHint
         )
 
-        # Setting opacity to translucent
-        self.setAttribute(Qt.WA_TranslucentBackground)
-        self.setWindowOpacity(0.8)
+        # Setting opacity to translucent. The lite mode draws an opaque window with
+        # rounded corners instead: the system does not blend it with what's below
+        # at every frame of the game.
+        self.is_lite = lite
+        if not lite:
+            self.setAttribute(Qt.WA_TranslucentBackground)
+            self.setWindowOpacity(0.8)
 
 
         # Handle resolution scaling
@@ -84,38 +142,50 @@ class MainWindow(QMainWindow):
         else:
             exit(0)
 
+        # A row per client needs a wider overlay
+        self.font_size = font_size
+        if self.is_multi:
+            self.overlay_w *= 2
+
         # Widget creation: we do assign a name to this external frame since we do
         # want to apply the stylesheet only to the external frame and not all the
         # children aswell. We also resize the frame based on the overlay w,h computed
         # before.
+        # In lite mode the frame paints the background from a pixmap scaled once
+        # for his size, instead of rescaling the image through the stylesheet.
         self.resize(self.overlay_w, self.overlay_h)
-        self.centralwidget = QWidget(self)
+        if lite:
+            self.centralwidget = BackgroundFrame(resource_path('assets/background.jpg'), self)
+        else:
+            self.centralwidget = QWidget(self)
         self.centralwidget.resize(self.overlay_w, self.overlay_h)
         self.centralwidget.setObjectName('ExternalFrame')
 
         # Stylesheet creation and application
-        stylesheet = """
-        QWidget#ExternalFrame {
-            border-image: url("assets/background.jpg");
-            background-repeat: no-repeat;
-            border-radius: 20px;
-        }
-        """
-        self.centralwidget.setStyleSheet(stylesheet)
+        if not lite:
+            stylesheet = """
+            QWidget#ExternalFrame {
+                border-image: url("assets/background.jpg");
+                background-repeat: no-repeat;
+                border-radius: 20px;
+            }
+            """
+            self.centralwidget.setStyleSheet(stylesheet)
 
         # Setting the central widget just created inside the qmainwindow
         self.setCentralWidget(self.centralwidget)
 
-        # Define timer: we need to synchronize with the server timer, so initially
-        # thats set to 1 sec in polling to refresh the queue status. Once we've been
-        # sinchronized we then change the timer timeout to 20 sec.
-        self.update_timer = QtCore.QTimer(self)
-        self.update_timer.timeout.connect(self.update_label)
-        self.update_timer.start(1000)
-        self.is_synchronized = False
+        # Start the pipeline: it synchronizes with the server refresh by itself
+        # (polling every sec until the number changes, then capturing only around
+        # each expected refresh) and posts back the results.
+        self.pipeline.start()
 
         # Creating label
-        if self.queue_status == '':
+        if self.is_multi:
+            queue_text = ' Looking for game clients.. '
+            player_text = ' Queue into a server '
+            time_text = ' on every client! '
+        elif self.queue_status == '':
             queue_text = ' Not in queue. '
             player_text = ' Please choose a server '
             time_text = ' And try again! '
@@ -137,95 +207,182 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.time_label)
         self.centralwidget.setLayout(layout)
 
+        # Repaints and CPU time of the overlay, reported every minute (with the
+        # metrics or the estimator traces only)
+        self.stats = None
+        if METRICS.enabled or logging.getLogger('lostqueue').isEnabledFor(logging.DEBUG):
+            self.stats = OverlayStats([self, self.centralwidget, self.queue_label, self.player_label,
+                                       self.time_label], parent=self)
+
+
+    def update_label(self, result):
+        """
+            Function that handles the results posted by the pipeline. Runs on the
+            GUI thread and only updates the labels.
+            INPUT:
+            - result: QueueResult of the processed frame
+        """
+
+        with METRICS.timer('overlay'):
+            self.show_result(result)
+
+    def show_result(self, result):
+        """
+            Function that updates the labels with a result.
+            INPUT:
+            - result: QueueResult of the processed frame
+        """
+
+        # Drop results older than the one already shown for the client
+        if result.timestamp < self.last_result_timestamps.get(result.client, 0):
+            return
+        self.last_result_timestamps[result.client] = result.timestamp
+
+        # Monitoring several clients: update the row of the client
+        if self.is_multi:
+            self.update_row(result)
+            return
+
+        # Check if we´ve logged in
+        if result.status == 'logged':
+            self.queue_label.setVisible(False)
+            self.set_text(self.player_label, '   LOGGED IN!   ')
+            self.time_label.setVisible(False)
+
+            # Play the login sound (once) with the audio backend of the platform
+            if not self.is_logged:
+                self.is_logged = True
+                get_backend('audio')(resource_path('assets/logged.wav'))
+
+            return
+
+        # Still waiting for the queue number to change: show the eta from the
+        # history of the server, if any
+        if result.status == 'synching':
+            if result.avg_time:
+                self.set_text(self.time_label, ' Time left: ~{} minutes (history) '.format(result.avg_time))
+            return
+
+        # Update queue and time left
+        queue_text, player_text, time_text = self.get_texts(result)
+        self.set_text(self.time_label, time_text)
+        self.set_text(self.queue_label, queue_text)
+        self.set_text(self.player_label, player_text)
+
+        # Keep track of the last valid queue
+        if result.queue != '':
+            self.queue_status = result.queue
+
+    def get_texts(self, result):
+        """
+            Function that builds the texts of an update result. We need to handle
+            some cases, since we can have none values or empty string.
+            INPUT:
+            - result: QueueResult of the processed frame
+        """
 
-    def update_label(self):
-
-        # Try to get cur queue status, if some error returns, assign an empty string
-        try:
-            cur_queue = self.lamanager.get_queue_status()
-        except:
-            cur_queue = ''
-
-
-        # Check if we´ve logged in: if the last queue status was lesser than 15,
-        # and the new status is empty that means we´ve finally managed to get in the game.
-        if self.queue_status != '':
-            if int(self.queue_status) < 100 and cur_queue == '':
-                self.queue_label.setVisible(False)
-                self.player_label.setText('   LOGGED IN!   ')
-                self.time_label.setVisible(False)
-
-                # Playsound strangely wont work TODO: Understand whY!
-                #self.update_timer.start(7000)
-                #playsound('./assets/logged.wav')
-
-                return
-
-        # Check if we're synchronized with the client: we achieve that comapring
-        # the initial queue status with the fetched one; if equal that means we're
-        # still on the same number, if not we set the correct timer timeout (20 sec)
-        # and then set the synch flag to true.
-        if not self.is_synchronized:
-            if cur_queue != self.queue_status:
-                self.is_synchronized = True
-                self.update_timer.start(20100)
-            else:
-                return
-
-        # Update queue and time left. We need to handle some cases, since we can
-        # have none values or empty string.
-        # If the queue status is empy, that means we do not have information yet.
-        if self.queue_status == '':
+        # If the last queue is empy, that means we do not have information yet.
+        if result.last_queue == '':
             time_text = 'Time left: Computing..'
+
+        # We can have the cases in which avg time is None (failed to fetch data).
+        elif not result.avg_time:
+            time_text =  'Time to left: {}'.format('Recomputing..')
+        elif result.eta_range is None:
+            time_text =  'Time left: {} minutes'.format(result.avg_time)
         else:
+            time_text =  'Time left: {} minutes ({}-{})'.format(result.avg_time, *result.eta_range)
 
-            # Get the avg time from the manager
-            avg_time = self.lamanager.compute_wait_time(cur_queue, self.queue_status)
+        # Players per minute are available only once we have a decrease estimate
+        if result.players_per_minute is None:
+            player_text = ' Validating. Please wait.. '
+        else:
+            player_text = ' Players per minute: {} '.format(int(result.players_per_minute))
 
-            # We can have the cases in which avg time is None (failed to fetch data).
-            if not avg_time:
-                time_text =  'Time to left: {}'.format('Recomputing..')
-            else:
-                time_text =  'Time left: {} minutes'.format(avg_time)
+        # If the cur queue is empty, that means tesseract failed the recognition.
+        # Set the estimated queue if present or display a message.
+        if result.queue != '':
+            queue_text = ' Position in queue: {} '.format(result.queue)
+        elif result.estimated_queue is not None:
+            queue_text = ' Position in queue: {} '.format(result.estimated_queue)
+        else:
+            queue_text = ' Validating. Please wait.. '
 
-        # Set the time label with the appropriate text
-        self.time_label.setText(time_text)
+        return queue_text, player_text, time_text
 
+    def update_row(self, result):
+        """
+            Function that handles the results of a client when monitoring several
+            ones: every client has his own row, created on his first result and
+            removed when his window is closed.
+            INPUT:
+            - result: QueueResult of the processed frame
+        """
 
-        # If the cur queue is empty, that means tesseract failed the recognition.
-        # Set the last queue if present or display a message.
-        if cur_queue == '':
-            if self.queue_status != '':
-                if self.lamanager.avg_queue_decreases.mean() != None:
-                    try:
-                        self.player_label.setText(' Players per minute: {} '.format(int(self.lamanager.avg_queue_decreases.mean()*3)))
-                        self.queue_label.setText(' Position in queue: {} '.format(int(self.queue_status)-int(self.lamanager.avg_queue_decreases.mean())))
-                    except:
-                        self.player_label.setText(' Validating. Please wait.. ')
-                        self.queue_label.setText(' Validating. Please wait.. ')
-                else:
-                    self.queue_label.setText(' Validating. Please wait.. ')
-                    self.player_label.setText(' Validating. Please wait.. ')
-
-            else:
-                self.queue_label.setText(' Validating. Please wait.. ')
-                try:
-                    self.player_label.setText(' Players per minute: {} '.format(int(self.lamanager.avg_queue_decreases.mean()*3)))
-                except:
-                    self.player_label.setText(' Validating. Please wait.. ')
+        # The window of the client has been closed
+        if result.status == 'closed':
+            row = self.rows.pop(result.client, None)
+            if row is not None:
+                self.label_texts.pop(row, None)
+                row.deleteLater()
+            self.resize_rows()
+            return
+
+        # First result of the client: add his row
+        if result.client not in self.rows:
+            self.rows[result.client] = self.create_label('Lato', self.font_size, 0, 0, '')
+            self.centralwidget.layout().addWidget(self.rows[result.client])
+            if self.stats is not None:
+                self.stats.watch(self.rows[result.client])
+            self.resize_rows()
+
+        if result.status == 'logged':
+            text = ' #{} LOGGED IN! '.format(result.client)
+        elif result.status == 'synching':
+            text = ' #{} Position in queue: {} - Synch.. '.format(result.client, result.queue or '-')
+            if result.avg_time:
+                text = text[:-1] + '(~{} minutes) '.format(result.avg_time)
         else:
-            self.queue_label.setText(' Position in queue: {} '.format(cur_queue))
-            try:
-                self.player_label.setText(' Players per minute: {} '.format(int(self.lamanager.avg_queue_decreases.mean()*3)))
-            except:
-                self.player_label.setText(' Validating. Please wait.. ')
+            texts = [t.strip() for t in self.get_texts(result)]
+            text = ' #{} {} '.format(result.client, ' - '.join(texts))
+
+        self.set_text(self.rows[result.client], text)
+
+    def set_text(self, label, text):
+        """
+            Function that sets the text of a label only if it changed, so that
+            the overlay is repainted only on a change of state.
+            INPUT:
+            - label: QLabel to update
+            - text: string to show
+        """
+
+        if self.label_texts.get(label) != text:
+            self.label_texts[label] = text
+            label.setText(text)
+
+    def resize_rows(self):
+        """
+            Function that fits the overlay to the rows: the placeholder labels
+            are shown only while no client has been found.
+        """
 
+        for label in (self.queue_label, self.player_label, self.time_label):
+            label.setVisible(len(self.rows) == 0)
 
+        h = max(self.overlay_h, (len(self.rows)+2) * self.overlay_h//5)
+        self.resize(self.overlay_w, h)
+        self.centralwidget.resize(self.overlay_w, h)
 
+    def resizeEvent(self, event):
+        """
+            Function that handles the resize event. In lite mode the window is
+            opaque: his rounded corners are cut by a mask.
+        """
 
-        # Update the queue status with the current queue fetch if valid
-        if cur_queue != '':
-            self.queue_status = cur_queue
+        if self.is_lite:
+            self.setMask(get_rounded_mask(self.width(), self.height()))
+        super(MainWindow, self).resizeEvent(event)
 
     def create_label(self, fontname, fontsize, x, y, text, border_radius=15):
         """
@@ -239,6 +396,7 @@ class MainWindow(QMainWindow):
 
         label = QLabel('', self)
         label.setText(text)
+        self.label_texts[label] = text
         label.setFont(QtGui.QFont(fontname, fontsize))
         label.setAlignment(QtCore.Qt.AlignCenter)
         label.setScaledContents(True)
@@ -293,7 +451,37 @@ class MainWindow(QMainWindow):
 
 if __name__ == '__main__':
 
+    # Needed by the tesseract worker processes when running from the exe
+    multiprocessing.freeze_support()
+
+    # Optional session recording, to be replayed with tools/replay_session.py
+    parser = argparse.ArgumentParser()
+    clients = parser.add_mutually_exclusive_group()
+    clients.add_argument('--record', help='save the captured queue regions in this .npz session file')
+    clients.add_argument('--all', action='store_true', help='monitor every game client running, one row each')
+    parser.add_argument('--burst', type=int, default=1, metavar='N',
+                        help='read every frame from a burst of N captures, voting the digits')
+    parser.add_argument('--server', default='default', help='name of the server: keeps his queue history apart')
+    parser.add_argument('--no-history', action='store_true', help='do not use nor save the queue history')
+    parser.add_argument('--lite', action='store_true',
+                        help='low overhead rendering: opaque overlay painted from cached pixmaps')
+    parser.add_argument('--publish', type=int, nargs='?', const=PUBLISH_PORT, metavar='PORT',
+                        help='publish the queue status as JSON lines to the readers of 127.0.0.1:PORT (default {})'
+                        .format(PUBLISH_PORT))
+    parser.add_argument('--metrics', type=int, metavar='PORT',
+                        help='collect stage latencies and serve them as JSON on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--verbose', action='store_true', help='print the estimator traces')
+    args = parser.parse_args()
+
+    # Estimator traces and instrumentation are off unless requested
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(message)s')
+    if args.metrics:
+        METRICS.enabled = True
+        METRICS.serve(args.metrics)
+
     app = QApplication([])
-    window = MainWindow()
+    window = MainWindow(record_path=args.record, monitor_all=args.all, burst_size=args.burst,
+                        server=args.server, use_history=not args.no_history, lite=args.lite,
+                        publish_port=args.publish)
     window.show()
     sys.exit(app.exec_())
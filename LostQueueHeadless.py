@@ -0,0 +1,119 @@
+# coding: utf-8
+# Headless entry point: reads the queue without the overlay (no Qt, no GUI) and
+# writes a JSON record per line for every processed frame, to stdout or to a file.
+# The frames come from the game window, or from a recorded session / folder of
+# screenshots with --source (any OS).
+
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+
+from core.lautils import LostArkManager
+from core.trackutils import QueueTracker, TrackerGroup, get_record
+from core.monutils import QueueMonitor
+from core.metutils import METRICS
+from core.plugutils import get_backend
+from core.pubutils import StatusServer, PUBLISH_PORT
+
+if __name__ == '__main__':
+
+    # Needed by the tesseract worker processes when running from the exe
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default='-', help='append the records to this file instead of stdout')
+    parser.add_argument('--source', help='play a recorded .npz session or a folder of screenshots instead of capturing')
+    parser.add_argument('--loop', action='store_true', help='play the source in loop')
+    parser.add_argument('--all', action='store_true', help='monitor every game client running')
+    parser.add_argument('--resolution', help='game resolution WxH (default: the game window size)')
+    parser.add_argument('--ocr', default='auto', choices=['auto', 'digits', 'tesseract'])
+    parser.add_argument('--estimator', default='kalman', choices=['kalman', 'legacy'])
+    parser.add_argument('--burst', type=int, default=1, metavar='N',
+                        help='read every frame from a burst of N captures, voting the digits')
+    parser.add_argument('--server', default='default', help='name of the server: keeps his queue history apart')
+    parser.add_argument('--no-history', action='store_true', help='do not use nor save the queue history')
+    parser.add_argument('--publish', type=int, nargs='?', const=PUBLISH_PORT, metavar='PORT',
+                        help='publish the queue status as JSON lines to the readers of 127.0.0.1:PORT (default {})'
+                        .format(PUBLISH_PORT))
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--metrics', type=int, metavar='PORT',
+                        help='collect stage latencies and serve them as JSON on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--verbose', action='store_true', help='print the estimator traces')
+    args = parser.parse_args()
+
+    # Logs go to stderr, stdout only carries the records
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(message)s')
+    if args.metrics:
+        METRICS.enabled = True
+        METRICS.serve(args.metrics)
+
+    # Capture source: the played frames or the game window (backend of the platform)
+    if args.source:
+        source = get_backend('capture', 'session')(args.source, loop=args.loop)
+    else:
+        source = get_backend('capture')()
+
+    if args.resolution:
+        screen_res = tuple(int(v) for v in args.resolution.lower().split('x'))
+    else:
+        screen_res = source.get_process_screensize('lost ark')
+    if screen_res[0] is None:
+        sys.exit('Lost Ark window not found')
+
+    # The history of the past queues gives an eta from the first frame
+    history = None
+    if not args.no_history:
+        from core.histutils import HistoryStore
+        history = HistoryStore()
+
+    # One tracker for the game window, or one for each client found by the monitor
+    if args.all:
+        monitor = QueueMonitor(screen_res, ocr_backend=args.ocr, estimator=args.estimator, wman=source,
+                               burst_size=args.burst, history=history, server=args.server)
+        group = TrackerGroup(monitor=monitor)
+    else:
+        lamanager = LostArkManager(screen_res, ocr_backend=args.ocr, estimator=args.estimator, wman=source)
+        lamanager.burst_size = args.burst
+        if history is not None:
+            lamanager.use_history(history, args.server)
+        group = TrackerGroup([QueueTracker(lamanager)])
+
+    # Readers of the status server get the same records as the output
+    publisher = None
+    if args.publish:
+        publisher = StatusServer(args.publish)
+        group.publisher = publisher
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'a')
+    end = time.monotonic() + args.duration if args.duration else float('inf')
+    group.fetch_initial()
+
+    try:
+        while time.monotonic() < end:
+
+            # Once a played source is over, process a last frame (the login is
+            # detected on it) and stop.
+            is_over = args.source is not None and source.is_finished()
+            for tracker, result in group.step(force=is_over):
+                out.write(json.dumps(get_record(tracker, result)) + '\n')
+                out.flush()
+            if is_over:
+                break
+
+            # Sleep until the next capture due (waking up at least every second)
+            time.sleep(min(max(min(group.get_next_wakeup(), end) - time.monotonic(), 0), 1.0))
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        group.close()
+        if history is not None:
+            history.close()
+        if publisher is not None:
+            publisher.close()
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,299 @@
+# Functions that take care of evaluating the legacy estimator (see LostArkManager
+# compute_wait_time) offline on many recorded sessions at once: the readings of all
+# the sessions, for every parameter set, are processed as rows of numpy arrays, one
+# time step after the other. Used by tools/sweep_sessions.py to tune LEGACY_PARAMS.
+import os
+import itertools
+import numpy as np
+
+from .statutils import EPS
+from .lautils import LostArkManager, LEGACY_PARAMS, NO_ESTIMATE
+
+# Seconds after which a stuck reading is estimated again (server refresh)
+STUCK_INTERVAL = 20
+
+def get_session_paths(paths):
+
+    # Session files of the given files and folders (.npz)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith('.npz'))
+        else:
+            files.append(path)
+
+    return files
+
+def read_session(path, source='ocr', ocr_backend='digits'):
+
+    # Readings (-1 if failed), timestamps and login time of a session. The readings
+    # are read again from the regions ('ocr'), or are the labels ('truth'). The ones
+    # recognized live ('recognized') have already been corrected by the estimator
+    # of the recording, so they only make sense for his own parameters.
+    from .recutils import load_session
+
+    session = load_session(path)
+    if source != 'ocr':
+        return session[source].astype(np.float64), session['timestamps'].astype(np.float64), \
+            float(session['logged_time'])
+
+    # Raw readings of the live path (cache and cascade), without the legacy
+    # correction: the kalman manager does not correct them while parsing
+    lamanager = LostArkManager(tuple(int(v) for v in session['screen_res']), ocr_backend=ocr_backend)
+    readings = []
+    for region in session['regions']:
+        text = lamanager.read_queue(lamanager.preprocess(region), region)
+        readings.append(int(text) if text != '' else -1)
+
+    return np.array(readings, dtype=np.float64), session['timestamps'].astype(np.float64), \
+        float(session['logged_time'])
+
+def stack_sessions(sessions):
+
+    # Pad the (readings, timestamps, logged_time) of the sessions into (S, T) arrays:
+    # the failed readings and the padding are nan
+    n = max(len(readings) for readings, _, _ in sessions)
+    readings = np.full((len(sessions), n), np.nan)
+    timestamps = np.full((len(sessions), n), np.nan)
+    for i, (r, t, _) in enumerate(sessions):
+        readings[i, :len(r)] = np.where(r >= 0, r, np.nan)
+        timestamps[i, :len(t)] = t
+
+    return {'readings': readings, 'timestamps': timestamps,
+            'logged_time': np.array([logged for _, _, logged in sessions], dtype=np.float64)}
+
+def load_sessions(paths, source='ocr', ocr_backend='digits'):
+
+    # Stacked sessions of the given files and folders
+    return stack_sessions([read_session(path, source, ocr_backend) for path in get_session_paths(paths)])
+
+def make_grid(**values):
+
+    # Parameter sets of every combination of the given values (lists), completing
+    # the missing parameters with LEGACY_PARAMS
+    names = list(LEGACY_PARAMS)
+    choices = [values.get(name) or [LEGACY_PARAMS[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+class BatchWindow():
+
+    def __init__(self, rows, capacities, resync_every=1024):
+
+        # A RingBuffer (see statutils) for each row, of the capacity of the row, with
+        # the same running statistics updated in the same order, so that the means
+        # and the roundings of the estimates are the scalar ones.
+        self.values = np.zeros((rows, int(capacities.max())))
+        self.capacities = capacities
+        self.counts = np.zeros(rows, dtype=np.int64)
+        self.starts = np.zeros(rows, dtype=np.int64)
+        self.totals = np.zeros(rows)
+        self.m2s = np.zeros(rows)
+        self.pushes = np.zeros(rows, dtype=np.int64)
+        self.resync_every = resync_every
+
+    def get_means(self):
+
+        # Mean of every row (nan if empty)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.totals / self.counts, np.nan)
+
+    def push(self, rows, values):
+
+        # Store the values in the given rows (bool mask), evicting the oldest sample
+        # of the full ones (inverse Welford update), then add them (Welford update)
+        rows = np.flatnonzero(rows)
+        values = values[rows]
+        counts, starts, capacities = self.counts[rows], self.starts[rows], self.capacities[rows]
+        totals, m2s = self.totals[rows], self.m2s[rows]
+
+        is_full = counts == capacities
+        evicted = self.values[rows, starts]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            old_means = totals / counts
+            counts = np.where(is_full, counts - 1, counts)
+            totals = np.where(is_full, totals - evicted, totals)
+            m2s = np.where(is_full, np.maximum(m2s - (evicted - old_means) * (evicted - totals / counts), 0.0), m2s)
+        totals = np.where(is_full & (counts == 0), 0.0, totals)
+        m2s = np.where(is_full & (counts == 0), 0.0, m2s)
+        starts = np.where(is_full, (starts + 1) % capacities, starts)
+
+        self.values[rows, (starts + counts) % capacities] = values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            old_means = np.where(counts > 0, totals / counts, 0.0)
+        counts = counts + 1
+        totals = totals + values
+        m2s = m2s + (values - old_means) * (values - totals / counts)
+
+        self.counts[rows], self.starts[rows], self.totals[rows], self.m2s[rows] = counts, starts, totals, m2s
+        self.pushes[rows] += 1
+        self.resync(rows[self.pushes[rows] % self.resync_every == 0])
+
+    def resync(self, rows):
+
+        # Recompute sum and m2 of the rows from their samples, oldest first
+        columns = [(self.starts[rows] + i) % self.capacities[rows] for i in range(self.values.shape[1])]
+        totals, m2s = np.zeros(len(rows)), np.zeros(len(rows))
+        for i, column in enumerate(columns):
+            totals = np.where(i < self.counts[rows], totals + self.values[rows, column], totals)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(self.counts[rows] > 0, totals / self.counts[rows], 0.0)
+        for i, column in enumerate(columns):
+            m2s = np.where(i < self.counts[rows], m2s + (self.values[rows, column] - means)**2, m2s)
+        self.totals[rows], self.m2s[rows] = totals, m2s
+
+    def is_outlier(self, values, deviations):
+
+        # Same test as RingBuffer.is_outlier, for every row (False for the empty ones)
+        n = self.counts + 1
+        old_means = self.totals / self.counts
+        means = (self.totals + values) / n
+        m2s = self.m2s + (values - old_means) * (values - means)
+        std = np.sqrt(m2s / n) + EPS
+
+        return (self.counts > 0) & (np.abs(values - (means + EPS)) >= deviations * std)
+
+    def add(self, rows, values, deviations):
+
+        # Push the values of the rows unless they're outliers (remove_outliers)
+        self.push(rows & ~self.is_outlier(values, deviations), values)
+
+def simulate(sessions, grid):
+
+    # Run the legacy estimator on every session with every parameter set, like the
+    # session replay does (see recutils.replay_session): the rows are the (parameter
+    # set, session) pairs, and the readings of a time step are processed for all of
+    # them at once. Returns the (P, S, T) minutes left estimated (nan if none, or
+    # before the first estimate).
+    readings = np.tile(sessions['readings'], (len(grid), 1))
+    timestamps = np.tile(sessions['timestamps'], (len(grid), 1))
+    rows, steps = readings.shape
+    per_row = lambda name: np.repeat([float(params[name]) for params in grid], len(sessions['readings']))
+    tolerance, deviations, refresh = per_row('tolerance'), per_row('deviations'), per_row('refresh')
+
+    # Estimator state of every row
+    decreases = BatchWindow(rows, per_row('window').astype(np.int64))
+    avg_times = BatchWindow(rows, per_row('window').astype(np.int64))
+    last_queue = np.full(rows, np.nan)
+    last_is_text = np.ones(rows, dtype=bool)
+    last_valid_queue = np.zeros(rows)
+    last_estimate_time = np.full(rows, np.nan)
+    last_avg_time = np.full(rows, float(NO_ESTIMATE))
+    delta_t = refresh.copy()
+    etas = np.full((rows, steps), np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for step in range(steps):
+            cur_queue, timestamp = readings[:, step].copy(), timestamps[:, step]
+            has_reading = ~np.isnan(cur_queue)
+
+            # A reading too far from the last valid queue is replaced by the expected
+            # one (parse_reading, once a decrease is known)
+            mean_decrease = decreases.get_means()
+            is_text = decreases.counts == 0
+            is_wrong = has_reading & ~is_text & (np.abs(last_valid_queue - cur_queue) > 2*tolerance)
+            cur_queue = np.where(is_wrong, np.round(last_valid_queue - mean_decrease), cur_queue)
+
+            # Estimate from the first change of the reading (synchronization): when
+            # it moved, or every refresh if it's stuck. Until a decrease is known
+            # parse_reading returns the text, then the number: the first number never
+            # equals the last text, so it's always estimated.
+            is_estimated = has_reading & ~np.isnan(last_queue) & \
+                ((cur_queue != last_queue) | (is_text != last_is_text) |
+                 (timestamp - last_estimate_time >= STUCK_INTERVAL))
+            last_estimate_time = np.where(is_estimated, timestamp, last_estimate_time)
+
+            # First decrease, or a wrong decrease replaced by the mean one
+            # (handle_wrong_pred)
+            delta = np.abs(last_queue - cur_queue)
+            is_first = is_estimated & (decreases.counts == 0)
+            is_wrong = is_estimated & ~is_first & (delta > 2*tolerance)
+            corrected = np.where(is_wrong, last_queue - mean_decrease, cur_queue)
+            delta = np.where(is_wrong, last_queue - corrected, delta)
+            decreases.push(is_first, delta)
+            decreases.add(is_estimated & ~is_first, delta, deviations)
+            corrected, delta = np.round(corrected), np.round(delta)
+
+            # Minutes left from the decrease per refresh, or the last ones if stuck
+            # (compute_wait_time)
+            is_moving = is_estimated & (corrected - last_queue != 0)
+            is_stuck = is_estimated & ~is_moving
+            avg_time = np.where(is_moving, np.ceil(corrected / (delta * (60 / delta_t))), last_avg_time)
+            delta_t = np.where(is_moving, refresh, np.where(is_stuck, delta_t + refresh, delta_t))
+            last_valid_queue = np.where(is_moving, corrected, last_valid_queue)
+            last_avg_time = np.where(is_estimated, avg_time, last_avg_time)
+            avg_times.add(is_estimated, avg_time, deviations)
+            eta = np.round(avg_times.get_means())
+            etas[:, step] = np.where(is_estimated & (eta < NO_ESTIMATE), eta, np.nan)
+
+            # Keep the last valid queue
+            last_queue = np.where(has_reading, cur_queue, last_queue)
+            last_is_text = np.where(has_reading, is_text, last_is_text)
+
+    return etas.reshape(len(grid), len(sessions['readings']), steps)
+
+def get_error_report(sessions, etas, params):
+
+    # Distribution of the eta errors (minutes, estimated - real) of a parameter set
+    # over the sessions with a known login time
+    remaining = (sessions['logged_time'][:, None] - sessions['timestamps']) / 60
+    errors = (etas - remaining)[~np.isnan(etas) & ~np.isnan(remaining)]
+    report = dict(params, estimates=int(errors.size))
+    if errors.size == 0:
+        return report
+
+    report.update({
+        'mae_min': float(np.abs(errors).mean()),
+        'bias_min': float(errors.mean()),
+        'rmse_min': float(np.sqrt((errors**2).mean())),
+        'percentiles_min': {str(p): float(v) for p, v in zip((5, 25, 50, 75, 95), np.percentile(errors, (5, 25, 50, 75, 95)))},
+        'within_1min': float((np.abs(errors) <= 1).mean()),
+        'within_5min': float((np.abs(errors) <= 5).mean()),
+    })
+    return report
+
+def evaluate(sessions, grid):
+
+    # Error report of every parameter set
+    etas = simulate(sessions, grid)
+    return [get_error_report(sessions, etas[i], params) for i, params in enumerate(grid)]
+
+def sweep(sessions, grid, workers=None):
+
+    # Evaluate the parameter sets, split in one chunk per worker process if
+    # workers > 1 (every worker runs the vectorized simulation on his chunk: the
+    # cost of a time step hardly depends on the number of rows, so the chunks are
+    # as large as possible). Returns the reports sorted by mean absolute error.
+    if workers and workers > 1 and len(grid) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        chunk = -(-len(grid) // workers)
+        chunks = [grid[i:i+chunk] for i in range(0, len(grid), chunk)]
+        with ProcessPoolExecutor(len(chunks)) as pool:
+            reports = [r for reports in pool.map(evaluate, itertools.repeat(sessions), chunks) for r in reports]
+    else:
+        reports = evaluate(sessions, grid)
+
+    return sorted(reports, key=lambda report: report.get('mae_min', float('inf')))
+
+def simulate_sequential(readings, timestamps, params, screen_res=(1920, 1080)):
+
+    # Reference implementation: the same run through a LostArkManager, one reading
+    # at a time (slow, used to check simulate). Returns the minutes left estimated.
+
+    lamanager = LostArkManager(screen_res, ocr_backend='digits', estimator='legacy')
+    lamanager.set_legacy_params(**params)
+    etas = np.full(len(readings), np.nan)
+    last_queue, last_estimate_time = '', None
+    for i, (reading, timestamp) in enumerate(zip(readings, timestamps)):
+        if np.isnan(reading):
+            continue
+        cur_queue = lamanager.parse_reading((str(int(reading)) if reading >= 0 else '', 1.0))
+        if cur_queue == '':
+            continue
+        if last_queue != '' and (cur_queue != last_queue or
+                                 (last_estimate_time is not None and timestamp - last_estimate_time >= STUCK_INTERVAL)):
+            last_estimate_time = timestamp
+            minutes = lamanager.compute_wait_time(cur_queue, last_queue)
+            etas[i] = minutes if minutes < NO_ESTIMATE else np.nan
+        last_queue = cur_queue
+
+    return etas
@@ -0,0 +1,20 @@
+# Functions that take care of playing the login sound, one for each audio backend
+# (see plugutils). Every function plays the file without blocking the caller.
+import threading
+
+def play_winsound(path):
+
+    # Windows builtin player, asynchronous
+    import winsound
+    winsound.PlaySound(path, winsound.SND_FILENAME | winsound.SND_ASYNC)
+
+def play_playsound(path):
+
+    # playsound blocks until the end of the file: play it from a daemon thread
+    from playsound import playsound
+    threading.Thread(target=playsound, args=(path,), daemon=True).start()
+
+def play_null(path):
+
+    # No audio available
+    pass
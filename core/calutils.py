@@ -0,0 +1,169 @@
+# Class that takes care of locating the queue number box on resolutions without
+# a hardcoded crop, and of caching the result for each window size and DPI.
+import os
+import cv2
+import json
+import numpy as np
+
+# Calibration cache and (optional) template of the queue dialog
+CALIBRATION_PATH = os.path.join(os.path.expanduser('~'), '.lostqueue', 'calibration.json')
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'queue_template.png')
+
+# Reference profile: the queue number box at 1080p, as offsets from the center of
+# the screen (x, y, w, h). Every other resolution is searched around this box
+# scaled by h/1080.
+REFERENCE_H = 1080
+REFERENCE_RECT = (43, 0, 67, 30)
+
+class RoiCalibrator():
+
+    def __init__(self, path=CALIBRATION_PATH, template_path=TEMPLATE_PATH):
+
+        self.path = path
+        self.template_path = template_path
+
+        # Load the cached rectangles: {"WxH@DPI": [x, y, w, h]}
+        self.rects = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.rects = json.load(f)
+
+        # The template (if present) is a grayscale crop of the queue dialog at 1080p,
+        # with the number box offsets inside it stored alongside.
+        self.template = None
+        if os.path.isfile(template_path) and os.path.isfile(template_path + '.json'):
+            self.template = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+            with open(template_path + '.json') as f:
+                self.template_rect = json.load(f)
+
+    def get_key(self, w, h, dpi):
+
+        return '{}x{}@{}'.format(w, h, dpi)
+
+    def get(self, w, h, dpi):
+
+        # Cached rectangle for the window size and DPI (None if not calibrated)
+        rect = self.rects.get(self.get_key(w, h, dpi))
+        return tuple(rect) if rect else None
+
+    def put(self, w, h, dpi, rect):
+
+        # Store and persist the rectangle
+        self.rects[self.get_key(w, h, dpi)] = [int(v) for v in rect]
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.rects, f, indent=2)
+
+    def drop(self, w, h, dpi):
+
+        # Forget the rectangle of the window size and DPI (ie: the readings from it
+        # keep failing), so that it is calibrated again
+        if self.rects.pop(self.get_key(w, h, dpi), None) is not None:
+            with open(self.path, 'w') as f:
+                json.dump(self.rects, f, indent=2)
+
+    def get_prior(self, w, h):
+
+        # Reference box scaled to the resolution: where we expect the number to be
+        s = h / REFERENCE_H
+        x, y, rw, rh = REFERENCE_RECT
+        return (w//2 + round(x*s), h//2 + round(y*s), round(rw*s), round(rh*s))
+
+    def save_template(self, frame, rect, pad=60):
+
+        # Build the template from a frame at 1080p where the number box is known:
+        # the dialog around the box is kept, in grayscale.
+        x, y, rw, rh = rect
+        x0, y0 = max(x-pad, 0), max(y-pad, 0)
+        patch = cv2.cvtColor(frame[y0:y+rh+pad, x0:x+rw+pad], cv2.COLOR_BGR2GRAY)
+        os.makedirs(os.path.dirname(self.template_path), exist_ok=True)
+        cv2.imwrite(self.template_path, patch)
+        with open(self.template_path + '.json', 'w') as f:
+            json.dump([x-x0, y-y0, rw, rh], f)
+
+        self.template = patch
+        self.template_rect = [x-x0, y-y0, rw, rh]
+
+    def locate_by_template(self, gray, h):
+
+        # Multi scale template matching around the expected scale: returns the
+        # number box of the best match, or None if the match is poor.
+        best = None
+        for scale in (h / REFERENCE_H) * np.linspace(0.85, 1.15, 7):
+            template = cv2.resize(self.template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if template.shape[0] > gray.shape[0] or template.shape[1] > gray.shape[1]:
+                continue
+
+            scores = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, loc = cv2.minMaxLoc(scores)
+            if best is None or score > best[0]:
+                best = (score, loc, scale)
+
+        if best is None or best[0] < 0.6:
+            return None
+
+        _, (tx, ty), scale = best
+        x, y, rw, rh = self.template_rect
+        return (tx + round(x*scale), ty + round(y*scale), round(rw*scale), round(rh*scale))
+
+    def locate_by_digits(self, gray, prior):
+
+        # Look for the bright digit glyphs in a window around the expected box: the
+        # number box is the union of the glyphs with the expected height, padded
+        # like the hardcoded crops.
+        x, y, rw, rh = prior
+        x0, y0 = max(x - rw, 0), max(y - rh, 0)
+        window = gray[y0:y+2*rh, x0:x+2*rw]
+        _, binary = cv2.threshold(window, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+
+        # A digit is between 30% and 90% of the box height
+        stats = stats[1:]
+        heights = stats[:, cv2.CC_STAT_HEIGHT]
+        glyphs = stats[(heights >= 0.3*rh) & (heights <= 0.9*rh)]
+        if len(glyphs) == 0:
+            return None
+
+        # Keep the glyphs on the same text line of the one closest to the prior center
+        cy = glyphs[:, cv2.CC_STAT_TOP] + glyphs[:, cv2.CC_STAT_HEIGHT]/2
+        cx = glyphs[:, cv2.CC_STAT_LEFT] + glyphs[:, cv2.CC_STAT_WIDTH]/2
+        closest = np.argmin((cx - (x-x0+rw/2))**2 + (cy - (y-y0+rh/2))**2)
+        line = glyphs[abs(cy - cy[closest]) < 0.25*rh]
+
+        gx0 = line[:, cv2.CC_STAT_LEFT].min()
+        gy0 = line[:, cv2.CC_STAT_TOP].min()
+        gx1 = (line[:, cv2.CC_STAT_LEFT] + line[:, cv2.CC_STAT_WIDTH]).max()
+        gy1 = (line[:, cv2.CC_STAT_TOP] + line[:, cv2.CC_STAT_HEIGHT]).max()
+        pad = max(rh//6, 2)
+
+        return (x0 + gx0 - pad, y0 + gy0 - pad, max(gx1 - gx0 + 2*pad, rw), gy1 - gy0 + 2*pad)
+
+    def calibrate(self, frame, w, h, dpi, verify=None):
+
+        # Locate the number box in a full frame (BGR) and cache it. The template is
+        # used when available, then the glyph search around the scaled reference box.
+        # If both fail, the scaled reference box is returned without being cached,
+        # so that the calibration is tried again on the next frame. The frame may
+        # also be BGRX, straight from the capture. Given verify (a function of the
+        # crop of the box), the box is cached only if it returns True: any bright
+        # blob of the right height passes the glyph search, so the digits must
+        # actually be read inside the box.
+        code = cv2.COLOR_BGRA2GRAY if frame.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        gray = cv2.cvtColor(frame[:h, :w], code)
+        prior = self.get_prior(w, h)
+
+        rect = None
+        if self.template is not None:
+            rect = self.locate_by_template(gray, h)
+        if rect is None:
+            rect = self.locate_by_digits(gray, prior)
+        if rect is None:
+            return prior
+
+        rect = tuple(int(v) for v in rect)
+        x, y, rw, rh = rect
+        if verify is not None and not verify(frame[max(y, 0):y+rh, max(x, 0):x+rw]):
+            return prior
+
+        self.put(w, h, dpi, rect)
+        return rect
@@ -0,0 +1,155 @@
+# Class that takes care of estimating the queue drain rate and the time left.
+from math import sqrt
+from collections import namedtuple
+
+# Estimate produced after every observation:
+# - position: filtered queue position
+# - rate: players leaving the queue per second
+# - eta: seconds left (None while the rate is unknown or not positive)
+# - eta_low, eta_high: 95% confidence interval of the eta (seconds)
+# - is_outlier: True if the observation has been rejected
+Estimate = namedtuple('Estimate', ['timestamp', 'position', 'rate', 'eta', 'eta_low', 'eta_high', 'is_outlier'])
+
+class DrainEstimator():
+
+    def __init__(self, rate_noise=1e-4, position_noise=4.0, drain_jitter=0.3, gate=4.0, min_samples=3, max_rejected=3):
+
+        # Kalman filter on the state [position, rate], with the queue draining at
+        # a (slowly varying) constant rate: position(t+dt) = position(t) - rate*dt.
+        # - rate_noise: how fast the rate can change ((players/sec)^2 per sec)
+        # - position_noise: variance of a correct reading (players^2) at full confidence
+        # - drain_jitter: std of the players drained between two observations, as a
+        #   fraction of the expected drain (the queue does not move smoothly)
+        # - gate: observations further than gate sigmas from the prediction are rejected
+        # - min_samples: observations needed before starting to reject
+        # - max_rejected: consecutive rejections after which the filter restarts from
+        #   the observations (the state itself was wrong, ie: misread first number)
+        # The state is 2x2: it's kept in plain lists, written out by hand, so that the
+        # estimator does not need numpy (fast import, and faster than numpy at this size).
+        self.rate_noise = rate_noise
+        self.position_noise = position_noise
+        self.drain_jitter = drain_jitter
+        self.gate = gate
+        self.min_samples = min_samples
+        self.max_rejected = max_rejected
+        self.rejected = 0
+        self.reset()
+
+    def reset(self, prior_rate=0.0, prior_rate_var=10.0):
+
+        # Forget everything: the rate starts from the prior (players/sec)
+        self.x = None
+        self.P = None
+        self.prior_rate = prior_rate
+        self.prior_rate_var = prior_rate_var
+        self.last_t = None
+        self.samples = 0
+        self.consecutive_rejected = 0
+
+    def is_ready(self):
+
+        return self.samples >= self.min_samples
+
+    def predict(self, t):
+
+        # Propagate state and covariance up to the time t, without updating them:
+        # x = F x and P = F P F' + Q, with F = [[1, -dt], [0, 1]] and the process
+        # noise Q = rate_noise * [[dt^3/3, -dt^2/2], [-dt^2/2, dt]].
+        dt = max(t - self.last_t, 0.0)
+        (p00, p01), (p10, p11) = self.P
+        q = self.rate_noise
+        fp00, fp01 = p00 - dt*p10, p01 - dt*p11
+
+        x = [self.x[0] - dt*self.x[1], self.x[1]]
+        P = [[fp00 - dt*fp01 + q*dt**3/3, fp01 - q*dt**2/2],
+             [p10 - dt*p11 - q*dt**2/2, p11 + q*dt]]
+
+        return x, P
+
+    def get_measurement_var(self, t, confidence):
+
+        # Variance of an observation: reading noise plus the jitter of the drain since
+        # the last observation, inflated when the OCR is not confident.
+        var = self.position_noise
+        if self.x is not None:
+            var += (self.drain_jitter * abs(self.x[1]) * max(t - self.last_t, 0.0))**2
+
+        return var / max(confidence, 1e-3)
+
+    def predict_position(self, t):
+
+        # Expected position at the time t (None before the first observation)
+        if self.x is None:
+            return None
+
+        x, _ = self.predict(t)
+        return max(x[0], 0.0)
+
+    def is_plausible(self, t, position, confidence=1.0):
+
+        # Check if an observation is compatible with the prediction: the squared
+        # innovation normalized by his variance must be inside the gate.
+        if self.x is None or not self.is_ready():
+            return True
+
+        x, P = self.predict(t)
+        S = P[0][0] + self.get_measurement_var(t, confidence)
+        return (position - x[0])**2 <= self.gate**2 * S
+
+    def observe(self, t, position, confidence=1.0):
+
+        # Feed an observation: t is a monotonic timestamp in seconds, position the
+        # recognized queue and confidence the OCR confidence (0-1). A less confident
+        # reading has a larger measurement variance.
+        R = self.get_measurement_var(t, confidence)
+
+        # First observation: initialize the state
+        if self.x is None:
+            self.x = [float(position), self.prior_rate]
+            self.P = [[R, 0.0], [0.0, self.prior_rate_var]]
+            self.last_t = t
+            self.samples = 1
+            return self.estimate(t, False)
+
+        # Statistically impossible observation (ie: 40000 read instead of 4000):
+        # reject it and keep the prediction. Too many rejections in a row mean that
+        # the filter is the one being wrong: restart it from this observation.
+        if not self.is_plausible(t, position, confidence):
+            self.rejected += 1
+            self.consecutive_rejected += 1
+            if self.consecutive_rejected < self.max_rejected:
+                return self.estimate(t, True)
+
+            self.reset(self.prior_rate, self.prior_rate_var)
+            return self.observe(t, position, confidence)
+
+        # Kalman update with the observed position (H = [1, 0]): the gain is the
+        # first column of P over the innovation variance.
+        x, P = self.predict(t)
+        S = P[0][0] + R
+        K = [P[0][0] / S, P[1][0] / S]
+        innovation = position - x[0]
+        self.x = [x[0] + K[0]*innovation, x[1] + K[1]*innovation]
+        self.P = [[P[0][0] - K[0]*P[0][0], P[0][1] - K[0]*P[0][1]],
+                  [P[1][0] - K[1]*P[0][0], P[1][1] - K[1]*P[0][1]]]
+        self.last_t = t
+        self.samples += 1
+        self.consecutive_rejected = 0
+
+        return self.estimate(t, False)
+
+    def estimate(self, t, is_outlier=False):
+
+        # Build the estimate at the time t: eta = position / rate, with his variance
+        # propagated from the state covariance (first order).
+        x, P = self.predict(t)
+        position, rate = max(x[0], 0.0), x[1]
+        if rate <= 0:
+            return Estimate(t, position, rate, None, None, None, is_outlier)
+
+        eta = position / rate
+        g0, g1 = 1/rate, -position/rate**2
+        eta_var = g0*g0*P[0][0] + g0*g1*(P[0][1] + P[1][0]) + g1*g1*P[1][1]
+        eta_std = sqrt(max(eta_var, 0.0))
+
+        return Estimate(t, position, rate, eta, max(eta - 1.96*eta_std, 0.0), eta + 1.96*eta_std, is_outlier)
@@ -0,0 +1,122 @@
+# Class that takes care of keeping the history of the queues across sessions, and
+# of giving the estimator a prior drain rate from it.
+import os
+import numpy as np
+
+# History file and his fixed width records (32 bytes): server name, wall clock
+# timestamp (sec), queue position and drain rate (players/sec)
+HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.lostqueue', 'history.bin')
+RECORD = np.dtype([('server', 'S16'), ('timestamp', '<f8'), ('position', '<i4'), ('rate', '<f4')])
+
+# Hours in a week: the drain rate mostly depends on the server and the time of the
+# week (ie: evenings and week ends are busier)
+HOURS = 168
+
+def get_hour_of_week(timestamp):
+
+    # Hour of the week (UTC, 0 is monday at midnight) of wall clock timestamps: the
+    # epoch was a thursday.
+    return ((np.floor_divide(timestamp, 3600) + 3*24) % HOURS).astype(np.int64)
+
+class HistoryStore():
+
+    def __init__(self, path=HISTORY_PATH):
+
+        # The file is append only: a record is written at every estimate and never
+        # changed. A record left incomplete by a crash is dropped at opening, so
+        # that the following ones stay aligned.
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.isfile(path) and os.path.getsize(path) % RECORD.itemsize:
+            os.truncate(path, os.path.getsize(path) - os.path.getsize(path) % RECORD.itemsize)
+        self.file = open(path, 'ab')
+        self.records = None
+
+        # Index: count, sum and sum of squares of the drain rates for each server
+        # (row) and hour of the week (column), built in one vectorized pass over the
+        # memory mapped records, then kept up to date by append.
+        self.servers = {}
+        self.counts = np.zeros((0, HOURS))
+        self.sums = np.zeros((0, HOURS))
+        self.squares = np.zeros((0, HOURS))
+
+        records = self.get_records()
+        if len(records):
+            names, inverse = np.unique(records['server'], return_inverse=True)
+            rows = np.array([self.get_row(name.decode()) for name in names])[inverse]
+            cols = get_hour_of_week(records['timestamp'])
+            rates = records['rate'].astype(np.float64)
+            np.add.at(self.counts, (rows, cols), 1)
+            np.add.at(self.sums, (rows, cols), rates)
+            np.add.at(self.squares, (rows, cols), rates**2)
+
+    def __len__(self):
+
+        return len(self.get_records())
+
+    def get_records(self):
+
+        # Memory mapped view of the records (mapped again if the file grew)
+        n = os.path.getsize(self.path) // RECORD.itemsize
+        if self.records is None or len(self.records) != n:
+            self.records = np.memmap(self.path, dtype=RECORD, mode='r', shape=(n,)) if n else np.zeros(0, RECORD)
+
+        return self.records
+
+    def get_name(self, server):
+
+        # Server name as stored in the records (16 bytes at most)
+        return server.encode()[:16].decode('utf-8', 'ignore')
+
+    def get_row(self, server):
+
+        # Index row of the server, added if new
+        if server not in self.servers:
+            self.servers[server] = len(self.servers)
+            self.counts = np.vstack([self.counts, np.zeros(HOURS)])
+            self.sums = np.vstack([self.sums, np.zeros(HOURS)])
+            self.squares = np.vstack([self.squares, np.zeros(HOURS)])
+
+        return self.servers[server]
+
+    def append(self, server, timestamp, position, rate):
+
+        # Write a record and update the index
+        server = self.get_name(server)
+        record = np.array([(server.encode(), timestamp, position, rate)], dtype=RECORD)
+        self.file.write(record.tobytes())
+        self.file.flush()
+
+        row, col = self.get_row(server), int(get_hour_of_week(timestamp))
+        self.counts[row, col] += 1
+        self.sums[row, col] += rate
+        self.squares[row, col] += rate**2
+
+    def get_prior(self, server, timestamp, min_samples=3):
+
+        # Prior drain rate (players/sec) and his variance for the server at the time
+        # of the week of timestamp: the samples of the same hour, widened to the
+        # nearby hours and then to the whole week until there are enough of them.
+        # Returns None if the server has no history.
+        server = self.get_name(server)
+        if server not in self.servers:
+            return None
+
+        row, col = self.servers[server], int(get_hour_of_week(timestamp))
+        for width in (0, 1, 3, HOURS//2):
+            cols = sorted({(col + d) % HOURS for d in range(-width, width+1)})
+            n = self.counts[row, cols].sum()
+            if n >= min_samples:
+                break
+        if n == 0:
+            return None
+
+        # The spread of the rates at that time of the week, plus a 20% margin since
+        # the queue of today is not the average one.
+        mean = self.sums[row, cols].sum() / n
+        var = max(self.squares[row, cols].sum() / n - mean**2, 0.0) + (0.2*mean)**2
+        return mean, var
+
+    def close(self):
+
+        self.file.close()
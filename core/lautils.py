@@ -1,72 +1,311 @@
 # Class that takes care of managing the LostArk queue.
 import re
-import cv2
-import numpy as np
-import pytesseract
+import time
+import logging
 from math import ceil
-from .wutils import WindowsManager
+from .statutils import RingBuffer
+from .estutils import DrainEstimator
+from .metutils import METRICS
+from .plugutils import get_backend
+
+# Estimator traces are printed only at DEBUG level (--verbose in the overlay)
+logger = logging.getLogger('lostqueue')
+
+# Queue number crops (y0, y1, x0, x1) inside the region at the center of the
+# screen, for each supported resolution height (borderless).
+QUEUE_CROPS = {
+    720: (0, 20, 78, 120),
+    1080: (0, 30, 93, 160),
+    1440: (5, 35, 107, 185),
+    2160: (10, 50, 145, 250),
+}
+
+# Seconds before a failed calibration of the queue box is attempted again
+CALIBRATION_RETRY = 30
+
+# Confidence of the reading required to keep a located queue box (any bright blob
+# of the right height is read as some digit, with a low confidence)
+CALIBRATION_CONFIDENCE = 0.4
+
+# Failed readings in a row after which a calibrated queue box is dropped and
+# located again
+CALIBRATION_FAILURES = 10
+
+# Minutes left of the legacy estimator until it computes a first one
+NO_ESTIMATE = 99999
+
+# Parameters of the legacy estimator (see compute_wait_time), tuned offline with
+# tools/sweep_sessions.py:
+# - tolerance: a reading moving more than 2*tolerance from the last one is wrong
+# - deviations: sigmas from the window mean beyond which a sample is an outlier
+# - window: samples kept in the windows of the decreases and of the times
+# - refresh: seconds between two server refreshes
+LEGACY_PARAMS = {'tolerance': 100, 'deviations': 4, 'window': 6, 'refresh': 20}
 
 class LostArkManager():
 
-    def __init__(self, screen_res):
+    def __init__(self, screen_res, ocr_backend='auto', estimator='kalman', wman=None, window='lost ark',
+                 engines=None):
 
-        self.wman = WindowsManager()
+        # The windows manager is created on first capture, so that the manager can
+        # run headless (ie: replaying a recorded session) on any OS. The game window
+        # is the first one named 'lost ark', unless a window handle is given (one
+        # manager for each client when several ones are running).
+        self.windows_manager = wman
+        self.window = window
         self.screen_res = screen_res
-        self.delta_t = 20
-        self.last_avg_time = 99999
+        self.last_avg_time = NO_ESTIMATE
         self.last_valid_queue = 0
-        self.avg_times = np.array([])
-        self.avg_queue_decreases = np.array([])
-        self.queue_tolerance = 100
-        pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract'
-
-    def get_queue_image(self):
-
-        # Extract queue rectangle box from the image
-        # NOTE: Precision may vary on screen resolution: higher one produces
-        # better images, and accurate queue inference.
-        im, w, h = self.wman.get_process_snap('lost ark')
-
-        # Assure h and w match current monitor resolution
-        if h != self.screen_res[1]: h = self.screen_res[1]
-        if w != self.screen_res[0]: w = self.screen_res[0]
+        self.set_legacy_params(**LEGACY_PARAMS)
 
-        # Convert the PIL image to opencv
-        im = cv2.cvtColor(np.array(im), cv2.COLOR_RGB2BGR)
-
-        # Crop (or pad) the image to the correct resolution if PIL
-        # failed to assert the size of the windows (may happens when using downscalign
-        # or upscaling in resolution)
-        im = im[:h, :w]
-
-        # Crop the rectangle box region: all the coordinates have been found optimally
-        # by trial and error.
-        rect = im[h//2:h//2+100, w//2-50:w//2+200]
-
-        # Handle resolution:
-        if self.screen_res[1] == 720:
-
-            # CASE 720P (borderless)
-            queue_img = rect[0:20, 78:120]
+        # Capture, preprocessing and OCR engines: built here, or the ones of another
+        # manager (engines) when monitoring several clients (see share_engines).
+        if engines is None:
+            self.create_engines(ocr_backend)
+        else:
+            self.share_engines(engines)
+
+        # Recognition cascade: a reading less confident than cascade_threshold (or
+        # empty) is retried on the region binarized with the alternative recipes
+        # (None disables it).
+        self.cascade_threshold = 0.6
+
+        # Select the estimator: 'kalman' fits position and drain rate on timestamped
+        # observations (see DrainEstimator), 'legacy' uses the averages on a fixed
+        # 20 sec refresh basis computed below.
+        self.estimator_type = estimator
+        self.estimator = DrainEstimator()
+        self.last_confidence = 1.0
+        self.last_estimate = None
+
+        # Queue box located by the calibrator (see get_queue_rect)
+        self.calibrated_rect = None
+        self.approximate_rect = None
+        self.calibrate_after = 0.0
+        self.calibrated_dpi = None
+        self.failed_readings = 0
+
+        # Optional SessionRecorder receiving every captured region
+        self.recorder = None
+
+        # Optional HistoryStore of the past queues of the server: it gives the
+        # estimator a prior drain rate, and receives the new estimates.
+        self.history = None
+        self.server = 'default'
+
+        # Burst mode: every reading captures burst_size regions, burst_interval
+        # seconds apart, recognized in a single OCR call and combined by a per digit
+        # majority vote (1 disables it).
+        self.burst_size = 1
+        self.burst_interval = 0.03
+
+    @property
+    def wman(self):
+
+        # Capture backend of the platform, loaded on first use
+        if self.windows_manager is None:
+            self.windows_manager = get_backend('capture')()
+
+        return self.windows_manager
+
+    def create_engines(self, ocr_backend):
+
+        # The image processing modules (opencv) are imported only when a manager is
+        # created: importing this module (ie: for the estimator) stays cheap.
+        from .ocrutils import OCRCache
+        from .calutils import RoiCalibrator
+        from .preputils import Preprocessor
+
+        # Binarization of the queue regions, with the profile of the resolution
+        self.preprocessor = Preprocessor.for_resolution(self.screen_res[1])
+
+        # Alternative binarization recipes of the recognition cascade, recognized
+        # concurrently. The threads start on first use.
+        from concurrent.futures import ThreadPoolExecutor
+        from .preputils import PREPROCESS_VARIANTS
+        self.variants = [Preprocessor(**profile) for profile in PREPROCESS_VARIANTS]
+        self.cascade_executor = ThreadPoolExecutor(len(self.variants), thread_name_prefix='cascade')
+
+        # Select the OCR backend: 'digits' uses the in-process recognizer, 'tesseract'
+        # the external binary. 'auto' picks the recognizer only when it has been
+        # trained for the current resolution, and falls back to tesseract otherwise.
+        self.recognizer = get_backend('ocr', 'digits')(self.screen_res[1])
+        if ocr_backend == 'auto':
+            ocr_backend = 'digits' if self.recognizer.is_trained else 'tesseract'
+        self.ocr_backend = ocr_backend
+
+        # Persistent tesseract engines, started on first use. If the tesseract
+        # library can't be loaded we fall back to the command line.
+        self.tesseract_pool = None
+        self.use_tesseract_pool = True
+
+        # Cache of the recognized crops: while the queue number does not change
+        # (20 sec between server refreshes) the OCR is not called at all.
+        self.ocr_cache = OCRCache()
+
+        # Calibration of the queue box for the resolutions without a hardcoded crop
+        self.calibrator = RoiCalibrator()
+
+    def share_engines(self, other):
+
+        # Use the capture, preprocessing and OCR engines of another manager, keeping
+        # only the estimation state: monitoring several clients then costs one set
+        # of engines. The tesseract pool is started here, so that it's not started
+        # again by every manager on first use.
+        if other.ocr_backend != 'digits' and other.use_tesseract_pool and other.tesseract_pool is None:
+            try:
+                other.start_tesseract_pool()
+            except (OSError, RuntimeError):
+                other.use_tesseract_pool = False
+
+        self.windows_manager = other.wman
+        self.preprocessor = other.preprocessor
+        self.variants = other.variants
+        self.cascade_executor = other.cascade_executor
+        self.recognizer = other.recognizer
+        self.ocr_backend = other.ocr_backend
+        self.tesseract_pool = other.tesseract_pool
+        self.use_tesseract_pool = other.use_tesseract_pool
+        self.ocr_cache = other.ocr_cache
+        self.calibrator = other.calibrator
+
+    def start_tesseract_pool(self):
+
+        # Start the persistent tesseract engines: one for each binarization recipe
+        # when the cascade is enabled, so that the recipes are recognized
+        # concurrently instead of queuing on a single engine.
+        size = len(self.variants) if self.cascade_threshold is not None else 1
+        self.tesseract_pool = get_backend('ocr', 'tesseract')(size)
+
+    def use_history(self, history, server='default'):
+
+        # Warm start: start the estimator from the drain rate seen in the past on the
+        # server at this time of the week, so that an eta is available from the
+        # first reading. The live observations then refine it.
+        self.history = history
+        self.server = server
+        prior = history.get_prior(server, time.time())
+        if prior is not None:
+            self.estimator.reset(*prior)
+            logger.debug('Prior drain rate for %s: %.3f players/sec', server, prior[0])
+
+    def get_prior_eta(self, queue):
+
+        # Minutes left from the prior drain rate only (None without a prior)
+        if queue == '' or self.estimator_type != 'kalman' or self.estimator.prior_rate <= 0:
+            return None
 
-        elif self.screen_res[1] == 1080:
+        return ceil(int(queue) / self.estimator.prior_rate / 60)
 
-            # CASE 1080P (borderless)
-            queue_img = rect[0:30, 93:160]
+    def set_legacy_params(self, tolerance, deviations, window, refresh):
 
-        elif self.screen_res[1] == 1440:
+        # Set the parameters of the legacy estimator, and reset his windows
+        self.queue_tolerance = tolerance
+        self.max_deviations = deviations
+        self.refresh = refresh
+        self.delta_t = refresh
+        self.avg_times = RingBuffer(window)
+        self.avg_queue_decreases = RingBuffer(window)
 
-            # CASE 1440P (borderless)
-            queue_img = rect[5:35, 107:185]
+    def get_queue_rect(self):
 
-        elif self.screen_res[1] == 2160:
+        # Get the queue number rectangle (x, y, w, h) inside the game window.
+        # The queue box lies in a region starting from the center of the screen
+        # (h//2:h//2+100, w//2-50:w//2+200), and the number inside the box has been
+        # found optimally by trial and error for each resolution.
+        # NOTE: Precision may vary on screen resolution: higher one produces
+        # better images, and accurate queue inference.
+        w, h = self.screen_res
+        if h in QUEUE_CROPS:
+            y0, y1, x0, x1 = QUEUE_CROPS[h]
+            return (w//2-50+x0, h//2+y0, x1-x0, y1-y0)
+
+        # Other resolutions (ultrawide, 1600p, scaled displays..): locate the box
+        # once with the calibrator, then use the cached rectangle. A failed
+        # calibration caches the approximate box for CALIBRATION_RETRY seconds,
+        # so the full frame is not grabbed and searched again at every tick.
+        if self.calibrated_rect is None and time.monotonic() >= self.calibrate_after:
+            rect, is_located = self.calibrate()
+            if is_located:
+                self.calibrated_rect = rect
+            elif rect is not None:
+                self.approximate_rect = rect
+                self.calibrate_after = time.monotonic() + CALIBRATION_RETRY
+
+        return self.calibrated_rect or self.approximate_rect
+
+    def calibrate(self):
+
+        # Look for a rectangle already calibrated for this window size and DPI.
+        # Returns the rectangle (None if no frame) and whether it has been located.
+        w, h = self.screen_res
+        dpi = self.wman.get_process_dpi(self.window)
+        if dpi is None:
+            return None, False
+
+        self.calibrated_dpi = dpi
+        rect = self.calibrator.get(w, h, dpi)
+        if rect is not None:
+            return rect, True
+
+        # Otherwise take a full frame (only once) and locate the box in it: the box
+        # is kept only if a number is read inside it. If the calibration fails we get
+        # an approximate box, used until the next attempt.
+        frame = self.wman.get_process_frame(self.window)
+        if frame is None:
+            return None, False
+        rect = self.calibrator.calibrate(frame, w, h, dpi, verify=self.is_readable)
+
+        return rect, self.calibrator.get(w, h, dpi) is not None
+
+    def is_readable(self, region):
+
+        # Whether a number is confidently recognized in the region (BGR or BGRX)
+        if region.size == 0:
+            return False
+        return self.get_score(self.recognize(self.preprocess(region))) >= CALIBRATION_CONFIDENCE
+
+    def check_calibration(self, clean_num):
+
+        # Count the failed readings in a row (nothing read, or not confidently): when
+        # the calibrated box keeps failing (wrong box, or a layout change of the game)
+        # drop it from the cache, so that it is located again on the next capture.
+        is_failed = clean_num == '' or self.last_confidence < CALIBRATION_CONFIDENCE
+        self.failed_readings = self.failed_readings + 1 if is_failed else 0
+        if self.calibrated_rect is not None and self.failed_readings >= CALIBRATION_FAILURES:
+            logger.debug('Calibrated box %s dropped after %d failed readings', self.calibrated_rect,
+                         self.failed_readings)
+            self.calibrator.drop(*self.screen_res, self.calibrated_dpi)
+            self.calibrated_rect = None
+            self.failed_readings = 0
+
+    def get_queue_region(self):
+
+        # Get the queue rectangle for the current resolution
+        rect = self.get_queue_rect()
+        if rect is None:
+            rect = self.calibrator.get_prior(*self.screen_res)
+
+        # Capture only the queue region from the game window: we get a BGRX view
+        # over the capture bitmap, no conversion is done here (the grayscale is
+        # computed straight from it by preprocess).
+        with METRICS.timer('capture'):
+            region = self.wman.get_process_region_array(self.window, rect)
+
+        # Record the raw region (BGR) if requested
+        if self.recorder is not None and region is not None:
+            self.recorder.add(region[..., :3])
+
+        return region
 
-            # CASE 2160P (borderless)
-            queue_img = rect[10:50, 145:250]
+    def get_queue_image(self):
 
-        else:
+        # Capture the queue region and binarize it
+        region = self.get_queue_region()
+        with METRICS.timer('threshold'):
+            return self.preprocess(region)
 
-            exit(0)
+    def preprocess(self, queue_img):
 
         # LESS ACCURATE
         """# Filtering out some noise with binarization and image processing
@@ -79,41 +318,155 @@ class LostArkManager():
         # Convert to grayscale
         final = cv2.cvtColor(eroded, cv2.COLOR_BGR2GRAY)"""
 
-        # Converting to grayscale and dilating to better recognize digits
-        if self.screen_res[1] != 2160:
-            queue_img = cv2.cvtColor(queue_img, cv2.COLOR_BGR2GRAY)
-            queue_img = cv2.dilate(queue_img, (2,2), iterations=1)
-            _, queue_img = cv2.threshold(queue_img, 60, 255, cv2.THRESH_BINARY_INV)
+        # Converting to grayscale, dilating and binarizing to better recognize
+        # digits, following the profile of the resolution (see preputils). The
+        # region is either BGRX (straight from the capture) or BGR (recorded); the
+        # returned image is overwritten by the next call.
+        return self.preprocessor.process(queue_img)
 
-        else:
-            # IF 4K, binarize without dilating: quality is good enough.
-            _, queue_img = cv2.threshold(queue_img, 127, 255, cv2.THRESH_BINARY_INV)
+    def get_queue_status(self):
 
-        # return
-        return queue_img
+        # Get the process screen and read the number (the raw region is kept for
+        # the cascade)
+        if self.burst_size > 1:
+            return self.read_burst(self.get_burst_images())
+        region = self.get_queue_region()
+        with METRICS.timer('threshold'):
+            queue_img = self.preprocess(region)
+        return self.read_queue(queue_img, region)
+
+    def get_burst_images(self):
+
+        # Capture a burst of regions in quick succession, copied in a preallocated
+        # stack (the capture reuses his buffer), and binarize them in one call.
+        stack = None
+        for i in range(self.burst_size):
+            if i > 0:
+                time.sleep(self.burst_interval)
+            region = self.get_queue_region()
+            if region is None:
+                raise RuntimeError('Game window not found')
+            if stack is None:
+                stack = self.preprocessor.get_stack(self.burst_size, region.shape)
+            stack[i] = region
+
+        with METRICS.timer('threshold'):
+            return self.preprocessor.process_batch(stack)
+
+    def read_burst(self, queue_imgs):
+
+        # Read the number from a burst of binarized crops, with a single OCR call
+        with METRICS.timer('ocr'):
+            result = self.recognize_burst(queue_imgs)
+        METRICS.count('ocr_bursts')
+
+        return self.parse_reading(result)
+
+    def read_queue(self, queue, region=None):
+
+        # Get the string queue number: if the same crop (or a perceptually identical
+        # one) has already been recognized, reuse the result without calling the OCR.
+        # Given the raw region, a reading not confident enough goes through the
+        # cascade, and the best result is cached for the crop.
+        result, keys = self.ocr_cache.get(queue)
+        if result is None:
+            METRICS.count('ocr_cache_misses')
+            with METRICS.timer('ocr'):
+                result = self.recognize(queue)
+            if region is not None and self.cascade_threshold is not None and \
+                    self.get_score(result) < self.cascade_threshold:
+                with METRICS.timer('cascade'):
+                    result = self.recognize_cascade(region, result)
+            self.ocr_cache.put(keys, result)
+        else:
+            METRICS.count('ocr_cache_hits')
 
-    def get_queue_status(self):
+        return self.parse_reading(result)
 
-        # Get the process screen
-        queue = self.get_queue_image()
+    def parse_reading(self, result):
 
-        # Get the string queue number
-        q_num = pytesseract.image_to_string(queue,
-                                            lang='eng',
-                                            config='--psm 10 --oem 3 -c tessedit_char_whitelist=0123456789')
+        # Turn the OCR result (text, confidence) into the queue number
+        q_num, self.last_confidence = result
 
         # Clean the string from special characters
-        clean_num = re.sub('\W+','', q_num)
+        clean_num = re.sub(r'\W+','', q_num)
+        if clean_num == '':
+            METRICS.count('ocr_failures')
+        self.check_calibration(clean_num)
 
         # Handle tesseract errors case: assure that there is at least one element
-        # inside the avg_queue_decreases to fetch an estimate.
-        if len(self.avg_queue_decreases) >= 1 and clean_num != '':
+        # inside the avg_queue_decreases to fetch an estimate. The kalman estimator
+        # instead checks the reading when observing it (see compute_wait_time).
+        if self.estimator_type == 'legacy' and len(self.avg_queue_decreases) >= 1 and clean_num != '':
             clean_num, _, _ = self.handle_wrong_pred(clean_num, None)
             clean_num = int(clean_num)
 
+        # Annotate the recorded region with the number read
+        if self.recorder is not None:
+            self.recorder.set_recognized(clean_num)
+
         # Return the number
         return clean_num
 
+    def get_score(self, result):
+
+        # Score of a reading (text, confidence): his confidence, -1 if no digit read
+        text, conf = result
+        return conf if re.sub(r'\D+', '', text) != '' else -1.0
+
+    def recognize_cascade(self, region, result):
+
+        # Binarize the raw region with every alternative recipe and recognize them
+        # concurrently (each recipe has his own buffers), then keep the best scoring
+        # reading, the given one included.
+        METRICS.count('ocr_cascades')
+        readings = list(self.cascade_executor.map(lambda variant: self.recognize(variant.process(region)),
+                                                  self.variants))
+        best = max(readings, key=self.get_score)
+        if self.get_score(best) <= self.get_score(result):
+            return result
+
+        METRICS.count('ocr_cascade_recoveries')
+        logger.debug('Cascade: %r (%.2f) replaced by %r (%.2f)', result[0], result[1], best[0], best[1])
+        return best
+
+    def recognize_burst(self, queue_imgs):
+
+        # Recognize a burst of crops of the same number and vote the digits: the
+        # recognizer reads all of them in one pass, tesseract in one call on the
+        # composite of the crops (one per text line).
+        from .ocrutils import make_composite, vote_readings
+        if self.ocr_backend == 'digits':
+            return vote_readings(self.recognizer.recognize_batch(queue_imgs))
+
+        text, conf = self.recognize(make_composite(queue_imgs), psm=6)
+        return vote_readings([(line, conf) for line in text.splitlines()])
+
+    def recognize(self, queue_img, psm=None):
+
+        # Recognize the crop and return the text alongside with the confidence (0-1).
+        # psm overrides the tesseract page segmentation mode (10: single number).
+        # Use the in-process recognizer if selected: no process spawn involved
+        if self.ocr_backend == 'digits':
+            return self.recognizer.recognize(queue_img)
+
+        # Otherwise use the persistent tesseract engines if available
+        if self.use_tesseract_pool:
+            try:
+                if self.tesseract_pool is None:
+                    self.start_tesseract_pool()
+                return self.tesseract_pool.recognize(queue_img, psm)
+            except (OSError, EOFError, RuntimeError):
+                self.use_tesseract_pool = False
+
+        # Last resort: shell out to the tesseract binary (no confidence available)
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract'
+        q_num = pytesseract.image_to_string(queue_img,
+                                            lang='eng',
+                                            config='--psm {} --oem 3 -c tessedit_char_whitelist=0123456789'.format(psm or 10))
+        return q_num, 1.0
+
     def compute_wait_time(self, cur_queue, last_queue):
 
         # Time needed is based off the percentage of the moving users every 20 secs,
@@ -126,6 +479,10 @@ class LostArkManager():
         if last_queue == '' or cur_queue== '':
             return None
 
+        # Kalman estimator: no fixed refresh assumption, just timestamped readings
+        if self.estimator_type == 'kalman':
+            return self.update_estimate(cur_queue, last_queue)
+
         # Typecast to do operations
         cur_queue = int(cur_queue)
         last_queue = int(last_queue)
@@ -146,38 +503,100 @@ class LostArkManager():
             avg_time = ceil(cur_queue/(delta_decrease*(60/self.delta_t)))
 
             # We reset delta_t to 20 in case has been updated in the other condition
-            self.delta_t = 20
+            self.delta_t = self.refresh
 
             # We assign the cur queue to the last valid queue
             self.last_valid_queue = cur_queue
 
-            # Append the number to the avg times array
-            self.avg_times = np.append(self.avg_times, avg_time)
-
         else:
 
             # If the queue is stuck, we need to increase delta_t to take track of
             # the increased amount of seconds passed without an update in the queue.
-            self.delta_t += 20
+            self.delta_t += self.refresh
 
             # We set avg_time to the last one computed since we cant do an estimate.
             avg_time = self.last_avg_time
 
-            # append to the avg time array
-            self.avg_times = np.append(self.avg_times, avg_time)
-
         # Updating the avg time with the calculated one
         self.last_avg_time = avg_time
 
-        print('Avg time before removing outliers and windowing: {}'.format(self.avg_times))
-        self.avg_times = self.remove_outliers(self.avg_times)
-        print('Avg time after removing outliers and windowing: {}'.format(self.avg_times))
-        print('----------------------------')
+        # Append the number to the avg times window, unless it's an outlier
+        logger.debug('Avg time before removing outliers and windowing: %s + %s', self.avg_times, avg_time)
+        self.remove_outliers(self.avg_times, avg_time)
+        logger.debug('Avg time after removing outliers and windowing: %s', self.avg_times)
+        logger.debug('----------------------------')
 
 
         return round(self.avg_times.mean())
 
 
+    def update_estimate(self, cur_queue, last_queue=None, timestamp=None):
+
+        # Feed the reading to the estimator with his timestamp and OCR confidence:
+        # readings statistically incompatible with the fitted drain are rejected.
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        # On the first call the last queue has never been observed: it was shown
+        # until the server refresh that produced cur_queue, so place it one refresh
+        # period (20 sec) before.
+        if self.estimator.x is None and last_queue not in ('', None):
+            self.estimator.observe(timestamp - 20, int(last_queue), self.last_confidence)
+
+        self.last_estimate = self.estimator.observe(timestamp, int(cur_queue), self.last_confidence)
+        if self.last_estimate.is_outlier:
+            METRICS.count('corrections')
+
+        # Store the estimated drain rate in the history of the server
+        elif self.history is not None and self.estimator.is_ready() and self.last_estimate.rate > 0:
+            self.history.append(self.server, time.time(), round(self.last_estimate.position), self.last_estimate.rate)
+
+        # Return the time left in minutes (None while the drain rate is unknown)
+        if self.last_estimate.eta is None:
+            return None
+
+        return ceil(self.last_estimate.eta/60)
+
+    def get_eta_range(self):
+
+        # 95% confidence interval of the time left in minutes (kalman only)
+        if self.last_estimate is None or self.last_estimate.eta is None:
+            return None
+
+        return int(self.last_estimate.eta_low//60), ceil(self.last_estimate.eta_high/60)
+
+    def get_players_per_minute(self):
+
+        # Players leaving the queue per minute (None if not available yet)
+        if self.estimator_type == 'kalman':
+            if not self.estimator.is_ready():
+                return None
+            return self.estimator.x[1]*60
+
+        # The avg decrease is computed on a 20 sec basis
+        if len(self.avg_queue_decreases) == 0:
+            return None
+        return self.avg_queue_decreases.mean()*3
+
+    def get_corrected_queue(self, cur_queue, last_queue):
+
+        # Queue to display: when the recognition failed ('') or the reading has been
+        # rejected by the estimator, estimate it from the last one.
+        if self.estimator_type == 'kalman':
+            if cur_queue != '' and not (self.last_estimate and self.last_estimate.is_outlier):
+                return cur_queue
+            if cur_queue != '':
+                return round(self.last_estimate.position)
+            position = self.estimator.predict_position(time.monotonic())
+            return None if position is None or not self.estimator.is_ready() else round(position)
+
+        # Legacy: the reading has already been corrected by get_queue_status
+        if cur_queue != '':
+            return cur_queue
+        if last_queue == '' or len(self.avg_queue_decreases) == 0:
+            return None
+        return int(last_queue) - int(self.avg_queue_decreases.mean())
+
     def handle_wrong_pred(self, cur_queue, last_queue):
 
 
@@ -192,8 +611,8 @@ class LostArkManager():
             # the decrease in the queue on 20 sec basis)
             delta_decrease = abs(last_queue - cur_queue)
 
-            # append the value to the array
-            self.avg_queue_decreases = np.append(self.avg_queue_decreases, delta_decrease)
+            # append the value to the window
+            self.avg_queue_decreases.push(delta_decrease)
 
         else:
 
@@ -215,8 +634,8 @@ class LostArkManager():
             # correct range.
             delta_decrease = abs(last_queue - cur_queue)
 
-            print('----------------------------')
-            print('Before correction: Cur {} - Last {} - Delta {} '.format(cur_queue, last_queue, delta_decrease))
+            logger.debug('----------------------------')
+            logger.debug('Before correction: Cur %s - Last %s - Delta %s ', cur_queue, last_queue, delta_decrease)
 
             # If the delta_decrease is lesser than a certain tolerance, that means we
             # have an error
@@ -228,51 +647,34 @@ class LostArkManager():
 
                 # We assign the correct delta_decrease
                 delta_decrease = last_queue - cur_queue
+                METRICS.count('corrections')
 
             # If we're here from the avg time function
             if not is_check:
 
-                # Append the new value to the avg_queue_decreases
-                self.avg_queue_decreases = np.append(self.avg_queue_decreases, delta_decrease)
-
-                # Clean the array from eventual outliers
-                self.avg_queue_decreases = self.remove_outliers(self.avg_queue_decreases)
+                # Append the new value to the avg_queue_decreases, unless it's an outlier
+                self.remove_outliers(self.avg_queue_decreases, delta_decrease)
 
-        print('AVG queue decrease: {}'.format(self.avg_queue_decreases))
-        print('Before correction: Cur {} - Last {} - Delta {} '.format(cur_queue, last_queue, delta_decrease))
+        logger.debug('AVG queue decrease: %s', self.avg_queue_decreases)
+        logger.debug('After correction: Cur %s - Last %s - Delta %s ', cur_queue, last_queue, delta_decrease)
 
         # Once here, we've (hopefully) corrected our values; return everything
         return round(cur_queue), round(last_queue), round(delta_decrease)
 
-    def remove_outliers(self, array):
+    def remove_outliers(self, window, value):
 
         # Removing the outliers given by wrong prediction by tesseract.
-        # We simply achieve that by calculating mean and std of our array,
-        # and then considering values inside the gaussian bell that does not
-        # go further than 4sigma from the mean.
-        # NOTE: We do this only when the queue times contains more than one element.
-        if len(array) != 1:
-
-            # Get mean and std (adding an eps to zero multiplication problem)
-            mean = np.mean(array) + np.finfo(np.float32).eps
-            standard_deviation = np.std(array) + np.finfo(np.float32).eps
-
-            # Compute the distances from the mean
-            distance_from_mean = abs(array - mean)
-
-            # Max deviations are 4sigma from the mean
-            max_deviations = 4
-
-            # Compute the array of boolean that are true only if the condition
-            # (not being away from 2sigma) is respected
-            not_outlier = distance_from_mean < max_deviations * standard_deviation
-
-            # Apply the mask on the time array and return only the last window
-            # (we do not want to calculate the mean on an huge window):
-            # A window is based on the last two minutes queue.
-            return array[not_outlier][-6:]
-
-        else:
-
-            # Else, just returnt the passed array
-            return array
+        # We simply achieve that by calculating mean and std of our window
+        # (including the new value), and then considering values inside the gaussian
+        # bell that does not go further than 4sigma from the mean (max_deviations).
+        # The window keeps only the last 6 samples (two minutes of queue, see
+        # LEGACY_PARAMS), since we do not want to calculate the mean on an huge window.
+        # NOTE: Only the new value needs to be checked: the ones already in the
+        # window passed the same test, and with at most 7 samples (default window) no
+        # sample can be further than 2.3sigma from their mean, so none of them can
+        # become an outlier.
+        # Mean and std are kept updated by the ring buffer, so this costs O(1).
+        if not window.is_outlier(value, self.max_deviations):
+            window.push(value)
+
+        return window
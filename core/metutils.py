@@ -0,0 +1,134 @@
+# Class that takes care of collecting latency histograms and counters of the
+# pipeline stages. Disabled by default: a disabled timer is a shared no-op, and
+# numpy is imported only once the metrics are enabled and used.
+import json
+import time
+import threading
+
+from contextlib import nullcontext
+
+# Histogram bucket upper bounds, in milliseconds (the last bucket is open)
+BUCKETS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+# Shared no-op context manager returned by a disabled timer
+NULL_TIMER = nullcontext()
+
+class StageTimer():
+
+    def __init__(self, metrics, stage):
+
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+class Metrics():
+
+    def __init__(self, enabled=False, window=1024):
+
+        # Every stage keeps the last `window` latencies (seconds) in a preallocated
+        # ring, so the histograms are rolling; the counters are cumulative.
+        self.enabled = enabled
+        self.window = window
+        self.latencies = {}
+        self.totals = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def timer(self, stage):
+
+        # Context manager timing a stage: with metrics.timer('ocr'): ...
+        if not self.enabled:
+            return NULL_TIMER
+
+        return StageTimer(self, stage)
+
+    def observe(self, stage, seconds):
+
+        # Store a latency in the ring of the stage (no-op when disabled)
+        if not self.enabled:
+            return
+
+        import numpy as np
+        with self.lock:
+            if stage not in self.latencies:
+                self.latencies[stage] = np.zeros(self.window)
+                self.totals[stage] = 0
+            self.latencies[stage][self.totals[stage] % self.window] = seconds
+            self.totals[stage] += 1
+
+    def count(self, name, n=1):
+
+        # Increment a counter (no-op when disabled)
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+
+        # Build a JSON serializable snapshot: for every stage the total count and
+        # the rolling histogram, mean and percentiles (milliseconds).
+        import numpy as np
+        with self.lock:
+            stages = {}
+            for stage, ring in self.latencies.items():
+                times = ring[:min(self.totals[stage], self.window)] * 1000
+                counts, _ = np.histogram(times, bins=[0] + BUCKETS_MS + [np.inf])
+                stages[stage] = {
+                    'count': self.totals[stage],
+                    'mean_ms': float(times.mean()),
+                    'p50_ms': float(np.percentile(times, 50)),
+                    'p95_ms': float(np.percentile(times, 95)),
+                    'max_ms': float(times.max()),
+                    'histogram': {'le_{}'.format(b): int(c) for b, c in zip(BUCKETS_MS + ['inf'], counts)},
+                }
+
+            return {'timestamp': time.time(), 'stages': stages, 'counters': dict(self.counters)}
+
+    def dump(self, path):
+
+        # Write the snapshot to a JSON file
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def serve(self, port=9123, host='127.0.0.1'):
+
+        # Expose the snapshot as JSON on a local http endpoint (GET /metrics), served
+        # from a daemon thread.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return self.server.server_address
+
+# Process wide metrics, enabled by the overlay with --metrics
+METRICS = Metrics()
@@ -0,0 +1,54 @@
+# Class that takes care of discovering every game client running on the machine,
+# and of giving each one his own queue tracker.
+import logging
+
+from .lautils import LostArkManager
+from .trackutils import QueueTracker
+
+logger = logging.getLogger('lostqueue')
+
+class QueueMonitor():
+
+    def __init__(self, screen_res, name='lost ark', ocr_backend='auto', estimator='kalman',
+                 wman=None, rescan_interval=10.0, burst_size=1, history=None, server='default'):
+
+        # The engine manager owns the capture, preprocessing and OCR engines: every
+        # client manager is built on them (see LostArkManager.share_engines), and keeps
+        # only his estimator. The clients are captured one after the other by the
+        # pipeline thread, so adding a client does not add threads or engines.
+        self.screen_res = screen_res
+        self.name = name
+        self.estimator = estimator
+        self.rescan_interval = rescan_interval
+        self.burst_size = burst_size
+        self.history = history
+        self.server = server
+        self.engine = LostArkManager(screen_res, ocr_backend=ocr_backend, estimator=estimator, wman=wman)
+
+        # Trackers of the clients being monitored, by window handle
+        self.trackers = {}
+        self.next_client = 1
+
+    def scan(self):
+
+        # Look for the game windows: returns the trackers of the new clients and the
+        # ones of the clients whose window has been closed.
+        hwnds = [hwnd for hwnd, _ in self.engine.wman.find_processes(self.name)]
+
+        added = []
+        for hwnd in hwnds:
+            if hwnd not in self.trackers:
+                lamanager = LostArkManager(self.screen_res, estimator=self.estimator, window=hwnd, engines=self.engine)
+                lamanager.burst_size = self.burst_size
+                if self.history is not None:
+                    lamanager.use_history(self.history, self.server)
+                self.trackers[hwnd] = QueueTracker(lamanager, client=self.next_client)
+                self.next_client += 1
+                added.append(self.trackers[hwnd])
+                logger.debug('Client %s found (window %s)', self.trackers[hwnd].client, hwnd)
+
+        removed = [self.trackers.pop(hwnd) for hwnd in list(self.trackers) if hwnd not in hwnds]
+        for tracker in removed:
+            logger.debug('Client %s closed', tracker.client)
+
+        return added, removed
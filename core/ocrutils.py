@@ -0,0 +1,510 @@
+# Class that takes care of recognizing the queue digits without spawning Tesseract.
+import os
+import re
+import cv2
+import time
+import hashlib
+import numpy as np
+
+from collections import Counter, OrderedDict
+
+# Folder containing the trained templates, one file for each supported resolution
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'digits')
+
+class DigitRecognizer():
+
+    def __init__(self, screen_h, templates_dir=TEMPLATES_DIR):
+
+        # Every glyph is normalized into a fixed size box before being compared
+        # with the templates: (w, h) in opencv order.
+        self.screen_h = screen_h
+        self.glyph_size = (12, 18)
+        self.templates_path = os.path.join(templates_dir, '{}p.npz'.format(screen_h))
+
+        # Try to load the trained templates for the current resolution: if they're
+        # not available we bootstrap them by rendering the digits with an opencv font.
+        self.is_trained = os.path.isfile(self.templates_path)
+        if self.is_trained:
+            self.templates = np.load(self.templates_path)['templates']
+        else:
+            self.templates = self.__render_templates()
+
+    def __render_templates(self):
+
+        # Render the ten digits white on black with the opencv font, then
+        # segment and normalize them exactly like a real crop.
+        glyphs = []
+        for digit in '0123456789':
+            canvas = np.zeros((60, 40), dtype=np.uint8)
+            cv2.putText(canvas, digit, (5, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 255, 3)
+            glyphs.append(self.normalize_glyph(canvas > 0))
+
+        return np.stack(glyphs)
+
+    def get_foreground(self, queue_img):
+
+        # The crop coming from get_queue_image is binarized with the inverse
+        # threshold: digits are black (0) on a white background. The 4k crop
+        # still has three channels, so we collapse them first.
+        if queue_img.ndim == 3:
+            queue_img = queue_img.max(axis=2)
+
+        return queue_img < 128
+
+    def segment(self, queue_img):
+
+        # Find the connected components of the foreground: every digit of the
+        # queue font is a single blob.
+        fg = self.get_foreground(queue_img)
+        n, _, stats, _ = cv2.connectedComponentsWithStats(fg.view(np.uint8), connectivity=8)
+
+        # Discard the background (label 0) and the noise: a glyph must be at least
+        # half as tall as the tallest blob found and have a minimum area.
+        stats = stats[1:]
+        if len(stats) == 0:
+            return fg, []
+
+        heights = stats[:, cv2.CC_STAT_HEIGHT]
+        keep = (heights >= 0.5*heights.max()) & (stats[:, cv2.CC_STAT_AREA] >= 4)
+        stats = stats[keep]
+
+        # Sort the boxes from left to right and merge the ones overlapping on the
+        # x axis (broken glyphs after binarization).
+        boxes = []
+        for x, y, w, h, _ in sorted(stats.tolist()):
+            if boxes and x < boxes[-1][0] + boxes[-1][2]:
+                bx, by, bw, bh = boxes[-1]
+                x0, y0 = min(bx, x), min(by, y)
+                x1, y1 = max(bx+bw, x+w), max(by+bh, y+h)
+                boxes[-1] = [x0, y0, x1-x0, y1-y0]
+            else:
+                boxes.append([x, y, w, h])
+
+        return fg, boxes
+
+    def normalize_glyph(self, glyph):
+
+        # Crop the glyph to his bounding box, resize it to the fixed glyph size
+        # and make it zero mean, unit norm: the dot product with a template is then
+        # the normalized cross correlation.
+        ys, xs = np.nonzero(glyph)
+        glyph = glyph[ys.min():ys.max()+1, xs.min():xs.max()+1].astype(np.float32)
+        glyph = cv2.resize(glyph, self.glyph_size, interpolation=cv2.INTER_AREA).ravel()
+        glyph -= glyph.mean()
+
+        return glyph / (np.linalg.norm(glyph) + np.finfo(np.float32).eps)
+
+    def recognize(self, queue_img):
+
+        # Recognize a single crop: returns (text, confidence)
+        return self.recognize_batch([queue_img])[0]
+
+    def recognize_batch(self, queue_imgs):
+
+        # Segment every crop and build a single matrix with the normalized glyphs of
+        # all of them, remembering the crop each glyph belongs to.
+        glyphs, owners = [], []
+        for i, queue_img in enumerate(queue_imgs):
+            fg, boxes = self.segment(queue_img)
+            glyphs.extend(self.normalize_glyph(fg[y:y+h, x:x+w]) for x, y, w, h in boxes)
+            owners.extend([i] * len(boxes))
+
+        results = [('', 0.0)] * len(queue_imgs)
+        if len(glyphs) == 0:
+            return results
+
+        # Correlate every glyph with every template in a single product and pick the
+        # best digit. The confidence of a number is the one of his worst digit.
+        scores = np.stack(glyphs) @ self.templates.T
+        digits = scores.argmax(axis=1)
+        best = scores[np.arange(len(digits)), digits]
+        owners = np.array(owners)
+        for i in range(len(queue_imgs)):
+            mask = owners == i
+            if mask.any():
+                results[i] = (''.join(str(d) for d in digits[mask]), float(best[mask].min()))
+
+        return results
+
+    def fit(self, crops, labels):
+
+        # Train the templates from labelled crops: every glyph found in a crop is
+        # accumulated into the template of his digit. Crops where the number of
+        # segmented glyphs does not match the label are skipped.
+        sums = np.zeros_like(self.templates)
+        counts = np.zeros(10)
+        for crop, label in zip(crops, labels):
+            fg, boxes = self.segment(crop)
+            if len(boxes) != len(label):
+                continue
+
+            for (x, y, w, h), digit in zip(boxes, label):
+                sums[int(digit)] += self.normalize_glyph(fg[y:y+h, x:x+w])
+                counts[int(digit)] += 1
+
+        # Keep the rendered template for the digits never seen in the crops
+        seen = counts > 0
+        templates = sums[seen] / counts[seen][:, None]
+        templates -= templates.mean(axis=1, keepdims=True)
+        self.templates[seen] = templates / np.linalg.norm(templates, axis=1, keepdims=True)
+        self.is_trained = True
+
+        return int(counts.sum())
+
+    def save(self):
+
+        # Persist the templates for the current resolution
+        os.makedirs(os.path.dirname(self.templates_path), exist_ok=True)
+        np.savez_compressed(self.templates_path, templates=self.templates)
+
+
+def make_composite(queue_imgs, gap=None):
+
+    # Stack the binarized crops of a burst into a single image, one per text line,
+    # separated by white rows: a single OCR call (page segmentation as a block)
+    # reads all of them.
+    h = queue_imgs[0].shape[0]
+    gap = np.full((gap or h//2,) + queue_imgs[0].shape[1:], 255, dtype=np.uint8)
+    rows = [gap]
+    for queue_img in queue_imgs:
+        rows.extend([queue_img, gap])
+
+    return np.concatenate(rows)
+
+def vote_readings(readings):
+
+    # Combine the readings (text, confidence) of a burst of crops of the same number
+    # into one, by majority: first on the number of digits, then digit by digit,
+    # every reading weighting his vote with his confidence. The confidence of the
+    # result is the mean confidence of the voters, scaled by the share of the votes
+    # of the least agreed digit and by the share of readings with the voted length.
+    # Unreadable crops do not vote.
+    readings = [(re.sub(r'\D', '', text), conf) for text, conf in readings]
+    readings = [(text, max(conf, 1e-3)) for text, conf in readings if text]
+    if not readings:
+        return '', 0.0
+
+    length = Counter(len(text) for text, _ in readings).most_common(1)[0][0]
+    voters = [(text, conf) for text, conf in readings if len(text) == length]
+
+    digits, agreement = [], 1.0
+    for i in range(length):
+        votes = Counter()
+        for text, conf in voters:
+            votes[text[i]] += conf
+        digit, weight = votes.most_common(1)[0]
+        digits.append(digit)
+        agreement = min(agreement, weight / sum(votes.values()))
+
+    confidence = sum(conf for _, conf in voters) / len(voters)
+    return ''.join(digits), float(confidence * agreement * len(voters) / len(readings))
+
+class OCRCache():
+
+    def __init__(self, size=32, max_distance=2):
+
+        # Bounded LRU of the recognized crops: the key is the exact hash of the crop
+        # bytes, the value is (perceptual hash, recognition result).
+        self.size = size
+        self.max_distance = max_distance
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_keys(self, queue_img):
+
+        # Exact hash of the crop (shape included, so two resolutions never collide)
+        exact = hashlib.blake2b(queue_img.tobytes(), digest_size=16)
+        exact.update(str(queue_img.shape).encode())
+
+        # Perceptual hash: the crop downsampled to 32x16 and binarized, packed into
+        # a 512 bits integer. Crops differing only by a few noisy pixels map to
+        # (almost) the same bits, while two different numbers are several bits apart
+        # (coarser grids make some numbers collide).
+        small = queue_img if queue_img.ndim == 2 else queue_img.max(axis=2)
+        small = cv2.resize(small, (32, 16), interpolation=cv2.INTER_AREA) > 127
+        perceptual = int.from_bytes(np.packbits(small).tobytes(), 'big')
+
+        return exact.digest(), perceptual
+
+    def get(self, queue_img):
+
+        # Look for the crop in the cache: returns (result or None, keys). The keys must
+        # be passed back to put on a miss, to avoid hashing twice.
+        keys = self.get_keys(queue_img)
+        exact, perceptual = keys
+
+        # Byte identical crop
+        if exact in self.entries:
+            self.entries.move_to_end(exact)
+            self.hits += 1
+            return self.entries[exact][1], keys
+
+        # Perceptually identical crop: compare the hamming distance with the recent
+        # entries, from the most recent one.
+        for key in reversed(self.entries):
+            p_hash, result = self.entries[key]
+            if bin(p_hash ^ perceptual).count('1') <= self.max_distance:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result, keys
+
+        self.misses += 1
+        return None, keys
+
+    def put(self, keys, result):
+
+        # Insert the result and evict the least recently used entry if full
+        exact, perceptual = keys
+        self.entries[exact] = (perceptual, result)
+        self.entries.move_to_end(exact)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get_stats(self):
+
+        # Hits are OCR calls saved
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                'hit_rate': self.hits / total if total else 0.0}
+
+
+# Persistent tesseract engines. Every engine lives in his own worker process that
+# loads the tesseract library (through the C API) and the language data only once,
+# then receives the crops to recognize over a pipe. A crash of the engine only kills
+# the worker, which gets restarted by the pool.
+TESSERACT_DIR = r'C:\Program Files\Tesseract-OCR'
+TESSERACT_LIBS = ['libtesseract-5.dll', 'libtesseract-4.dll', 'libtesseract-5.so', 'libtesseract.so.5', 'libtesseract.so.4']
+
+def find_tesseract_lib(tesseract_dir=TESSERACT_DIR):
+
+    # Look for the library in the tesseract install folder first, then let
+    # ctypes search it in the system paths.
+    import ctypes.util
+    for name in TESSERACT_LIBS:
+        path = os.path.join(tesseract_dir, name)
+        if os.path.isfile(path):
+            return path
+
+    return ctypes.util.find_library('tesseract') or ctypes.util.find_library('libtesseract-5')
+
+class TesseractAPI():
+
+    def __init__(self, lib_path, datapath=None, lang='eng', psm=10, oem=3, whitelist='0123456789'):
+
+        import ctypes
+        self.ctypes = ctypes
+
+        # Declare the signatures of the C API functions we use
+        lib = ctypes.CDLL(lib_path)
+        lib.TessBaseAPICreate.restype = ctypes.c_void_p
+        lib.TessBaseAPIInit2.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+        lib.TessBaseAPISetVariable.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+        lib.TessBaseAPISetPageSegMode.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.TessBaseAPISetImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p] + [ctypes.c_int]*4
+        lib.TessBaseAPIGetUTF8Text.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p
+        lib.TessBaseAPIMeanTextConf.argtypes = [ctypes.c_void_p]
+        lib.TessDeleteText.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIEnd.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIDelete.argtypes = [ctypes.c_void_p]
+        self.lib = lib
+
+        # Create the engine and load the language data: this is the expensive part
+        # that the command line pays on every call.
+        self.handle = lib.TessBaseAPICreate()
+        datapath = datapath.encode() if datapath else None
+        if lib.TessBaseAPIInit2(self.handle, datapath, lang.encode(), oem) != 0:
+            raise RuntimeError('Failed to initialize tesseract with language {}'.format(lang))
+
+        # Set the digits configuration once
+        self.psm = psm
+        lib.TessBaseAPISetPageSegMode(self.handle, psm)
+        lib.TessBaseAPISetVariable(self.handle, b'tessedit_char_whitelist', whitelist.encode())
+
+    def recognize(self, img, psm=None):
+
+        # Page segmentation mode for this image only (ie: 6 to read a composite of
+        # several crops as a block of lines)
+        if psm is not None:
+            self.lib.TessBaseAPISetPageSegMode(self.handle, psm)
+        try:
+            return self.__recognize(img)
+        finally:
+            if psm is not None:
+                self.lib.TessBaseAPISetPageSegMode(self.handle, self.psm)
+
+    def __recognize(self, img):
+
+        # Tesseract reads the pixels in place: assure the buffer is contiguous
+        img = np.ascontiguousarray(img)
+        h, w = img.shape[:2]
+        bpp = 1 if img.ndim == 2 else img.shape[2]
+        self.lib.TessBaseAPISetImage(self.handle, img.ctypes.data, w, h, bpp, img.strides[0])
+
+        # Fetch the text and the mean confidence (0-100), then release the string
+        ptr = self.lib.TessBaseAPIGetUTF8Text(self.handle)
+        text = self.ctypes.string_at(ptr).decode('utf-8') if ptr else ''
+        if ptr:
+            self.lib.TessDeleteText(ptr)
+        conf = self.lib.TessBaseAPIMeanTextConf(self.handle)
+
+        return text, conf / 100
+
+    def close(self):
+
+        self.lib.TessBaseAPIEnd(self.handle)
+        self.lib.TessBaseAPIDelete(self.handle)
+
+def tesseract_worker(conn, lib_path, datapath):
+
+    # Worker process loop: init the engine once, then serve the requests: an image,
+    # or a tuple (image, page segmentation mode). A None request is a health check
+    # (ping), answered with the string 'pong'.
+    api = TesseractAPI(lib_path, datapath)
+    conn.send('ready')
+    while True:
+        try:
+            img = conn.recv()
+        except EOFError:
+            break
+
+        if img is None:
+            conn.send('pong')
+        elif isinstance(img, tuple):
+            conn.send(api.recognize(*img))
+        else:
+            conn.send(api.recognize(img))
+
+    api.close()
+
+class TesseractEngine():
+
+    def __init__(self, lib_path, datapath=None, timeout=5):
+
+        self.lib_path = lib_path
+        self.datapath = datapath
+        self.timeout = timeout
+        self.last_used = 0.0
+        self.restarts = -1
+        self.process = None
+        self.start()
+
+    def start(self):
+
+        import multiprocessing
+
+        # Kill the old worker (if any) and spawn a new one
+        self.stop()
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=tesseract_worker,
+                                               args=(child_conn, self.lib_path, self.datapath),
+                                               daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.restarts += 1
+
+        # Wait for the engine to be loaded: a worker dying at init closes the pipe
+        try:
+            ready = self.conn.poll(self.timeout * 6) and self.conn.recv() == 'ready'
+        except EOFError:
+            ready = False
+
+        if not ready:
+            self.stop()
+            raise RuntimeError('Tesseract worker failed to start')
+
+    def stop(self):
+
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+            self.process = None
+
+    def request(self, msg):
+
+        # Send a message and wait for the answer: a dead worker or a timeout
+        # raise an error.
+        self.conn.send(msg)
+        if not self.conn.poll(self.timeout):
+            raise TimeoutError('Tesseract worker did not answer in {} sec'.format(self.timeout))
+        self.last_used = time.monotonic()
+
+        return self.conn.recv()
+
+    def is_healthy(self):
+
+        # Health check: the process must be alive and answer to a ping
+        try:
+            return self.process is not None and self.process.is_alive() and self.request(None) == 'pong'
+        except (OSError, EOFError, TimeoutError):
+            return False
+
+    def recognize(self, img, psm=None):
+
+        # Recognize the image: on crash (broken pipe, timeout) restart the worker
+        # and retry once. A worker crashing again is reported as a RuntimeError,
+        # like one failing to start.
+        msg = img if psm is None else (img, psm)
+        try:
+            return self.request(msg)
+        except (OSError, EOFError):
+            self.start()
+        try:
+            return self.request(msg)
+        except (OSError, EOFError) as e:
+            raise RuntimeError('Tesseract worker crashed twice') from e
+
+class TesseractPool():
+
+    def __init__(self, size=1, lib_path=None, datapath=None, check_after=30):
+
+        import queue
+
+        # Find the tesseract library: without it the pool can't work
+        lib_path = lib_path or find_tesseract_lib()
+        if not lib_path:
+            raise OSError('Tesseract library not found')
+        if datapath is None and os.path.isdir(os.path.join(TESSERACT_DIR, 'tessdata')):
+            datapath = os.path.join(TESSERACT_DIR, 'tessdata')
+
+        # Start the engines and put them in the idle queue. An engine idle for more
+        # than check_after seconds is health checked when borrowed: a worker wedged
+        # while waiting is replaced before his request times out.
+        self.check_after = check_after
+        self.engines = [TesseractEngine(lib_path, datapath) for _ in range(size)]
+        self.idle = queue.Queue()
+        for engine in self.engines:
+            self.idle.put(engine)
+
+    def recognize(self, img, psm=None):
+
+        # Borrow an idle engine (blocking if all of them are busy) and give it
+        # back once done.
+        engine = self.idle.get()
+        try:
+            if time.monotonic() - engine.last_used > self.check_after and not engine.is_healthy():
+                engine.start()
+            return engine.recognize(img, psm)
+        finally:
+            self.idle.put(engine)
+
+    def check(self):
+
+        # Restart every idle engine not passing the health check, and return the
+        # number of restarts done.
+        restarted = 0
+        for _ in range(len(self.engines)):
+            engine = self.idle.get()
+            if not engine.is_healthy():
+                engine.start()
+                restarted += 1
+            self.idle.put(engine)
+
+        return restarted
+
+    def close(self):
+
+        for engine in self.engines:
+            engine.stop()
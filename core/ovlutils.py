@@ -0,0 +1,116 @@
+# Classes that take care of the low overhead rendering of the overlay: a background
+# painted from pre-scaled cached pixmaps instead of a stylesheet border-image, and
+# the counters of the repaints and of the CPU time spent by the overlay.
+import time
+import logging
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtWidgets import QWidget
+from .metutils import METRICS
+
+logger = logging.getLogger('lostqueue')
+
+# Background pixmaps already scaled, by (path, width, height, device pixel ratio):
+# a resize back to a known size (ie: a client row added then removed) costs nothing.
+PIXMAPS = {}
+
+def get_background(path, w, h, ratio=1.0, radius=20):
+
+    # Background image scaled to the size once, with his rounded corners cut out
+    # (transparent), so that painting it is a plain copy.
+    key = (path, w, h, ratio)
+    if key not in PIXMAPS:
+        image = QtGui.QPixmap(path).scaled(int(w*ratio), int(h*ratio), QtCore.Qt.IgnoreAspectRatio,
+                                           QtCore.Qt.SmoothTransformation)
+        pixmap = QtGui.QPixmap(int(w*ratio), int(h*ratio))
+        pixmap.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        clip = QtGui.QPainterPath()
+        clip.addRoundedRect(QtCore.QRectF(0, 0, w*ratio, h*ratio), radius*ratio, radius*ratio)
+        painter.setClipPath(clip)
+        painter.drawPixmap(0, 0, image)
+        painter.end()
+        pixmap.setDevicePixelRatio(ratio)
+        PIXMAPS[key] = pixmap
+
+    return PIXMAPS[key]
+
+def get_rounded_mask(w, h, radius=20):
+
+    # Window shape with rounded corners: an opaque window clipped by a mask is
+    # composited by the system as a plain rectangle copy, unlike a translucent one.
+    path = QtGui.QPainterPath()
+    path.addRoundedRect(QtCore.QRectF(0, 0, w, h), radius, radius)
+    return QtGui.QRegion(path.toFillPolygon().toPolygon())
+
+class BackgroundFrame(QWidget):
+
+    def __init__(self, path, parent=None, radius=20):
+        super(BackgroundFrame, self).__init__(parent)
+
+        # The pixmap of the current size is fetched on resize only
+        self.path = path
+        self.radius = radius
+        self.pixmap = None
+
+    def resizeEvent(self, event):
+
+        self.pixmap = get_background(self.path, self.width(), self.height(), self.devicePixelRatioF(), self.radius)
+        super(BackgroundFrame, self).resizeEvent(event)
+
+    def paintEvent(self, event):
+
+        # Copy only the damaged part of the cached pixmap
+        if self.pixmap is None:
+            return
+        painter = QtGui.QPainter(self)
+        rect = event.rect()
+        ratio = self.pixmap.devicePixelRatio()
+        painter.drawPixmap(rect, self.pixmap, QtCore.QRect(int(rect.x()*ratio), int(rect.y()*ratio),
+                                                          int(rect.width()*ratio), int(rect.height()*ratio)))
+        painter.end()
+
+class OverlayStats(QtCore.QObject):
+
+    def __init__(self, widgets, interval=60.0, parent=None):
+        super(OverlayStats, self).__init__(parent)
+
+        # Paint events of the watched widgets, and CPU time of the GUI thread (where
+        # the overlay runs: capture and OCR are on the pipeline thread), reported
+        # once per interval as rates per minute.
+        self.interval = interval
+        self.repaints = 0
+        self.repaints_per_minute = 0.0
+        self.cpu_ms_per_minute = 0.0
+        self.last_cpu = time.thread_time()
+        self.last_wall = time.monotonic()
+        for widget in widgets:
+            self.watch(widget)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.report)
+        self.timer.start(int(interval * 1000))
+
+    def watch(self, widget):
+
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+
+        if event.type() == QtCore.QEvent.Paint:
+            self.repaints += 1
+        return False
+
+    def report(self):
+
+        # Rates over the elapsed interval, must run on the GUI thread
+        cpu, wall = time.thread_time(), time.monotonic()
+        minutes = max(wall - self.last_wall, 1e-6) / 60
+        self.repaints_per_minute = self.repaints / minutes
+        self.cpu_ms_per_minute = (cpu - self.last_cpu) * 1000 / minutes
+        METRICS.count('overlay_repaints', self.repaints)
+        METRICS.observe('overlay_cpu', cpu - self.last_cpu)
+        logger.debug('Overlay: %.1f repaints/min, %.1f ms CPU/min', self.repaints_per_minute, self.cpu_ms_per_minute)
+        self.repaints = 0
+        self.last_cpu, self.last_wall = cpu, wall
@@ -0,0 +1,66 @@
+# Class that takes care of running the queue pipeline of one or more game clients
+# (see trackutils) in a background thread, off the Qt GUI thread.
+import time
+import threading
+
+from PyQt5 import QtCore
+from .trackutils import QueueResult, QueueTracker, TrackerGroup
+
+class QueuePipeline(QtCore.QThread):
+
+    # Signal carrying a QueueResult to the GUI thread
+    result_ready = QtCore.pyqtSignal(object)
+
+    def __init__(self, lamanager=None, scheduler=None, parent=None, monitor=None, publisher=None):
+        super(QueuePipeline, self).__init__(parent)
+
+        # A single thread drives the trackers of every client: either the one of the
+        # given manager, or the ones discovered by the monitor. Their results are
+        # published to the readers of the status server, if any.
+        trackers = [QueueTracker(lamanager, scheduler)] if lamanager is not None else []
+        self.group = TrackerGroup(trackers, monitor, publisher)
+
+        # Condition the worker waits on until the next scheduled capture, notified
+        # when the pipeline is stopped. Frames are captured only when due, after the
+        # previous one has been processed: a slow frame delays the next capture
+        # instead of queueing stale ones.
+        self.cond = threading.Condition()
+        self.running = True
+
+    @property
+    def trackers(self):
+
+        return self.group.trackers
+
+    def fetch_initial(self):
+
+        # Fetch the initial queue status of the clients: returns the one of the
+        # first client ('' if none). Must be called before starting the thread.
+        return self.group.fetch_initial()
+
+    def stop(self):
+
+        # Stop the worker, wait for it to finish the current frame and release the
+        # capture sessions
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.wait()
+        self.group.close()
+
+    def run(self):
+
+        # Worker loop: wait for the next scheduled capture of any client, process
+        # the frames due and post the results
+        while True:
+            with self.cond:
+                while self.running:
+                    timeout = self.group.get_next_wakeup() - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self.cond.wait(timeout if timeout != float('inf') else None)
+                if not self.running:
+                    return
+
+            for _, result in self.group.step():
+                self.result_ready.emit(result)
@@ -0,0 +1,87 @@
+# Functions that take care of loading the capture, OCR and audio backends lazily:
+# the module of a backend is imported only when the backend is first requested,
+# and the default backend of every kind is selected from the platform.
+import os
+import sys
+import ctypes.util
+import importlib
+import importlib.util
+
+# Backends of every kind: name -> ('module:attribute', platforms). The platforms are
+# sys.platform prefixes (None: any platform).
+BACKENDS = {
+    'capture': {
+        'win32': ('.wutils:WindowsManager', ('win32',)),
+        'x11': ('.xutils:X11Manager', ('linux', 'freebsd')),
+        'session': ('.recutils:SessionSource', None),
+        'synthetic': ('.synutils:SyntheticSource', None),
+    },
+    'ocr': {
+        'digits': ('.ocrutils:DigitRecognizer', None),
+        'tesseract': ('.ocrutils:TesseractPool', None),
+    },
+    'audio': {
+        'winsound': ('.audutils:play_winsound', ('win32',)),
+        'playsound': ('.audutils:play_playsound', None),
+        'null': ('.audutils:play_null', None),
+    },
+}
+
+# Candidates for the default backend of every kind, by preference: the first one
+# available is used (the session and synthetic captures are never a default).
+DEFAULTS = {
+    'capture': ['win32', 'x11'],
+    'ocr': ['digits'],
+    'audio': ['winsound', 'playsound', 'null'],
+}
+
+# Third party modules a backend needs, checked (not imported) to pick the default
+REQUIRES = {
+    ('capture', 'win32'): ['win32gui', 'win32ui'],
+    ('audio', 'playsound'): ['playsound'],
+}
+
+# Shared libraries (ctypes names) and environment variables a backend needs
+LIBRARIES = {
+    ('capture', 'x11'): ['X11', 'Xext'],
+}
+ENVIRON = {
+    ('capture', 'x11'): ['DISPLAY'],
+}
+
+# Backends already loaded
+LOADED = {}
+
+def is_supported(kind, name):
+
+    # Check if the backend runs on this platform and his dependencies are installed
+    _, platforms = BACKENDS[kind][name]
+    if platforms is not None and not sys.platform.startswith(platforms):
+        return False
+
+    if not all(os.environ.get(variable) for variable in ENVIRON.get((kind, name), [])):
+        return False
+    if not all(ctypes.util.find_library(library) for library in LIBRARIES.get((kind, name), [])):
+        return False
+
+    return all(importlib.util.find_spec(module) is not None for module in REQUIRES.get((kind, name), []))
+
+def get_backend(kind, name=None):
+
+    # Load (on first use) and return a backend: the given one, or the default one
+    # of the platform. Raises ValueError for an unknown backend and ImportError if
+    # no backend of the kind is available.
+    if name is None:
+        available = [name for name in DEFAULTS[kind] if is_supported(kind, name)]
+        if not available:
+            raise ImportError('No {} backend available on {}'.format(kind, sys.platform))
+        name = available[0]
+
+    if name not in BACKENDS[kind]:
+        raise ValueError('Unknown {} backend: {}'.format(kind, name))
+
+    if (kind, name) not in LOADED:
+        module, attribute = BACKENDS[kind][name][0].split(':')
+        LOADED[(kind, name)] = getattr(importlib.import_module(module, __package__), attribute)
+
+    return LOADED[(kind, name)]
@@ -0,0 +1,127 @@
+# Class that takes care of binarizing the queue regions before the OCR, following
+# a declarative profile for each resolution.
+import cv2
+import numpy as np
+from .metutils import METRICS
+
+# Preprocessing profile for each supported resolution height:
+# - gray: convert to grayscale before the threshold (otherwise every channel is
+#   thresholded on his own, and the output keeps three channels)
+# - dilate: (rows, cols) of the dilation applied before the threshold, None to skip
+# - threshold: pixels brighter than this become black (0), the others white (255)
+# Resolutions without a profile (calibrated ones) use the default profile.
+PREPROCESS_PROFILES = {
+    720: {'gray': True, 'dilate': (2, 1), 'threshold': 60},
+    1080: {'gray': True, 'dilate': (2, 1), 'threshold': 60},
+    1440: {'gray': True, 'dilate': (2, 1), 'threshold': 60},
+    # 4k: binarize without dilating, quality is good enough.
+    2160: {'gray': False, 'dilate': None, 'threshold': 127},
+}
+DEFAULT_PROFILE = {'gray': True, 'dilate': (2, 1), 'threshold': 60}
+
+# Alternative recipes tried when the reading of the profile one is not confident
+# (see LostArkManager.recognize_cascade): the former plain threshold at 90, a higher
+# threshold for bright or blurred frames, a lower one for faint digits.
+PREPROCESS_VARIANTS = [
+    {'gray': True, 'dilate': None, 'threshold': 90},
+    {'gray': True, 'dilate': (2, 1), 'threshold': 110},
+    {'gray': True, 'dilate': None, 'threshold': 40},
+]
+
+class Preprocessor():
+
+    def __init__(self, gray=True, dilate=(2, 1), threshold=60):
+
+        # Everything that does not depend on the frame is computed once:
+        # - the inverse threshold as a 256 entries lookup table
+        # - the morphology kernel. The threshold being inverse and monotonic,
+        #   dilating and then thresholding is the same as thresholding and then
+        #   eroding with the same kernel: the table is applied straight after the
+        #   grayscale conversion and the erosion runs on the binary image.
+        self.gray = gray
+        self.threshold = threshold
+        self.lut = np.where(np.arange(256) > threshold, 0, 255).astype(np.uint8)
+        self.kernel = None if dilate is None else np.ones(dilate, dtype=np.uint8)
+
+        # Output buffers for each input shape, allocated on the first frame: the
+        # hot path does not allocate.
+        self.buffers = {}
+        self.stacks = {}
+
+    @classmethod
+    def for_resolution(cls, screen_h):
+
+        # Preprocessor of the profile of the resolution height
+        return cls(**PREPROCESS_PROFILES.get(screen_h, DEFAULT_PROFILE))
+
+    def get_buffers(self, shape):
+
+        # (converted, binary, output) buffers for the input shape: the stacks of
+        # regions are processed as a single tall image of N*h rows.
+        if shape not in self.buffers:
+            rows, w = int(np.prod(shape[:-2])), shape[-2]
+            channels = () if self.gray else (3,)
+            converted = np.empty((rows, w) + channels, dtype=np.uint8)
+            binary = np.empty_like(converted)
+            output = np.empty_like(converted) if self.kernel is not None else binary
+            self.buffers[shape] = (converted, binary, output)
+
+        return self.buffers[shape]
+
+    def get_stack(self, n, shape):
+
+        # Preallocated (n, h, w, channels) stack where a burst of regions is copied
+        # before process_batch
+        key = (n,) + tuple(shape)
+        if key not in self.stacks:
+            self.stacks[key] = np.empty(key, dtype=np.uint8)
+
+        return self.stacks[key]
+
+    def get_conversion(self, channels):
+
+        # Color conversion of the input (BGRX from the capture, BGR if recorded)
+        if self.gray:
+            return cv2.COLOR_BGRA2GRAY if channels == 4 else cv2.COLOR_BGR2GRAY
+        return cv2.COLOR_BGRA2BGR if channels == 4 else None
+
+    def process(self, region):
+
+        # Binarize a region (h, w, 3|4): the digits come out black on white. The
+        # returned image is a buffer reused by the next call with the same shape:
+        # copy it to keep it.
+        converted, binary, output = self.get_buffers(region.shape)
+        self.__binarize(region.reshape(converted.shape[:2] + region.shape[-1:]), converted, binary)
+
+        if self.kernel is not None:
+            cv2.erode(binary, self.kernel, dst=output)
+
+        return output
+
+    def process_batch(self, regions):
+
+        # Binarize a stack of regions (N, h, w, 3|4) in one call: the pointwise steps
+        # run once on the whole stack, the erosion on every region, so that it does
+        # not leak across the region borders. Returns a (N, h, w[, 3]) buffer reused
+        # by the next call with the same shape.
+        n, h = regions.shape[:2]
+        converted, binary, output = self.get_buffers(regions.shape)
+        self.__binarize(regions.reshape(converted.shape[:2] + regions.shape[-1:]), converted, binary)
+
+        if self.kernel is not None:
+            for i in range(n):
+                cv2.erode(binary[i*h:(i+1)*h], self.kernel, dst=output[i*h:(i+1)*h])
+
+        return output.reshape((n, h) + output.shape[1:])
+
+    def __binarize(self, image, converted, binary):
+
+        # Convert the colors in place (timed on his own: 'convert' is part of the
+        # 'threshold' stage) and apply the threshold table
+        code = self.get_conversion(image.shape[-1])
+        with METRICS.timer('convert'):
+            if code is None:
+                converted[...] = image
+            else:
+                cv2.cvtColor(image, code, dst=converted)
+        cv2.LUT(converted, self.lut, dst=binary)
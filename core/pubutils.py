@@ -0,0 +1,103 @@
+# Class that takes care of publishing the queue records (see trackutils.get_record)
+# to any number of local readers (stream overlays, bots, alerting scripts..) over a
+# TCP socket, as JSON lines: a single capture and OCR pipeline feeds all of them.
+import json
+import socket
+import logging
+import threading
+
+logger = logging.getLogger('lostqueue')
+
+# Default port of the status server (the metrics one is 9123)
+PUBLISH_PORT = 9124
+
+class StatusServer():
+
+    def __init__(self, port=PUBLISH_PORT, host='127.0.0.1', send_timeout=0.1):
+
+        # Every record is serialized once and written to every subscriber. A reader
+        # that does not keep up within send_timeout is disconnected instead of
+        # slowing down the pipeline: he gets the last values again on reconnection.
+        self.sock = socket.create_server((host, port))
+        self.port = self.sock.getsockname()[1]
+        self.send_timeout = send_timeout
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.running = True
+
+        # Last value semantics: the last record of every client is sent to a new
+        # subscriber on connection, so he does not wait for the next frame.
+        self.last_values = {}
+        self.logged = set()
+
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+
+        # Accept the subscribers (daemon thread): each one gets the last values
+        # first, then every new record
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.settimeout(self.send_timeout)
+            with self.lock:
+                try:
+                    for line in self.last_values.values():
+                        conn.sendall(line)
+                except OSError:
+                    conn.close()
+                    continue
+                self.subscribers.append(conn)
+            logger.debug('Status subscriber connected (%d)', len(self.subscribers))
+
+    def send(self, line):
+
+        # Write a line to every subscriber, dropping the disconnected or slow ones
+        # (must be called with the lock held)
+        for conn in list(self.subscribers):
+            try:
+                conn.sendall(line)
+            except OSError:
+                self.subscribers.remove(conn)
+                conn.close()
+                logger.debug('Status subscriber dropped (%d)', len(self.subscribers))
+
+    def publish(self, record):
+
+        # Publish the record of a result as a 'status' event. The first 'logged' one
+        # of a client is followed by a 'login' event, and a 'closed' client is
+        # dropped from the last values.
+        line = (json.dumps(dict(record, event='status')) + '\n').encode()
+        client = record['client']
+        with self.lock:
+            if record['status'] == 'closed':
+                self.last_values.pop(client, None)
+                self.logged.discard(client)
+            else:
+                self.last_values[client] = line
+            self.send(line)
+
+            if record['status'] == 'logged' and client not in self.logged:
+                self.logged.add(client)
+                self.send((json.dumps({'event': 'login', 'client': client, 'timestamp': record['timestamp']})
+                           + '\n').encode())
+
+    def close(self):
+
+        # Stop accepting and disconnect the subscribers
+        self.running = False
+        self.sock.close()
+        with self.lock:
+            for conn in self.subscribers:
+                conn.close()
+            self.subscribers = []
+
+def subscribe(port=PUBLISH_PORT, host='127.0.0.1'):
+
+    # Generator of the events published by a status server (dicts), for the Python
+    # readers: for event in subscribe(): ...
+    with socket.create_connection((host, port)) as conn:
+        for line in conn.makefile('r'):
+            yield json.loads(line)
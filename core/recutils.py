@@ -0,0 +1,253 @@
+# Classes that take care of recording the queue regions captured from the game and
+# of replaying them headlessly through the LostArkManager pipeline.
+import os
+import cv2
+import time
+import numpy as np
+
+class SessionRecorder():
+
+    def __init__(self, path, screen_res):
+
+        # A session is a single compressed .npz file holding:
+        # - regions: (N, h, w, 3) raw BGR queue regions, before any preprocessing
+        # - timestamps: (N,) monotonic capture times in seconds
+        # - truth: (N,) ground truth queue positions (-1 if unknown)
+        # - recognized: (N,) positions recognized live (-1 if the OCR failed)
+        # - logged_time: time at which we got in the game (nan if unknown)
+        # - screen_res: (2,) game resolution
+        self.path = path
+        self.screen_res = screen_res
+        self.regions = []
+        self.timestamps = []
+        self.truth = []
+        self.recognized = []
+        self.logged_time = np.nan
+
+    def add(self, region, timestamp=None, truth=-1):
+
+        # Add a captured region
+        self.regions.append(region.copy())
+        self.timestamps.append(time.monotonic() if timestamp is None else timestamp)
+        self.truth.append(truth)
+        self.recognized.append(-1)
+
+    def set_recognized(self, queue):
+
+        # Annotate the last region with the queue recognized from it
+        if self.recognized and queue != '':
+            self.recognized[-1] = int(queue)
+
+    def set_truth(self, queue, index=-1):
+
+        # Annotate a region with his ground truth queue
+        self.truth[index] = int(queue)
+
+    def mark_logged(self, timestamp=None):
+
+        # Save the time at which we got in the game: used to compute the eta error
+        self.logged_time = time.monotonic() if timestamp is None else timestamp
+
+    def save(self):
+
+        # Regions of a session have the same size, unless the resolution changed
+        # while recording: in that case only the regions with the last size are kept.
+        if not self.regions:
+            return 0
+
+        shape = self.regions[-1].shape
+        keep = [i for i, r in enumerate(self.regions) if r.shape == shape]
+        np.savez_compressed(self.path,
+                            regions=np.stack([self.regions[i] for i in keep]),
+                            timestamps=np.array(self.timestamps)[keep],
+                            truth=np.array(self.truth, dtype=np.int32)[keep],
+                            recognized=np.array(self.recognized, dtype=np.int32)[keep],
+                            logged_time=self.logged_time,
+                            screen_res=np.array(self.screen_res))
+
+        return len(keep)
+
+def load_session(path):
+
+    # Load a recorded session as a dictionary of arrays
+    with np.load(path) as session:
+        return {k: session[k] for k in session.files}
+
+class SessionSource():
+
+    def __init__(self, path, loop=False):
+
+        # Capture source playing back frames in real time in place of the game window:
+        # it's given to the LostArkManager as windows manager, so that the pipeline
+        # runs unchanged on any OS. The frames are either the queue regions of a
+        # recorded session (.npz), played with their timestamps, or a folder of full
+        # screenshots of the game, played one per second and cropped like the window.
+        # Once the frames are over the window is considered closed (unless looping).
+        if os.path.isdir(path):
+            files = sorted(f for f in os.listdir(path) if f.lower().endswith(('.png', '.jpg', '.bmp')))
+            self.frames = [cv2.imread(os.path.join(path, f)) for f in files]
+            self.timestamps = np.arange(len(self.frames), dtype=float)
+            self.is_full = True
+            h, w = self.frames[0].shape[:2]
+            self.screen_res = (w, h)
+        else:
+            session = load_session(path)
+            self.frames = session['regions']
+            self.timestamps = session['timestamps'] - session['timestamps'][0]
+            self.is_full = False
+            self.screen_res = tuple(int(v) for v in session['screen_res'])
+
+        # Every frame is shown until the next one, the last one for a second
+        self.duration = self.timestamps[-1] + 1.0
+        self.loop = loop
+        self.start = None
+
+    def get_elapsed(self):
+
+        # Seconds since the first frame was requested
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        return now - self.start
+
+    def is_finished(self):
+
+        return not self.loop and self.start is not None and self.get_elapsed() >= self.duration
+
+    def get_frame(self):
+
+        # Frame shown at the current time (None once the frames are over)
+        elapsed = self.get_elapsed()
+        if self.loop:
+            elapsed %= self.duration
+        elif elapsed >= self.duration:
+            return None
+
+        return self.frames[np.searchsorted(self.timestamps, elapsed, side='right') - 1]
+
+    def get_process_region_array(self, name, rect, mode='printwindow'):
+
+        # Region of the current frame: the recorded regions are already cropped
+        frame = self.get_frame()
+        if frame is None or not self.is_full:
+            return frame
+
+        x, y, rw, rh = rect
+        return frame[y:y+rh, x:x+rw]
+
+    def get_process_frame(self, name):
+
+        # Only the screenshots are full frames (used by the calibration)
+        return self.get_frame() if self.is_full else None
+
+    def get_screen_size(self):
+
+        return self.screen_res
+
+    def get_process_screensize(self, name):
+
+        return self.screen_res
+
+    def get_process_dpi(self, name):
+
+        return 96
+
+    def find_processes(self, name):
+
+        # A single client, until the frames are over
+        return [] if self.is_finished() else [(1, 'session')]
+
+    def close(self):
+
+        pass
+
+def get_latency_stats(times):
+
+    # Mean, median and 95th percentile of a list of latencies, in milliseconds
+    times = np.array(times) * 1000
+    if len(times) == 0:
+        return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0}
+
+    return {'mean': float(times.mean()), 'p50': float(np.percentile(times, 50)),
+            'p95': float(np.percentile(times, 95))}
+
+def replay_session(path, lamanager=None, **kwargs):
+
+    # Feed a recorded session through a LostArkManager, frame by frame, like the
+    # overlay does but without capturing: preprocess -> recognize -> estimate.
+    # Extra keyword arguments are passed to the LostArkManager (ie: ocr_backend).
+    # Returns a report with per stage latency, throughput, OCR accuracy and eta error.
+    from .lautils import LostArkManager, NO_ESTIMATE
+
+    session = load_session(path)
+    if lamanager is None:
+        lamanager = LostArkManager(tuple(int(v) for v in session['screen_res']), **kwargs)
+
+    stages = {'preprocess': [], 'recognize': [], 'estimate': []}
+    correct, labelled = 0, 0
+    eta_errors = []
+    last_queue = ''
+    last_estimate_time = None
+
+    start = time.perf_counter()
+    for region, timestamp, truth in zip(session['regions'], session['timestamps'], session['truth']):
+
+        # Preprocess the raw region
+        t0 = time.perf_counter()
+        queue_img = lamanager.preprocess(region)
+
+        # Recognize the number
+        t1 = time.perf_counter()
+        try:
+            cur_queue = lamanager.read_queue(queue_img, region)
+        except Exception:
+            cur_queue = ''
+
+        # Estimate the time left like the overlay does once synchronized (from the
+        # first change of the number seen): when the number moved, or once every
+        # server refresh (20 sec) if it's stuck.
+        t2 = time.perf_counter()
+        eta = None
+        is_estimated = cur_queue != '' and last_queue != '' and \
+            (cur_queue != last_queue or (last_estimate_time is not None and timestamp - last_estimate_time >= 20))
+        if is_estimated:
+            last_estimate_time = timestamp
+            if lamanager.estimator_type == 'kalman':
+                lamanager.update_estimate(cur_queue, last_queue, timestamp=float(timestamp))
+                if lamanager.last_estimate.eta is not None:
+                    eta = lamanager.last_estimate.eta
+            else:
+                minutes = lamanager.compute_wait_time(cur_queue, last_queue)
+                eta = None if minutes is None or minutes >= NO_ESTIMATE else minutes*60
+        t3 = time.perf_counter()
+
+        stages['preprocess'].append(t1 - t0)
+        stages['recognize'].append(t2 - t1)
+        if is_estimated:
+            stages['estimate'].append(t3 - t2)
+
+        # Accuracy on the labelled frames, eta error when the login time is known
+        if truth >= 0:
+            labelled += 1
+            correct += cur_queue != '' and int(cur_queue) == truth
+        if eta is not None and not np.isnan(session['logged_time']):
+            eta_errors.append((eta - (session['logged_time'] - timestamp)) / 60)
+
+        # Keep the last valid queue (corrected by the estimator if rejected)
+        if cur_queue != '':
+            last_queue = lamanager.get_corrected_queue(cur_queue, last_queue) if is_estimated else cur_queue
+
+    elapsed = time.perf_counter() - start
+    n = len(session['regions'])
+    eta_errors = np.array(eta_errors)
+
+    return {
+        'frames': n,
+        'fps': n / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {stage: get_latency_stats(times) for stage, times in stages.items()},
+        'accuracy': correct / labelled if labelled else None,
+        'labelled': labelled,
+        'eta_mae_min': float(np.abs(eta_errors).mean()) if len(eta_errors) else None,
+        'eta_bias_min': float(eta_errors.mean()) if len(eta_errors) else None,
+        'ocr_cache': lamanager.ocr_cache.get_stats(),
+    }
@@ -0,0 +1,141 @@
+# Class that takes care of scheduling the captures around the queue server refresh.
+class RefreshScheduler():
+
+    def __init__(self, period=20.0, burst_before=0.75, burst_after=1.25, burst_interval=0.5,
+                 acquire_interval=1.0, max_missed=3, phase_gain=0.3, period_gain=0.05, period_band=0.25):
+
+        # The queue server refreshes the queue number every `period` seconds. Once
+        # the phase of the refresh is known (locked) we capture only in a burst
+        # window around each expected change, every `burst_interval` seconds, and
+        # sleep otherwise. Before that (or after losing the phase) we poll every
+        # `acquire_interval` seconds, like the overlay synchronization does.
+        # - max_missed: consecutive burst windows without a change after which the
+        #   phase is considered lost (the queue may legitimately not move at a refresh)
+        # - phase_gain, period_gain: how fast phase and period follow the drift
+        # - period_band: max seconds the period can drift from the nominal one
+        self.period = period
+        self.nominal_period = period
+        self.period_band = period_band
+        self.burst_before = burst_before
+        self.burst_after = burst_after
+        self.burst_interval = burst_interval
+        self.acquire_interval = acquire_interval
+        self.max_missed = max_missed
+        self.phase_gain = phase_gain
+        self.period_gain = period_gain
+        self.last_delay = None
+        self.last_time = None
+        self.reset()
+
+    def reset(self):
+
+        # Forget the phase: back to acquisition
+        self.phase = None
+        self.is_locked = False
+        self.missed = 0
+        self.checked_cycle = None
+
+    def get_cycle(self, t):
+
+        # Index of the refresh closest to the time t
+        return round((t - self.phase) / self.period)
+
+    def observe(self, t, changed):
+
+        # Feed a capture done at the time t: changed is True if the queue number
+        # differs from the previous capture. Returns the residual (seconds) between
+        # the observed and the expected change, None if not available.
+        last_time, self.last_time = self.last_time, t
+        if changed:
+
+            # The change happened between the previous capture and this one: take
+            # the middle point as the change time (the captures are further apart
+            # than the delays when the processing of a frame takes long).
+            interval = self.burst_interval if self.is_locked else self.acquire_interval
+            t_change = t - (t - last_time if last_time is not None else interval)/2
+
+            # First change: lock the phase on it
+            if not self.is_locked:
+                self.phase = t_change
+                self.is_locked = True
+                self.missed = 0
+                self.checked_cycle = 0
+                return None
+
+            # The previous capture was followed by a sleep, outside of a burst window
+            # (the delay scheduled, not the time elapsed: the processing of a frame
+            # may take long): the change happened somewhere in between, at an unknown
+            # time, so it tells only that the phase is wrong (ie: the server refresh
+            # moved later than the window). It counts as a missed tick instead of
+            # being fitted.
+            if self.last_delay is None or self.last_delay > self.burst_interval:
+                self.register_missed()
+                return None
+
+            # Follow the drift (second order loop): move the phase toward the observed
+            # change, and the period by a fraction of the residual, so that a server
+            # period slightly different from 20 sec stops producing residuals.
+            # A change seen far from the window (ie: by the capture registering a
+            # missed tick) is clamped, to not throw the loop away.
+            cycle = self.get_cycle(t_change)
+            expected = self.phase + cycle * self.period
+            residual = min(max(t_change - expected, -self.burst_before), self.burst_after)
+
+            # The phase is re-anchored on this refresh, so that a period correction
+            # does not get multiplied by the number of cycles elapsed.
+            self.phase = expected + self.phase_gain * residual
+            self.period = min(max(self.period + self.period_gain * residual,
+                                  self.nominal_period - self.period_band), self.nominal_period + self.period_band)
+            self.missed = 0
+            self.checked_cycle = 0
+
+            return residual
+
+        # No change: count the burst windows ended without a change (missed ticks)
+        # and drop the phase if too many in a row.
+        if self.is_locked:
+            cycle = self.get_cycle(t)
+            window_end = self.phase + cycle * self.period + self.burst_after
+            if t >= window_end and cycle != self.checked_cycle:
+                self.checked_cycle = cycle
+                self.register_missed()
+
+        return None
+
+    def register_missed(self):
+
+        # Count a missed tick, and drop the phase if too many in a row
+        self.missed += 1
+        if self.missed >= self.max_missed:
+            self.reset()
+
+    def next_delay(self, now):
+
+        # Seconds to wait before the next capture, kept for the next observation
+        self.last_delay = self.get_delay(now)
+        return self.last_delay
+
+    def get_delay(self, now):
+
+        # Acquisition: poll at the acquisition interval
+        if not self.is_locked:
+            return self.acquire_interval
+
+        # Burst window of the closest refresh
+        cycle = self.get_cycle(now)
+        expected = self.phase + cycle * self.period
+        if cycle != self.checked_cycle:
+
+            # Before the window: sleep until it starts
+            if now < expected - self.burst_before:
+                return expected - self.burst_before - now
+
+            # Inside the window: capture often
+            if now < expected + self.burst_after:
+                return self.burst_interval
+
+            # Window ended without a change: capture now to register the missed tick
+            return 0.0
+
+        # Change already seen for this refresh: sleep until the next window
+        return max(expected + self.period - self.burst_before - now, 0.0)
@@ -0,0 +1,112 @@
+# Class that takes care of keeping a fixed window of samples with O(1) statistics.
+from math import sqrt
+
+# Machine epsilon of float32, used as tolerance by is_outlier
+EPS = 1.1920929e-07
+
+class RingBuffer():
+
+    def __init__(self, capacity):
+
+        # Preallocated storage: pushing never reallocates
+        self.capacity = capacity
+        self.data = [0.0] * capacity
+        self.start = 0
+        self.count = 0
+
+        # Running sum and sum of squared differences (Welford), updated on every
+        # push and eviction. The mean is the sum divided by the count, like np.mean:
+        # a mean updated incrementally drifts, and round(mean) then differs at the
+        # .5 ties. Every resync_every pushes they're recomputed from the window to
+        # avoid the floating point drift of m2 on very long queues.
+        self.total = 0.0
+        self.m2 = 0.0
+        self.pushes = 0
+        self.resync_every = 1024
+
+    def __len__(self):
+
+        return self.count
+
+    def __repr__(self):
+
+        return repr(self.values())
+
+    def values(self):
+
+        # Samples from the oldest to the newest (this one copies: debug only)
+        return [self.data[(self.start + i) % self.capacity] for i in range(self.count)]
+
+    def __add(self, value):
+
+        # Welford update for a new sample
+        old_mean = self.total / self.count if self.count else 0.0
+        self.count += 1
+        self.total += value
+        self.m2 += (value - old_mean) * (value - self.total / self.count)
+
+    def __remove(self, value):
+
+        # Inverse Welford update for a sample leaving the window
+        old_mean = self.total / self.count
+        self.count -= 1
+        self.total -= value
+        if self.count == 0:
+            self.total = 0.0
+            self.m2 = 0.0
+            return
+
+        self.m2 = max(self.m2 - (value - old_mean) * (value - self.total / self.count), 0.0)
+
+    def push(self, value):
+
+        # Evict the oldest sample if the window is full, then store the new one
+        if self.count == self.capacity:
+            self.__remove(self.data[self.start])
+            self.start = (self.start + 1) % self.capacity
+
+        self.data[(self.start + self.count) % self.capacity] = value
+        self.__add(value)
+
+        # Periodic resync of the running statistics
+        self.pushes += 1
+        if self.pushes % self.resync_every == 0:
+            self.resync()
+
+    def resync(self):
+
+        # Recompute sum and m2 from the samples, oldest first (no allocation: the
+        # window is walked in place).
+        total = 0.0
+        for i in range(self.count):
+            total += self.data[(self.start + i) % self.capacity]
+        mean, m2 = total / self.count if self.count else 0.0, 0.0
+        for i in range(self.count):
+            m2 += (self.data[(self.start + i) % self.capacity] - mean) ** 2
+        self.total, self.m2 = total, m2
+
+    def mean(self):
+
+        # Mean of the window (nan if empty, like numpy)
+        return self.total / self.count if self.count else float('nan')
+
+    def std(self):
+
+        # Population standard deviation of the window (nan if empty, like numpy)
+        return sqrt(self.m2 / self.count) if self.count else float('nan')
+
+    def is_outlier(self, value, max_deviations):
+
+        # Check if value would be further than max_deviations sigma from the mean
+        # of the window including the value itself. Computed in O(1) from the running
+        # statistics, without inserting the value or copying the window.
+        if self.count == 0:
+            return False
+
+        n = self.count + 1
+        old_mean = self.total / self.count
+        mean = (self.total + value) / n
+        m2 = self.m2 + (value - old_mean) * (value - mean)
+        standard_deviation = sqrt(m2 / n) + EPS
+
+        return abs(value - (mean + EPS)) >= max_deviations * standard_deviation
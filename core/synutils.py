@@ -0,0 +1,178 @@
+# Classes that take care of generating synthetic queue regions, labelled, for every
+# supported resolution: digits rendered with varying fonts, noise, JPEG artifacts
+# and scaling, as single frames, batches or a draining queue stream. They feed the
+# stress benchmarks and the tests of the recognizers, without the game.
+import cv2
+import time
+import numpy as np
+
+from .lautils import QUEUE_CROPS
+
+# Fonts of the rendered digits (the game font is a sans serif one)
+FONTS = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_COMPLEX, cv2.FONT_HERSHEY_TRIPLEX]
+
+class QueueFrameGenerator():
+
+    def __init__(self, screen_h, seed=None, fonts=FONTS, noise=(0, 8), jpeg=(40, 95), scale=(0.8, 1.2),
+                 jitter=2):
+
+        # The regions have the size of the queue crop of the resolution, like the
+        # ones returned by LostArkManager.get_queue_region (BGR). Every distortion
+        # is drawn uniformly in his (low, high) range, None disables it:
+        # - noise: standard deviation of the gaussian noise
+        # - jpeg: quality of the JPEG round trip
+        # - scale: factor of the down and up scaling round trip (blur, aliasing)
+        # - jitter: max offset in pixels of the text
+        y0, y1, x0, x1 = QUEUE_CROPS[screen_h]
+        self.shape = (y1-y0, x1-x0, 3)
+        self.rng = np.random.default_rng(seed)
+        self.fonts = fonts
+        self.noise = noise
+        self.jpeg = jpeg
+        self.scale = scale
+        self.jitter = jitter
+
+    def draw(self, bounds):
+
+        # Random value in the range (None if the distortion is disabled)
+        return None if bounds is None else self.rng.uniform(*bounds)
+
+    def render(self, position):
+
+        # Render a region showing the position: light digits on the dark box of the
+        # dialog, drawn one by one with a gap (like the game font, they never touch)
+        # and fitted in 90% of the width and 70% of the height
+        h, w, _ = self.shape
+        background = int(self.rng.integers(10, 35))
+        foreground = int(self.rng.integers(190, 250))
+        region = np.full(self.shape, background, dtype=np.uint8)
+
+        text = str(position)
+        font = self.fonts[self.rng.integers(len(self.fonts))]
+        thickness = int(self.rng.integers(1, 3)) if h < 40 else int(self.rng.integers(2, 4))
+        (dw, dh), _ = cv2.getTextSize('0', font, 1.0, thickness)
+        advance = 1.25 * dw
+        font_scale = min(0.9*w / (advance*(len(text)-1) + dw), 0.7*h / dh)
+        dx, dy = self.rng.integers(-self.jitter, self.jitter+1, size=2) if self.jitter else (0, 0)
+        x0 = (w - font_scale*(advance*(len(text)-1) + dw)) / 2 + dx
+        y0 = int((h + font_scale*dh) // 2 + dy)
+        for i, digit in enumerate(text):
+            cv2.putText(region, digit, (int(x0 + i*advance*font_scale), y0), font, font_scale, (foreground,)*3,
+                        thickness, cv2.LINE_AA)
+
+        return self.distort(region)
+
+    def distort(self, region):
+
+        # Scaling round trip, gaussian noise and JPEG round trip
+        h, w, _ = region.shape
+        factor = self.draw(self.scale)
+        if factor is not None and factor != 1:
+            small = cv2.resize(region, (max(int(w*factor), 1), max(int(h*factor), 1)), interpolation=cv2.INTER_AREA)
+            region = cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+
+        sigma = self.draw(self.noise)
+        if sigma:
+            noisy = region + self.rng.normal(0, sigma, region.shape)
+            region = np.clip(noisy, 0, 255).astype(np.uint8)
+
+        quality = self.draw(self.jpeg)
+        if quality is not None:
+            _, data = cv2.imencode('.jpg', region, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+            region = cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+        return region
+
+    def render_batch(self, n, low=100, high=20000):
+
+        # Random positions and their regions, as a (n, h, w, 3) stack
+        positions = self.rng.integers(low, high, size=n)
+        regions = np.empty((n,) + self.shape, dtype=np.uint8)
+        for i, position in enumerate(positions):
+            regions[i] = self.render(position)
+
+        return regions, positions
+
+    def get_position(self, t, start=5000, players_per_minute=100, refresh=20.0):
+
+        # Position of a draining queue after t seconds: it drops at every server
+        # refresh only
+        return max(int(start - players_per_minute/60 * refresh * (t // refresh)), 0)
+
+    def stream(self, start=5000, players_per_minute=100, fps=1.0, duration=None, refresh=20.0):
+
+        # Frames of a draining queue, one every 1/fps seconds of queue time, as
+        # (timestamp, region, position) until the queue is empty. The stream is not
+        # paced: the consumer decides how fast it runs (see SyntheticSource for a
+        # real time one).
+        t = 0.0
+        while duration is None or t < duration:
+            position = self.get_position(t, start, players_per_minute, refresh)
+            if position == 0:
+                return
+            yield t, self.render(position), position
+            t += 1.0 / fps
+
+class SyntheticSource():
+
+    def __init__(self, screen_res, fps=None, seed=None, start=5000, players_per_minute=100, refresh=20.0):
+
+        # Capture source rendering a draining queue in place of the game window
+        # (like recutils.SessionSource). The queue time runs with the wall clock, or
+        # advances by 1/fps at every capture if fps is given (as fast as the reader
+        # goes). Once the queue is empty the window is considered closed.
+        self.screen_res = screen_res
+        self.generator = QueueFrameGenerator(screen_res[1], seed=seed)
+        self.fps = fps
+        self.queue = (start, players_per_minute, refresh)
+        self.captures = 0
+        self.start = None
+        self.truth = None
+
+    def get_elapsed(self):
+
+        # Seconds of queue time since the first capture
+        if self.fps is not None:
+            return self.captures / self.fps
+        if self.start is None:
+            self.start = time.monotonic()
+        return time.monotonic() - self.start
+
+    def is_finished(self):
+
+        return self.generator.get_position(self.get_elapsed(), *self.queue) == 0
+
+    def get_process_region_array(self, name, rect, mode='printwindow'):
+
+        # Render the position at the current queue time (his truth is kept)
+        position = self.generator.get_position(self.get_elapsed(), *self.queue)
+        self.captures += 1
+        if position == 0:
+            return None
+
+        self.truth = position
+        return self.generator.render(position)
+
+    def get_process_frame(self, name):
+
+        return None
+
+    def get_screen_size(self):
+
+        return self.screen_res
+
+    def get_process_screensize(self, name):
+
+        return self.screen_res
+
+    def get_process_dpi(self, name):
+
+        return 96
+
+    def find_processes(self, name):
+
+        return [] if self.is_finished() else [(1, 'synthetic')]
+
+    def close(self):
+
+        pass
@@ -0,0 +1,236 @@
+# Classes that take care of tracking the queue of the game clients: the per client
+# pipeline state (capture -> preprocess -> recognize -> estimate) and the schedule
+# of the captures of every client. Qt free, shared by the overlay pipeline thread
+# and the headless daemon.
+import time
+import logging
+
+from collections import namedtuple
+from .metutils import METRICS
+from .schedutils import RefreshScheduler
+
+logger = logging.getLogger('lostqueue')
+
+# Immutable result posted at every processed frame.
+# - status: 'logged' when we got in the game, 'synching' while waiting for the
+#   first change of the queue number, 'update' otherwise, 'closed' when the game
+#   window of the client has been closed
+# - queue: current recognized queue, corrected by the estimator ('' if the recognition failed)
+# - last_queue: last valid queue before this frame ('' if none)
+# - avg_time: estimated minutes left (None if not available)
+# - eta_range: 95% confidence interval (low, high) of the minutes left (None if not available)
+# - players_per_minute: average players leaving the queue per minute (None if not available)
+# - estimated_queue: queue estimated from the last one when the recognition failed
+# - client: id of the game client the result belongs to (0 with a single client)
+QueueResult = namedtuple('QueueResult', ['timestamp', 'status', 'queue', 'last_queue', 'avg_time', 'eta_range',
+                                         'players_per_minute', 'estimated_queue', 'is_synchronized', 'client'])
+
+def get_record(tracker, result):
+
+    # JSON serializable record of a result (headless output and status server): wall clock time, position (estimated if the reading
+    # failed), players per minute, minutes left with his range and OCR confidence
+    position = result.queue if result.queue != '' else result.estimated_queue
+    eta_low, eta_high = result.eta_range or (None, None)
+    return {
+        'timestamp': round(time.time() - (time.monotonic() - result.timestamp), 3),
+        'client': result.client,
+        'status': result.status,
+        'position': None if position in ('', None) else int(position),
+        'rate': None if result.players_per_minute is None else round(float(result.players_per_minute), 2),
+        'eta': result.avg_time,
+        'eta_low': eta_low,
+        'eta_high': eta_high,
+        'confidence': None if tracker is None else round(float(tracker.lamanager.last_confidence), 3),
+        'synchronized': result.is_synchronized,
+    }
+
+class QueueTracker():
+
+    def __init__(self, lamanager, scheduler=None, client=0):
+
+        # State of the queue of a single game client: his manager (estimator),
+        # the synchronization with the overlay and the server refresh phase.
+        self.lamanager = lamanager
+        self.client = client
+        self.queue_status = ''
+        self.is_synchronized = False
+
+        # The scheduler decides when to capture, following the server refresh phase
+        self.scheduler = scheduler or RefreshScheduler()
+        self.last_reading = ''
+        self.last_estimate_time = float('-inf')
+        self.next_capture = time.monotonic()
+
+    def fetch_initial(self):
+
+        # Fetch the initial queue status: if returns some error, assign an empty
+        # string.
+        try:
+            self.queue_status = self.lamanager.get_queue_status()
+        except:
+            self.queue_status = ''
+
+        self.last_reading = self.queue_status
+        return self.queue_status
+
+    def get_result(self, timestamp, status, queue, avg_time=None, eta_range=None,
+                   players_per_minute=None, estimated_queue=None):
+
+        return QueueResult(timestamp, status, queue, self.queue_status, avg_time, eta_range,
+                           players_per_minute, estimated_queue, self.is_synchronized, self.client)
+
+    def process(self):
+
+        timestamp = time.monotonic()
+
+        # Try to get cur queue status, if some error returns, assign an empty string
+        try:
+            cur_queue = self.lamanager.get_queue_status()
+        except:
+            cur_queue = ''
+        METRICS.count('captures')
+
+        # Feed the scheduler with the change detection: it learns the server phase
+        changed = cur_queue != '' and self.last_reading != '' and cur_queue != self.last_reading
+        residual = self.scheduler.observe(timestamp, changed)
+        if residual is not None:
+            METRICS.observe('refresh_residual', abs(residual))
+        if cur_queue != '':
+            self.last_reading = cur_queue
+
+        # Check if we´ve logged in: if the last queue status was lesser than 100,
+        # and the new status is empty that means we´ve finally managed to get in the game.
+        if self.queue_status != '':
+            if int(self.queue_status) < 100 and cur_queue == '':
+                if self.lamanager.recorder is not None:
+                    self.lamanager.recorder.mark_logged(timestamp)
+                return self.get_result(timestamp, 'logged', cur_queue)
+
+        # Check if we're synchronized with the client: we achieve that comapring
+        # the initial queue status with the fetched one; if equal that means we're
+        # still on the same number, if not we set the synch flag to true.
+        if not self.is_synchronized:
+            if cur_queue != self.queue_status:
+                self.is_synchronized = True
+            else:
+                # Until then, the eta is the one of the history of the server (if any)
+                return self.get_result(timestamp, 'synching', cur_queue, self.lamanager.get_prior_eta(cur_queue))
+
+        # Once synchronized, a frame is processed only if the reading changed, or
+        # once per refresh period if it's stuck (or unreadable): the other captures
+        # of a burst bring no new information.
+        if not changed and timestamp - self.last_estimate_time < self.scheduler.period:
+            return None
+        self.last_estimate_time = timestamp
+
+        # Estimate the time left: if the queue status is empty, that means we do
+        # not have information yet.
+        avg_time = None
+        if self.queue_status != '':
+            with METRICS.timer('estimate'):
+                avg_time = self.lamanager.compute_wait_time(cur_queue, self.queue_status)
+
+        # If the cur queue is empty, that means tesseract failed the recognition:
+        # estimate it from the last one. A reading rejected by the estimator is
+        # replaced by the estimate as well.
+        estimated_queue = None
+        if cur_queue == '':
+            estimated_queue = self.lamanager.get_corrected_queue(cur_queue, self.queue_status)
+        else:
+            cur_queue = self.lamanager.get_corrected_queue(cur_queue, self.queue_status)
+
+        result = self.get_result(timestamp, 'update', cur_queue, avg_time, self.lamanager.get_eta_range(),
+                                 self.lamanager.get_players_per_minute(), estimated_queue)
+
+        # Update the queue status with the current queue fetch if valid
+        if cur_queue != '':
+            self.queue_status = cur_queue
+
+        return result
+
+class TrackerGroup():
+
+    def __init__(self, trackers=None, monitor=None, publisher=None):
+
+        # The trackers of every client, captured one after the other: either the
+        # given ones, or the ones discovered by the monitor (see QueueMonitor), which
+        # is asked to look for new or closed clients every rescan_interval.
+        self.trackers = list(trackers or [])
+        self.monitor = monitor
+
+        # Optional StatusServer receiving the record of every result
+        self.publisher = publisher
+        self.next_scan = time.monotonic() + (monitor.rescan_interval if monitor else float('inf'))
+
+    def fetch_initial(self):
+
+        # Fetch the initial queue status of the clients (discovering them first with
+        # a monitor): returns the one of the first client ('' if none).
+        if self.monitor is not None:
+            self.trackers.extend(self.monitor.scan()[0])
+
+        statuses = [tracker.fetch_initial() for tracker in self.trackers]
+        return statuses[0] if statuses else ''
+
+    def get_next_wakeup(self):
+
+        # Monotonic time of the next capture due or rescan (inf if none)
+        return min([t.next_capture for t in self.trackers] + [self.next_scan])
+
+    def rescan(self):
+
+        # Add the trackers of the new clients and drop the ones of the closed
+        # windows: returns a 'closed' result for each of them.
+        added, removed = self.monitor.scan()
+        for tracker in added:
+            tracker.fetch_initial()
+            self.trackers.append(tracker)
+
+        results = []
+        for tracker in removed:
+            self.trackers.remove(tracker)
+            results.append(tracker.get_result(time.monotonic(), 'closed', ''))
+
+        return results
+
+    def step(self, force=False):
+
+        # Process the frames due (all of them if forced) and return the results,
+        # alongside with the tracker that produced each one.
+        results = []
+        if time.monotonic() >= self.next_scan:
+            try:
+                results.extend((None, result) for result in self.rescan())
+            except Exception:
+                logger.exception('Monitor error')
+            self.next_scan = time.monotonic() + self.monitor.rescan_interval
+
+        for tracker in list(self.trackers):
+            if not force and time.monotonic() < tracker.next_capture:
+                continue
+
+            # An error in a frame must not kill the loop: skip the frame
+            try:
+                result = tracker.process()
+            except Exception:
+                logger.exception('Pipeline error')
+                result = None
+
+            if result is not None:
+                results.append((tracker, result))
+
+            tracker.next_capture = time.monotonic() + tracker.scheduler.next_delay(time.monotonic())
+
+        if self.publisher is not None:
+            for tracker, result in results:
+                self.publisher.publish(get_record(tracker, result))
+
+        return results
+
+    def close(self):
+
+        # Release the capture sessions of the game windows
+        wmans = {id(t.lamanager.windows_manager): t.lamanager.windows_manager for t in self.trackers}
+        for wman in wmans.values():
+            if wman is not None:
+                wman.close()
@@ -1,21 +1,269 @@
 # Class that takes care of initializing processes windows ID and screnshotting.
 import win32ui
 import win32gui
+import win32con
 import win32com.client
+import ctypes
+import numpy as np
 
-from ctypes import windll
+from ctypes import windll, wintypes
 from PIL import ImageGrab
 from PIL import Image
 
+class BITMAPINFOHEADER(ctypes.Structure):
+
+    _fields_ = [('biSize', wintypes.DWORD), ('biWidth', wintypes.LONG), ('biHeight', wintypes.LONG),
+                ('biPlanes', wintypes.WORD), ('biBitCount', wintypes.WORD), ('biCompression', wintypes.DWORD),
+                ('biSizeImage', wintypes.DWORD), ('biXPelsPerMeter', wintypes.LONG),
+                ('biYPelsPerMeter', wintypes.LONG), ('biClrUsed', wintypes.DWORD),
+                ('biClrImportant', wintypes.DWORD)]
+
+# Handles are pointer sized: declare the signatures, or they get truncated on 64 bit
+windll.gdi32.CreateDIBSection.restype = wintypes.HBITMAP
+windll.gdi32.CreateDIBSection.argtypes = [wintypes.HDC, ctypes.c_void_p, wintypes.UINT,
+                                          ctypes.POINTER(ctypes.c_void_p), wintypes.HANDLE, wintypes.DWORD]
+windll.gdi32.SelectObject.restype = wintypes.HGDIOBJ
+windll.gdi32.SelectObject.argtypes = [wintypes.HDC, wintypes.HGDIOBJ]
+windll.gdi32.DeleteObject.argtypes = [wintypes.HGDIOBJ]
+
+def create_dib(hdc, w, h):
+
+    # Create a top-down 32 bit DIB section of w x h pixels, selected in the memory
+    # DC hdc. The pixels live in memory we can address: they're returned as a numpy
+    # (h, w, 4) BGRX view, without any copy. The view is overwritten by the next
+    # blit in the bitmap.
+    bmi = BITMAPINFOHEADER()
+    bmi.biSize = ctypes.sizeof(BITMAPINFOHEADER)
+    bmi.biWidth = w
+    bmi.biHeight = -h
+    bmi.biPlanes = 1
+    bmi.biBitCount = 32
+    bmi.biCompression = 0
+
+    bits = ctypes.c_void_p()
+    hbmp = windll.gdi32.CreateDIBSection(hdc, ctypes.byref(bmi), 0, ctypes.byref(bits), None, 0)
+    if not hbmp:
+        raise ctypes.WinError()
+    windll.gdi32.SelectObject(hdc, hbmp)
+
+    buffer = (ctypes.c_ubyte * (w*h*4)).from_address(bits.value)
+    return hbmp, np.frombuffer(buffer, dtype=np.uint8).reshape(h, w, 4)
+
+
+class CaptureSession():
+
+    def __init__(self, wman, name):
+
+        # A capture session holds the window handle and the GDI objects (DCs and
+        # bitmaps) of a process window across frames: they're rebuilt only when
+        # the window is resized or lost, instead of being created and destroyed at
+        # every frame. The bitmaps are DIB sections, so the captured pixels are read
+        # in place as numpy views instead of being copied out with GetBitmapBits.
+        self.wman = wman
+        self.name = name
+        self.hwnd = None
+        self.size = None
+        self.hwndDC = None
+        self.mfcDC = None
+        self.fullDC = None
+        self.fullBitMap = None
+        self.fullView = None
+        self.regions = {}
+
+    def is_valid(self):
+
+        return self.hwnd is not None and win32gui.IsWindow(self.hwnd)
+
+    def ensure(self):
+
+        # Assure the session is usable: find the window again if lost (the game may
+        # have been restarted), rebuild the GDI objects if it has been resized.
+        # Returns False if the window can't be found.
+        if not self.is_valid():
+            self.close()
+            self.hwnd, _ = self.wman.get_process_ID(self.name)
+            if not self.hwnd:
+                self.hwnd = None
+                return False
+
+        # Get windows rectangle coordinate, and the window DC to process it in
+        # background. The window may be destroyed in between (the game closing).
+        try:
+            left, top, right, bot = win32gui.GetClientRect(self.hwnd)
+            size = (right - left, bot - top)
+            if size != self.size:
+                self.release_gdi()
+                self.size = size
+
+            if self.hwndDC is None:
+                self.hwndDC = win32gui.GetWindowDC(self.hwnd)
+                self.mfcDC = win32ui.CreateDCFromHandle(self.hwndDC)
+        except (win32gui.error, win32ui.error):
+            self.close()
+            self.hwnd = None
+            return False
+
+        return True
+
+    def get_full(self):
+
+        # Full window bitmap, where the window gets rendered by PrintWindow
+        if self.fullDC is None:
+            w, h = self.size
+            self.fullDC = self.mfcDC.CreateCompatibleDC()
+            self.fullBitMap, self.fullView = create_dib(self.fullDC.GetSafeHdc(), w, h)
+
+        return self.fullDC, self.fullView
+
+    def get_region(self, rw, rh):
+
+        # Region bitmap of the given size (one for each size requested)
+        if (rw, rh) not in self.regions:
+            saveDC = self.mfcDC.CreateCompatibleDC()
+            saveBitMap, view = create_dib(saveDC.GetSafeHdc(), rw, rh)
+            self.regions[(rw, rh)] = (saveDC, saveBitMap, view)
+
+        return self.regions[(rw, rh)]
+
+    def render(self):
+
+        # Render the full window inside the full bitmap. Change the flag depending
+        # on whether you want the whole window (2) or just the client area (1).
+        fullDC, fullView = self.get_full()
+        windll.user32.PrintWindow(self.hwnd, fullDC.GetSafeHdc(), 2)
+
+        return fullDC, fullView
+
+    def grab_full_array(self):
+
+        # Capture the whole window: returns the (h, w, 4) BGRX view over the bitmap,
+        # or None if the window can't be found.
+        if not self.ensure():
+            return None
+
+        _, fullView = self.render()
+
+        # Make sure GDI has finished drawing before reading the memory
+        windll.gdi32.GdiFlush()
+        return fullView
+
+    def grab_full(self):
+
+        # Capture the whole window as a PIL image (None if the window can't be found)
+        view = self.grab_full_array()
+        if view is None:
+            return None
+
+        h, w, _ = view.shape
+        return Image.frombuffer('RGB', (w, h), view.tobytes(), 'raw', 'BGRX', 0, 1)
+
+    def is_region_visible(self, rect):
+
+        # Check if a region (x, y, w, h) of the window is shown on screen: the window
+        # is not minimized, and no other window (the overlay included) lies over the
+        # corners and the center of the region.
+        if win32gui.IsIconic(self.hwnd) or not win32gui.IsWindowVisible(self.hwnd):
+            return False
+
+        x, y, rw, rh = rect
+        left, top, _, _ = win32gui.GetWindowRect(self.hwnd)
+        for px, py in ((x, y), (x+rw-1, y), (x, y+rh-1), (x+rw-1, y+rh-1), (x+rw//2, y+rh//2)):
+            hwnd = win32gui.WindowFromPoint((left + px, top + py))
+            if hwnd != self.hwnd and win32gui.GetAncestor(hwnd, win32con.GA_ROOT) != self.hwnd:
+                return False
+
+        return True
+
+    def grab_region_array(self, rect, mode='auto'):
+
+        # Capture only a region (x, y, w, h) of the window: returns the (h, w, 4)
+        # BGRX view over the region bitmap, or None if the window can't be found.
+        # See WindowsManager.get_process_region for the modes.
+        if not self.ensure():
+            return None
+
+        x, y, rw, rh = rect
+        saveDC, _, view = self.get_region(rw, rh)
+        if mode == 'auto':
+            mode = 'bitblt' if self.is_region_visible(rect) else 'printwindow'
+
+        if mode == 'bitblt':
+
+            # Copy the region from the window
+            saveDC.BitBlt((0, 0), (rw, rh), self.mfcDC, (x, y), win32con.SRCCOPY)
+
+        else:
+
+            # Render the full window (this stays on the GDI side, it's never copied
+            # to python) and copy the region out of it.
+            fullDC, _ = self.render()
+            saveDC.BitBlt((0, 0), (rw, rh), fullDC, (x, y), win32con.SRCCOPY)
+
+        windll.gdi32.GdiFlush()
+        return view
+
+    def grab_region(self, rect, mode='auto'):
+
+        # Capture only a region of the window as a PIL image (None if not found)
+        view = self.grab_region_array(rect, mode)
+        if view is None:
+            return None
+
+        h, w, _ = view.shape
+        return Image.frombuffer('RGB', (w, h), view.tobytes(), 'raw', 'BGRX', 0, 1)
+
+    def release_gdi(self):
+
+        # clean objects: the DCs first, so that the bitmaps are no more selected
+        for saveDC, saveBitMap, _ in self.regions.values():
+            saveDC.DeleteDC()
+            windll.gdi32.DeleteObject(saveBitMap)
+        self.regions = {}
+
+        if self.fullDC is not None:
+            self.fullDC.DeleteDC()
+            windll.gdi32.DeleteObject(self.fullBitMap)
+            self.fullDC = None
+            self.fullBitMap = None
+            self.fullView = None
+
+        if self.mfcDC is not None:
+            self.mfcDC.DeleteDC()
+            win32gui.ReleaseDC(self.hwnd, self.hwndDC)
+            self.mfcDC = None
+            self.hwndDC = None
+
+    def close(self):
+
+        # The GDI objects of a destroyed window may be already gone: ignore errors
+        try:
+            self.release_gdi()
+        except win32ui.error:
+            pass
+
+        self.mfcDC = None
+        self.hwndDC = None
+        self.fullDC = None
+        self.fullBitMap = None
+        self.fullView = None
+        self.regions = {}
+        self.size = None
 
 class WindowsManager():
 
     def __init__(self):
 
+        # Set the correct DPI for the process (once)
+        windll.user32.SetProcessDPIAware()
+
         # Initialize process list and populate it with the custom function
         self.plist = []
         self.__acquire_processes_ID()
 
+        # Capture sessions and window handles, for each process name
+        self.sessions = {}
+        self.hwnds = {}
+
     def __acquire_processes_ID(self):
 
         # Defining lambda function that append the process pid and the
@@ -25,11 +273,44 @@ class WindowsManager():
         # Using win32guo to get the process list
         win32gui.EnumWindows(l, self.plist)
 
+    def refresh(self):
+
+        # Enumerate the windows again (ie: the game started after the overlay)
+        self.plist = []
+        self.__acquire_processes_ID()
+
+    def find_processes(self, name):
+
+        # Enumerate the windows again and return every visible window (hwnd, name)
+        # whose name contains the given one: one for each game client running.
+        # Hidden windows are skipped, the game may create some with the same name.
+        self.refresh()
+        return [(p, n) for (p, n) in self.plist if name in n.lower() and win32gui.IsWindowVisible(p)]
+
     def get_process_ID(self, name):
 
-        # Getting the wanted process by analyzing the plist built
-        # at init
-        process_info = [(p, n) for (p, n) in self.plist if name in n.lower()]
+        # A window handle can be given instead of a name, to address one client
+        # among several ones with the same name: it's only checked to still exist.
+        if isinstance(name, int):
+            if not win32gui.IsWindow(name):
+                return None, None
+            return name, win32gui.GetWindowText(name)
+
+        # Use the handle already found for the name, if the window still exists.
+        # Otherwise the game has been closed or restarted: enumerate again.
+        if name in self.hwnds:
+            if win32gui.IsWindow(self.hwnds[name][0]):
+                return self.hwnds[name]
+            del self.hwnds[name]
+            self.refresh()
+
+        # Getting the wanted process by analyzing the plist (skipping the destroyed
+        # windows): if not found, the windows are enumerated again once.
+        is_found = lambda p, n: name in n.lower() and win32gui.IsWindow(p)
+        process_info = [(p, n) for (p, n) in self.plist if is_found(p, n)]
+        if len(process_info) == 0:
+            self.refresh()
+            process_info = [(p, n) for (p, n) in self.plist if is_found(p, n)]
 
         # Handle error: if no process with the given name is found, return None
         # both for name and hwnd
@@ -37,8 +318,40 @@ class WindowsManager():
             return None, None
 
         # return the process hwnd and name
+        self.hwnds[name] = process_info[0]
         return process_info[0][0], process_info[0][1]
 
+    def get_session(self, name):
+
+        # Capture session of the process (name or handle), created on first use
+        if name not in self.sessions:
+            self.sessions[name] = CaptureSession(self, name)
+
+        return self.sessions[name]
+
+    def release_session(self, name):
+
+        # Release the GDI objects of the session of a window that can't be found
+        # anymore (ie: a game client closed), instead of keeping them until close
+        session = self.sessions.pop(name, None)
+        if session is not None:
+            session.close()
+
+    def capture(self, name, grab, *args):
+
+        # Capture through the session of the process: if the window is gone (None)
+        # the session is released
+        result = grab(self.get_session(name), *args)
+        if result is None:
+            self.release_session(name)
+
+        return result
+
+    def get_screen_size(self):
+
+        # Size of the primary screen in physical pixels (the process is DPI aware)
+        return windll.user32.GetSystemMetrics(0), windll.user32.GetSystemMetrics(1)
+
     def get_process_screensize(self, name):
 
         # Get the process id based on the name
@@ -49,9 +362,6 @@ class WindowsManager():
         if not hwnd:
             return None, None
 
-        # Set the correct DPI for the process
-        windll.user32.SetProcessDPIAware()
-
         # Get windows rectangle coordinate
         left, top, right, bot = win32gui.GetClientRect(hwnd)
         w = right - left
@@ -60,47 +370,64 @@ class WindowsManager():
         # Return width and height of the process
         return (w,h)
 
-    def get_process_snap(self, name):
+    def get_process_dpi(self, name):
 
-        # Get process info based on name
+        # Get the DPI of the process window (96 is the 100% scaling). Older
+        # systems without GetDpiForWindow are assumed at 96.
         hwnd, _ = self.get_process_ID(name)
+        if not hwnd:
+            return None
+
+        try:
+            return windll.user32.GetDpiForWindow(hwnd)
+        except AttributeError:
+            return 96
+
+    def get_process_snap(self, name):
+
+        # Capture the whole process window through his session
+        im = self.capture(name, CaptureSession.grab_full)
 
         # Handle error: if no process with the given name is found, return None
         # for image, w, h
-        if not hwnd:
+        if im is None:
             return None, None, None
 
-        # Get w and h of the process
-        w, h = self.get_process_screensize(name)
-        
-        # Process window in background
-        hwndDC = win32gui.GetWindowDC(hwnd)
-        mfcDC  = win32ui.CreateDCFromHandle(hwndDC)
-        saveDC = mfcDC.CreateCompatibleDC()
-
-        # Create bitmap from selected windows
-        saveBitMap = win32ui.CreateBitmap()
-        saveBitMap.CreateCompatibleBitmap(mfcDC, w, h)
-        saveDC.SelectObject(saveBitMap)
-
-        # Change the line below depending on whether you want the whole window
-        # or just the client area.
-        #result = windll.user32.PrintWindow(hwnd, saveDC.GetSafeHdc(), 1)
-        result = windll.user32.PrintWindow(hwnd, saveDC.GetSafeHdc(), 2)
-
-        bmpinfo = saveBitMap.GetInfo()
-        bmpstr = saveBitMap.GetBitmapBits(True)
-
-        im = Image.frombuffer(
-            'RGB',
-            (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
-            bmpstr, 'raw', 'BGRX', 0, 1)
-
-        # clean objects
-        win32gui.DeleteObject(saveBitMap.GetHandle())
-        saveDC.DeleteDC()
-        mfcDC.DeleteDC()
-        win32gui.ReleaseDC(hwnd, hwndDC)
-
         # Return the converted process image alongside with his resolution info
+        w, h = self.get_session(name).size
         return im, w, h
+
+    def get_process_frame(self, name):
+
+        # Capture the whole process window as a (h, w, 4) BGRX numpy view, without
+        # copies (None if no process with the given name is found). The view is
+        # overwritten by the next capture: copy it to keep it.
+        return self.capture(name, CaptureSession.grab_full_array)
+
+    def get_process_region(self, name, rect, mode='auto'):
+
+        # Capture only a region of the process window, instead of copying the
+        # whole frame to python. rect is (x, y, w, h) in window coordinates.
+        # Three modes are available:
+        # - printwindow: the window is rendered with PrintWindow inside a GDI bitmap,
+        #   and only the region is copied out of it (works even when the game is
+        #   covered by other windows, but the whole window is rendered every time).
+        # - bitblt: the region is copied straight from the window DC, skipping the
+        #   full frame render (faster, but the window must be visible on screen).
+        # - auto: bitblt while the region is visible on screen, printwindow otherwise
+        #   (the game minimized or covered, ie: tabbed out).
+        # Returns None if no process with the given name is found.
+        return self.capture(name, CaptureSession.grab_region, rect, mode)
+
+    def get_process_region_array(self, name, rect, mode='auto'):
+
+        # Same as get_process_region, but returns the (h, w, 4) BGRX numpy view over
+        # the region bitmap: no copy and no channel swizzle. The view is overwritten
+        # by the next capture of a region of the same size: copy it to keep it.
+        return self.capture(name, CaptureSession.grab_region_array, rect, mode)
+
+    def close(self):
+
+        # Release the GDI objects of every session
+        for session in self.sessions.values():
+            session.close()
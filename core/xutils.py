@@ -0,0 +1,372 @@
+# Class that takes care of finding the game window and capturing it on Linux (the
+# client running through Wine / Proton) over X11: the regions are grabbed with the
+# MIT-SHM extension into shared memory images, read as numpy views without copies.
+# Same interface as WindowsManager (see wutils), selected by plugutils.
+import ctypes
+import ctypes.util
+import numpy as np
+
+from ctypes import c_int, c_uint, c_long, c_ulong, c_ubyte, c_char_p, c_void_p, POINTER, byref
+
+# Xlib constants
+ZPIXMAP = 2
+IS_VIEWABLE = 2
+ALL_PLANES = c_ulong(-1).value
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+class XImage(ctypes.Structure):
+    _fields_ = [('width', c_int), ('height', c_int), ('xoffset', c_int), ('format', c_int),
+                ('data', c_void_p), ('byte_order', c_int), ('bitmap_unit', c_int), ('bitmap_bit_order', c_int),
+                ('bitmap_pad', c_int), ('depth', c_int), ('bytes_per_line', c_int), ('bits_per_pixel', c_int),
+                ('red_mask', c_ulong), ('green_mask', c_ulong), ('blue_mask', c_ulong), ('obdata', c_void_p),
+                ('f', c_void_p * 6)]
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [('shmseg', c_ulong), ('shmid', c_int), ('shmaddr', c_void_p), ('readOnly', c_int)]
+
+class XWindowAttributes(ctypes.Structure):
+    _fields_ = [('x', c_int), ('y', c_int), ('width', c_int), ('height', c_int), ('border_width', c_int),
+                ('depth', c_int), ('visual', c_void_p), ('root', c_ulong), ('class_', c_int),
+                ('bit_gravity', c_int), ('win_gravity', c_int), ('backing_store', c_int),
+                ('backing_planes', c_ulong), ('backing_pixel', c_ulong), ('save_under', c_int),
+                ('colormap', c_ulong), ('map_installed', c_int), ('map_state', c_int),
+                ('all_event_masks', c_long), ('your_event_mask', c_long), ('do_not_propagate_mask', c_long),
+                ('override_redirect', c_int), ('screen', c_void_p)]
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [('type', c_int), ('display', c_void_p), ('resourceid', c_ulong), ('serial', c_ulong),
+                ('error_code', c_ubyte), ('request_code', c_ubyte), ('minor_code', c_ubyte)]
+
+ERROR_HANDLER = ctypes.CFUNCTYPE(c_int, c_void_p, POINTER(XErrorEvent))
+
+def load_library(name):
+
+    # Load a shared library by his short name (ie: 'X11'): raises OSError if missing
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise OSError('lib{} not found'.format(name))
+
+    return ctypes.CDLL(path)
+
+def declare(lib, name, restype, *argtypes):
+
+    function = getattr(lib, name)
+    function.restype = restype
+    function.argtypes = list(argtypes)
+
+# Libraries and signatures, declared once (the module is imported only when the
+# backend is selected, see plugutils). The window creation ones are used by the
+# benchmark only (tools/bench_capture_x11.py).
+xlib = load_library('X11')
+xext = load_library('Xext')
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+declare(xlib, 'XOpenDisplay', c_void_p, c_char_p)
+declare(xlib, 'XCloseDisplay', c_int, c_void_p)
+declare(xlib, 'XDefaultRootWindow', c_ulong, c_void_p)
+declare(xlib, 'XDefaultScreen', c_int, c_void_p)
+declare(xlib, 'XDisplayWidth', c_int, c_void_p, c_int)
+declare(xlib, 'XDisplayHeight', c_int, c_void_p, c_int)
+declare(xlib, 'XDisplayWidthMM', c_int, c_void_p, c_int)
+declare(xlib, 'XQueryTree', c_int, c_void_p, c_ulong, POINTER(c_ulong), POINTER(c_ulong),
+        POINTER(POINTER(c_ulong)), POINTER(c_uint))
+declare(xlib, 'XFetchName', c_int, c_void_p, c_ulong, POINTER(c_char_p))
+declare(xlib, 'XInternAtom', c_ulong, c_void_p, c_char_p, c_int)
+declare(xlib, 'XGetWindowProperty', c_int, c_void_p, c_ulong, c_ulong, c_long, c_long, c_int, c_ulong,
+        POINTER(c_ulong), POINTER(c_int), POINTER(c_ulong), POINTER(c_ulong), POINTER(c_void_p))
+declare(xlib, 'XGetWindowAttributes', c_int, c_void_p, c_ulong, POINTER(XWindowAttributes))
+declare(xlib, 'XGetImage', POINTER(XImage), c_void_p, c_ulong, c_int, c_int, c_uint, c_uint, c_ulong, c_int)
+declare(xlib, 'XCreateImage', POINTER(XImage), c_void_p, c_void_p, c_uint, c_int, c_int, c_void_p, c_uint, c_uint,
+        c_int, c_int)
+declare(xlib, 'XCreateSimpleWindow', c_ulong, c_void_p, c_ulong, c_int, c_int, c_uint, c_uint, c_uint, c_ulong,
+        c_ulong)
+declare(xlib, 'XStoreName', c_int, c_void_p, c_ulong, c_char_p)
+declare(xlib, 'XMapWindow', c_int, c_void_p, c_ulong)
+declare(xlib, 'XDestroyWindow', c_int, c_void_p, c_ulong)
+declare(xlib, 'XDefaultGC', c_void_p, c_void_p, c_int)
+declare(xlib, 'XDefaultVisual', c_void_p, c_void_p, c_int)
+declare(xlib, 'XDefaultDepth', c_int, c_void_p, c_int)
+declare(xlib, 'XPutImage', c_int, c_void_p, c_ulong, c_void_p, POINTER(XImage), c_int, c_int, c_int, c_int, c_uint,
+        c_uint)
+declare(xlib, 'XDestroyImage', c_int, POINTER(XImage))
+declare(xlib, 'XSetErrorHandler', c_void_p, ERROR_HANDLER)
+declare(xlib, 'XSync', c_int, c_void_p, c_int)
+declare(xlib, 'XFree', c_int, c_void_p)
+declare(xext, 'XShmQueryExtension', c_int, c_void_p)
+declare(xext, 'XShmCreateImage', POINTER(XImage), c_void_p, c_void_p, c_uint, c_int, c_void_p,
+        POINTER(XShmSegmentInfo), c_uint, c_uint)
+declare(xext, 'XShmAttach', c_int, c_void_p, POINTER(XShmSegmentInfo))
+declare(xext, 'XShmDetach', c_int, c_void_p, POINTER(XShmSegmentInfo))
+declare(xext, 'XShmGetImage', c_int, c_void_p, c_ulong, POINTER(XImage), c_int, c_int, c_ulong)
+declare(libc, 'shmget', c_int, c_int, ctypes.c_size_t, c_int)
+declare(libc, 'shmat', c_void_p, c_int, c_void_p, c_int)
+declare(libc, 'shmdt', c_int, c_void_p)
+declare(libc, 'shmctl', c_int, c_int, c_int, c_void_p)
+
+# Last X error, recorded by the handler instead of letting Xlib exit the process
+# (ie: a window closed between two captures)
+X_ERRORS = []
+
+@ERROR_HANDLER
+def on_error(display, event):
+
+    X_ERRORS.append(event.contents.error_code)
+    return 0
+
+class ShmImage():
+
+    def __init__(self, display, visual, depth, w, h):
+
+        # Shared memory image of a fixed size: the X server writes the pixels
+        # straight into the segment, and the numpy view reads them without copies.
+        self.display = display
+        self.info = XShmSegmentInfo()
+        self.image = xext.XShmCreateImage(display, visual, depth, ZPIXMAP, None, byref(self.info), w, h)
+        if not self.image:
+            raise OSError('XShmCreateImage failed')
+        image = self.image.contents
+        if image.bits_per_pixel != 32:
+            self.destroy()
+            raise OSError('Unsupported pixel format ({} bits)'.format(image.bits_per_pixel))
+
+        # The segment is marked for removal once attached: the system frees it when
+        # both the server and this process detach, even after a crash.
+        size = image.bytes_per_line * h
+        self.info.shmid = libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if self.info.shmid < 0:
+            self.destroy()
+            raise OSError(ctypes.get_errno(), 'shmget failed')
+        self.info.shmaddr = libc.shmat(self.info.shmid, None, 0)
+        self.info.readOnly = 0
+        is_mapped = self.info.shmaddr not in (None, c_void_p(-1).value)
+        if not is_mapped or not xext.XShmAttach(display, byref(self.info)):
+            if is_mapped:
+                libc.shmdt(self.info.shmaddr)
+            libc.shmctl(self.info.shmid, IPC_RMID, None)
+            self.destroy()
+            raise OSError('Cannot attach the shared memory segment')
+        image.data = self.info.shmaddr
+        xlib.XSync(display, 0)
+        libc.shmctl(self.info.shmid, IPC_RMID, None)
+
+        # (h, w, 4) BGRX view over the segment (rows may be padded)
+        buffer = (c_ubyte * size).from_address(self.info.shmaddr)
+        self.array = np.ctypeslib.as_array(buffer).reshape(h, image.bytes_per_line // 4, 4)[:, :w]
+
+    def grab(self, xid, x, y):
+
+        # Copy the pixels of the window at (x, y) into the segment: returns the view,
+        # or None on error (ie: the window is gone or unmapped)
+        del X_ERRORS[:]
+        if not xext.XShmGetImage(self.display, xid, self.image, x, y, ALL_PLANES) or X_ERRORS:
+            return None
+
+        return self.array
+
+    def destroy(self):
+
+        # Free the image structure only: Xlib would free his data (the segment) and
+        # his obdata (our segment info) too
+        self.image.contents.data = None
+        self.image.contents.obdata = None
+        xlib.XDestroyImage(self.image)
+
+    def close(self):
+
+        xext.XShmDetach(self.display, byref(self.info))
+        xlib.XSync(self.display, 0)
+        self.destroy()
+        libc.shmdt(self.info.shmaddr)
+
+class X11Manager():
+
+    def __init__(self, display=None):
+
+        # Connection to the X server ($DISPLAY unless given), checked for MIT-SHM
+        self.display = xlib.XOpenDisplay(display.encode() if display else None)
+        if not self.display:
+            raise OSError('Cannot open the X display')
+        if not xext.XShmQueryExtension(self.display):
+            xlib.XCloseDisplay(self.display)
+            raise OSError('The X server does not support MIT-SHM')
+        xlib.XSetErrorHandler(on_error)
+
+        self.root = xlib.XDefaultRootWindow(self.display)
+        self.screen = xlib.XDefaultScreen(self.display)
+        self.net_wm_name = xlib.XInternAtom(self.display, b'_NET_WM_NAME', 0)
+        self.utf8_string = xlib.XInternAtom(self.display, b'UTF8_STRING', 0)
+
+        # Windows (xid, title) found at the last enumeration, the window found for
+        # each process name, and the shared memory images by (window, w, h)
+        self.plist = []
+        self.xids = {}
+        self.images = {}
+
+    def get_title(self, xid):
+
+        # Title of a window: the UTF-8 _NET_WM_NAME, or the legacy WM_NAME
+        actual_type, actual_format = c_ulong(), c_int()
+        nitems, bytes_after, prop = c_ulong(), c_ulong(), c_void_p()
+        status = xlib.XGetWindowProperty(self.display, xid, self.net_wm_name, 0, 1024, 0, self.utf8_string,
+                                         byref(actual_type), byref(actual_format), byref(nitems),
+                                         byref(bytes_after), byref(prop))
+        if status == 0 and prop.value:
+            title = ctypes.string_at(prop.value, nitems.value).decode('utf-8', 'replace')
+            xlib.XFree(prop)
+            if title:
+                return title
+
+        name = c_char_p()
+        if xlib.XFetchName(self.display, xid, byref(name)) and name.value is not None:
+            title = name.value.decode('latin-1')
+            xlib.XFree(ctypes.cast(name, c_void_p))
+            return title
+
+        return ''
+
+    def get_attributes(self, xid):
+
+        # Attributes of a window (None if it does not exist anymore)
+        attributes = XWindowAttributes()
+        del X_ERRORS[:]
+        if not xlib.XGetWindowAttributes(self.display, xid, byref(attributes)) or X_ERRORS:
+            return None
+
+        return attributes
+
+    def refresh(self):
+
+        # Enumerate the windows of the tree under the root, with their title
+        self.plist = []
+        stack = [self.root]
+        while stack:
+            xid = stack.pop()
+            root, parent, children, n = c_ulong(), c_ulong(), POINTER(c_ulong)(), c_uint()
+            if not xlib.XQueryTree(self.display, xid, byref(root), byref(parent), byref(children), byref(n)):
+                continue
+            for i in range(n.value):
+                child = children[i]
+                self.plist.append((child, self.get_title(child)))
+                stack.append(child)
+            if children:
+                xlib.XFree(ctypes.cast(children, c_void_p))
+
+    def is_viewable(self, xid):
+
+        attributes = self.get_attributes(xid)
+        return attributes is not None and attributes.map_state == IS_VIEWABLE
+
+    def find_processes(self, name):
+
+        # Enumerate the windows again and return every viewable window (xid, name)
+        # whose name contains the given one: one for each game client running.
+        self.refresh()
+        return [(p, n) for (p, n) in self.plist if name in n.lower() and self.is_viewable(p)]
+
+    def get_process_ID(self, name):
+
+        # A window id can be given instead of a name (one client among several)
+        if isinstance(name, int):
+            if self.get_attributes(name) is None:
+                self.release_window(name)
+                return None, None
+            return name, self.get_title(name)
+
+        # Use the window already found for the name, if it still exists
+        if name in self.xids:
+            if self.get_attributes(self.xids[name][0]) is not None:
+                return self.xids[name]
+            self.release_window(self.xids.pop(name)[0])
+
+        processes = self.find_processes(name)
+        if len(processes) == 0:
+            return None, None
+
+        self.xids[name] = processes[0]
+        return processes[0]
+
+    def get_screen_size(self):
+
+        return xlib.XDisplayWidth(self.display, self.screen), xlib.XDisplayHeight(self.display, self.screen)
+
+    def get_process_screensize(self, name):
+
+        # Size of the game window (None, None if not found)
+        xid, _ = self.get_process_ID(name)
+        attributes = self.get_attributes(xid) if xid else None
+        if attributes is None:
+            return None, None
+
+        return attributes.width, attributes.height
+
+    def get_process_dpi(self, name):
+
+        # DPI of the screen from his physical size (96 if unknown)
+        xid, _ = self.get_process_ID(name)
+        if not xid:
+            return None
+
+        mm = xlib.XDisplayWidthMM(self.display, self.screen)
+        return round(self.get_screen_size()[0] * 25.4 / mm) if mm > 0 else 96
+
+    def grab(self, name, x, y, w, h):
+
+        # Grab a rectangle of the window into his shared memory image (one for each
+        # window and size, created on first use), clipped to the window
+        xid, _ = self.get_process_ID(name)
+        attributes = self.get_attributes(xid) if xid else None
+        if attributes is None:
+            if xid:
+                self.release_window(xid)
+            return None
+        if attributes.map_state != IS_VIEWABLE:
+            return None
+
+        w, h = min(w, attributes.width - x), min(h, attributes.height - y)
+        if w <= 0 or h <= 0:
+            return None
+
+        key = (xid, w, h)
+        if key not in self.images:
+            self.images[key] = ShmImage(self.display, attributes.visual, attributes.depth, w, h)
+
+        return self.images[key].grab(xid, x, y)
+
+    def get_process_frame(self, name):
+
+        # Capture the whole window as a (h, w, 4) BGRX numpy view (None if not
+        # found). The view is overwritten by the next capture: copy it to keep it.
+        w, h = self.get_process_screensize(name)
+        if w is None:
+            return None
+
+        return self.grab(name, 0, 0, w, h)
+
+    def get_process_region_array(self, name, rect, mode='shm'):
+
+        # Capture only a region (x, y, w, h) of the window, as a (h, w, 4) BGRX numpy
+        # view over his shared memory image. The window must be mapped (the X server
+        # does not keep the content of covered windows without a compositor). The
+        # view is overwritten by the next capture of the same size: copy it to keep
+        # it.
+        x, y, w, h = rect
+        return self.grab(name, x, y, w, h)
+
+    def release_window(self, xid):
+
+        # Release the shared memory images of a window that does not exist anymore
+        # (ie: a game client closed), instead of keeping them until close
+        for key in [key for key in self.images if key[0] == xid]:
+            self.images.pop(key).close()
+
+    def close(self):
+
+        # Release the shared memory images and the connection
+        for image in self.images.values():
+            image.close()
+        self.images = {}
+        if self.display:
+            xlib.XCloseDisplay(self.display)
+            self.display = None
@@ -0,0 +1,44 @@
+# The vectorized sweep of the legacy estimator (core/anautils.py) must give the
+# same estimates as the estimator itself, run one reading at a time, on sessions
+# with misreads and failed readings.
+import os
+import sys
+import pytest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.anautils import stack_sessions, make_grid, simulate, simulate_sequential
+
+def make_sessions(n, seed=0):
+
+    # Draining queues read every 0.5-3 seconds, refreshed every 20 seconds: 5% of
+    # the readings are misread (an extra digit) and 5% failed (-1)
+    rng = np.random.default_rng(seed)
+    sessions = []
+    for _ in range(n):
+        start, players_per_minute, steps = rng.integers(500, 8000), rng.integers(30, 300), rng.integers(100, 300)
+        timestamps = np.cumsum(rng.uniform(0.5, 3, steps))
+        readings = np.maximum(start - (players_per_minute/60 * 20 * (timestamps // 20)).astype(int), 1).astype(float)
+        misread = rng.random(steps) < 0.05
+        readings[misread] = readings[misread]*10 + rng.integers(0, 9, misread.sum())
+        readings[rng.random(steps) < 0.05] = -1
+        sessions.append((readings, timestamps, float(timestamps[-1] + rng.uniform(0, 60))))
+
+    return sessions
+
+@pytest.mark.parametrize('grid', [
+    make_grid(),
+    make_grid(tolerance=[50, 100], deviations=[2, 4], window=[3, 6]),
+])
+def test_simulate_matches_sequential(grid):
+
+    sessions = make_sessions(12)
+    etas = simulate(stack_sessions(sessions), grid)
+    assert etas.shape[:2] == (len(grid), len(sessions))
+
+    for p, params in enumerate(grid):
+        for i, (readings, timestamps, _) in enumerate(sessions):
+            expected = simulate_sequential(np.where(readings >= 0, readings, np.nan), timestamps, params)
+            assert (~np.isnan(expected)).any()
+            np.testing.assert_allclose(etas[p, i, :len(readings)], expected, rtol=1e-9,
+                                       err_msg='parameters {}, session {}'.format(params, i))
@@ -0,0 +1,70 @@
+# Training of the digit recognizer on queue regions rendered with a FreeType font
+# (the default one of PIL) instead of the opencv Hershey fonts of the fallback
+# templates and of the generator: the templates learned from some numbers must
+# read other ones.
+import os
+import sys
+import pytest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image, ImageDraw, ImageFont
+from core.synutils import QueueFrameGenerator
+from core.preputils import Preprocessor
+from core.ocrutils import DigitRecognizer
+
+def load_font(size):
+
+    # Scalable default font of PIL (Pillow >= 10.1 with FreeType)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        pytest.skip('Pillow without a scalable default font')
+
+def render(generator, position):
+
+    # Region of the generator showing the position, drawn with the PIL font: light
+    # digits on a dark box, laid out one by one like the game font (see
+    # QueueFrameGenerator.render), then distorted by the generator
+    h, w, _ = generator.shape
+    image = Image.new('RGB', (w, h), (20, 20, 20))
+    draw = ImageDraw.Draw(image)
+
+    text = str(position)
+    l, t, r, b = draw.textbbox((0, 0), '0', font=load_font(100))
+    dw, dh = r - l, b - t
+    advance = 1.25 * dw
+    scale = min(0.9*w / (advance*(len(text)-1) + dw), 0.7*h / dh)
+    font = load_font(100 * scale)
+    x0 = (w - scale*(advance*(len(text)-1) + dw)) / 2
+    for i, digit in enumerate(text):
+        l, t, r, b = draw.textbbox((0, 0), digit, font=font)
+        draw.text((x0 + i*advance*scale - l + (scale*dw - (r-l))/2, (h - scale*dh)/2 - t), digit, font=font,
+                  fill=(230, 230, 230))
+
+    return generator.distort(np.array(image)[..., ::-1].copy())
+
+@pytest.mark.parametrize('screen_h', [1080, 1440, 2160])
+def test_trained_on_other_font(tmp_path, screen_h):
+
+    # Binarized crops of random positions, like the ones saved for train_digits.py
+    generator = QueueFrameGenerator(screen_h, seed=1, noise=(0, 4), jpeg=(70, 95), scale=None, jitter=0)
+    preprocessor = Preprocessor.for_resolution(screen_h)
+    rng = np.random.default_rng(0)
+    def get_crops(n):
+        positions = rng.integers(100, 20000, size=n)
+        return [preprocessor.process(render(generator, p)).copy() for p in positions], [str(p) for p in positions]
+
+    train_crops, train_labels = get_crops(60)
+    test_crops, test_labels = get_crops(200)
+
+    # Train and persist the templates, then read the unseen crops with a recognizer
+    # loading them
+    recognizer = DigitRecognizer(screen_h, templates_dir=str(tmp_path))
+    recognizer.fit(train_crops, train_labels)
+    recognizer.save()
+
+    recognizer = DigitRecognizer(screen_h, templates_dir=str(tmp_path))
+    assert recognizer.is_trained
+    correct = sum(text == label for (text, _), label in zip(recognizer.recognize_batch(test_crops), test_labels))
+    assert correct / len(test_labels) >= 0.95
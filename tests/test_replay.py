@@ -0,0 +1,31 @@
+# Replay of a clean synthetic session (see core/synutils.py) through both estimators:
+# every reading must be right and the eta close to the real login time.
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.synutils import QueueFrameGenerator
+from core.recutils import SessionRecorder, replay_session
+
+@pytest.fixture(scope='module')
+def session_path(tmp_path_factory):
+
+    # Draining queue of 1500 players at 100 players per minute, one frame per second
+    # without distortions, logged in a refresh after the queue emptied
+    path = str(tmp_path_factory.mktemp('sessions') / 'clean.npz')
+    generator = QueueFrameGenerator(1080, seed=0, noise=None, jpeg=None, scale=None, jitter=0)
+    recorder = SessionRecorder(path, (1920, 1080))
+    for timestamp, region, position in generator.stream(start=1500, players_per_minute=100):
+        recorder.add(region, timestamp, position)
+    recorder.mark_logged(timestamp + 20)
+    recorder.save()
+
+    return path
+
+@pytest.mark.parametrize('estimator', ['legacy', 'kalman'])
+def test_replay_clean_session(session_path, estimator):
+
+    report = replay_session(session_path, ocr_backend='digits', estimator=estimator)
+    assert report['accuracy'] == 1.0
+    assert report['eta_mae_min'] is not None and report['eta_mae_min'] < 3
@@ -0,0 +1,63 @@
+# Script that compares the full window capture with the queue region capture
+# (Windows only, with the game running), reporting the cost on the GDI side (pixels
+# rendered and blitted, and the time of the capture calls alone) and the total
+# latency up to the grayscale crop. Usage: python tools/bench_capture.py [n]
+import os
+import sys
+import cv2
+import time
+import numpy as np
+import pyautogui
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.lautils import LostArkManager
+
+def bench(fn, n):
+
+    # Warm up once, then return the mean latency in milliseconds
+    fn()
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    lamanager = LostArkManager(screen_res=pyautogui.size())
+    wman = lamanager.wman
+    x, y, rw, rh = lamanager.get_queue_rect()
+
+    def full_path():
+
+        # Old path: full window snap, full frame conversion and crop
+        im, w, h = wman.get_process_snap('lost ark')
+        im = cv2.cvtColor(np.array(im), cv2.COLOR_RGB2BGR)
+        return cv2.cvtColor(im[y:y+rh, x:x+rw], cv2.COLOR_BGR2GRAY)
+
+    def region_gdi(mode):
+
+        # GDI side of the new path: the region is blitted (after the full window
+        # render with printwindow) in the DIB section, nothing else
+        return wman.get_process_region_array('lost ark', (x, y, rw, rh), mode)
+
+    def region_path(mode):
+
+        # New path: only the queue region is blitted, and read in place as BGRX
+        return cv2.cvtColor(region_gdi(mode), cv2.COLOR_BGRA2GRAY)
+
+    # Bytes drawn on the GDI side (BGRX, 4 bytes per pixel: printwindow renders the
+    # full window before blitting the region) and copied out of GDI (the region is
+    # not copied at all, it's read in place from the DIB section).
+    w, h = wman.get_process_screensize('lost ark')
+    session = wman.get_session('lost ark')
+    is_visible = session.is_region_visible((x, y, rw, rh))
+    print('Window {}x{}, queue region {}x{}, auto mode: {}'.format(w, h, rw, rh,
+                                                               'bitblt' if is_visible else 'printwindow'))
+    print('{:<22}{:>12}{:>14}{:>10}{:>10}'.format('path', 'gdi bytes', 'bytes copied', 'gdi ms', 'ms/frame'))
+    print('{:<22}{:>12}{:>14}{:>10}{:>10.3f}'.format('full window', w*h*4, w*h*4, '-', bench(full_path, n)))
+    for mode, gdi_bytes in (('printwindow', (w*h + rw*rh)*4), ('bitblt', rw*rh*4),
+                            ('auto', (rw*rh if is_visible else w*h + rw*rh)*4)):
+        print('{:<22}{:>12}{:>14}{:>10.3f}{:>10.3f}'.format('region ({})'.format(mode), gdi_bytes, 0,
+                                                            bench(lambda: region_gdi(mode), n),
+                                                            bench(lambda: region_path(mode), n)))
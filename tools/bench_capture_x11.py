@@ -0,0 +1,84 @@
+# Script that measures the capture latency of the X11 backend (see core/xutils.py)
+# on a dummy window named like the game, showing a synthetic queue region: the
+# MIT-SHM region grab, the plain XGetImage one (copied by the X server to a new
+# image at every call) and the whole window, then reads the queue from it.
+# Linux only, runs without a desktop with: xvfb-run -s "-screen 0 1920x1080x24" python tools/bench_capture_x11.py [n]
+import os
+import sys
+import time
+import ctypes
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import xutils
+from core.lautils import LostArkManager
+from core.synutils import QueueFrameGenerator
+
+def create_window(wman, frame, title=b'Lost Ark (dummy)'):
+
+    # Map a window of the frame size, named like the game, and draw the frame (BGRX)
+    # into it
+    h, w = frame.shape[:2]
+    display, screen = wman.display, wman.screen
+    xid = xutils.xlib.XCreateSimpleWindow(display, wman.root, 0, 0, w, h, 0, 0, 0)
+    xutils.xlib.XStoreName(display, xid, title)
+    xutils.xlib.XMapWindow(display, xid)
+    xutils.xlib.XSync(display, 0)
+    deadline = time.monotonic() + 2
+    while not wman.is_viewable(xid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    image = xutils.xlib.XCreateImage(display, xutils.xlib.XDefaultVisual(display, screen),
+                                     xutils.xlib.XDefaultDepth(display, screen), xutils.ZPIXMAP, 0,
+                                     frame.ctypes.data, w, h, 32, 0)
+    xutils.xlib.XPutImage(display, xid, xutils.xlib.XDefaultGC(display, screen), image, 0, 0, 0, 0, w, h)
+    xutils.xlib.XSync(display, 0)
+    image.contents.data = None
+    xutils.xlib.XDestroyImage(image)
+
+    return xid
+
+def bench(fn, n):
+
+    # Warm up once, then return the mean latency in milliseconds
+    fn()
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    try:
+        wman = xutils.X11Manager()
+    except OSError as e:
+        sys.exit('{}: run it under an X server (ie: xvfb-run)'.format(e))
+
+    # 1080p frame with the synthetic queue region at the queue rectangle
+    screen_res = (1920, 1080)
+    lamanager = LostArkManager(screen_res, ocr_backend='digits', wman=wman)
+    x, y, w, h = rect = lamanager.get_queue_rect()
+    frame = np.zeros((screen_res[1], screen_res[0], 4), dtype=np.uint8)
+    region = QueueFrameGenerator(screen_res[1], seed=0, noise=None, jpeg=None, scale=None, jitter=0).render(4034)
+    frame[y:y+h, x:x+w, :3] = region
+    xid = create_window(wman, frame)
+
+    def get_image():
+        image = xutils.xlib.XGetImage(wman.display, xid, x, y, w, h, xutils.ALL_PLANES, xutils.ZPIXMAP)
+        data = np.ctypeslib.as_array((ctypes.c_ubyte * (image.contents.bytes_per_line * h))
+                                     .from_address(image.contents.data)).copy()
+        xutils.xlib.XDestroyImage(image)
+        return data
+
+    grabbed = wman.get_process_region_array('lost ark', rect)
+    print('window:             {} ({}x{})'.format(wman.get_process_ID('lost ark')[1],
+                                                  *wman.get_process_screensize('lost ark')))
+    print('region matches:     {}'.format(grabbed is not None and np.array_equal(grabbed[..., :3], region)))
+    print('shm region:         {:9.3f} ms'.format(bench(lambda: wman.get_process_region_array('lost ark', rect), n)))
+    print('XGetImage region:   {:9.3f} ms'.format(bench(get_image, n)))
+    print('shm full window:    {:9.3f} ms'.format(bench(lambda: wman.get_process_frame('lost ark'), max(n // 10, 1))))
+    print('get_queue_status:   {:9.3f} ms -> {}'.format(bench(lamanager.get_queue_status, n), lamanager.get_queue_status()))
+
+    xutils.xlib.XDestroyWindow(wman.display, xid)
+    wman.close()
@@ -0,0 +1,64 @@
+# Script that compares, for each supported resolution, the memory and latency of
+# the old frame path (GetBitmapBits bytes -> PIL -> numpy -> BGR -> crop -> gray)
+# with the zero-copy one (BGRX view -> crop -> gray). The capture buffer is
+# synthetic, so it runs anywhere. Usage: python tools/bench_frame_path.py [n]
+import os
+import sys
+import cv2
+import time
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.lautils import QUEUE_CROPS
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (2560, 1440), (3840, 2160)]
+
+def bench(fn, n):
+
+    # Warm up once, then return the mean latency in milliseconds and the peak
+    # memory allocated by a single call (numpy allocations are traced, PIL ones
+    # aren't: the old path is underestimated).
+    fn()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000, peak
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print('{:<11}{:<10}{:>16}{:>14}{:>12}'.format('resolution', 'path', 'bytes copied', 'peak alloc', 'ms/frame'))
+    for w, h in RESOLUTIONS:
+
+        # The capture bitmap (BGRX) and the queue rectangle inside it
+        frame = np.random.randint(0, 256, (h, w, 4), dtype=np.uint8)
+        y0, y1, x0, x1 = QUEUE_CROPS[h]
+        x, y, rw, rh = w//2-50+x0, h//2+y0, x1-x0, y1-y0
+
+        def old_path():
+
+            # Bytes out of the bitmap, PIL swizzle, numpy copy, full frame swizzle
+            bmpstr = frame.tobytes()
+            im = Image.frombuffer('RGB', (w, h), bmpstr, 'raw', 'BGRX', 0, 1)
+            bgr = cv2.cvtColor(np.array(im), cv2.COLOR_RGB2BGR)
+            return cv2.cvtColor(bgr[y:y+rh, x:x+rw], cv2.COLOR_BGR2GRAY)
+
+        def new_path():
+
+            # View over the bitmap, crop, grayscale from BGRX
+            return cv2.cvtColor(frame[y:y+rh, x:x+rw], cv2.COLOR_BGRA2GRAY)
+
+        assert (old_path() == new_path()).all()
+
+        # Full frame copies: bytes (4 bpp), PIL (3 bpp), numpy (3 bpp), BGR (3 bpp)
+        copied = {'old': w*h*(4+3+3+3) + rw*rh, 'zero-copy': rw*rh}
+        for name, fn in (('old', old_path), ('zero-copy', new_path)):
+            ms, peak = bench(fn, n)
+            print('{:<11}{:<10}{:>16}{:>14}{:>12.3f}'.format('{}x{}'.format(w, h), name, copied[name], peak, ms))
@@ -0,0 +1,45 @@
+# Script that measures the per-frame latency of the OCR backends on a queue crop.
+# Usage: python tools/bench_ocr.py [crop.png] [screen height]
+import os
+import sys
+import cv2
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.ocrutils import DigitRecognizer
+
+def bench(fn, img, n):
+
+    # Warm up once, then return the mean latency in milliseconds
+    fn(img)
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(img)
+    return (time.perf_counter() - start) / n * 1000
+
+if __name__ == '__main__':
+
+    # Use the given crop or render a 1080p-like one (black digits on white)
+    if len(sys.argv) > 1:
+        img = cv2.imread(sys.argv[1], cv2.IMREAD_UNCHANGED)
+        screen_h = int(sys.argv[2]) if len(sys.argv) > 2 else 1080
+    else:
+        img = np.full((30, 67), 255, dtype=np.uint8)
+        cv2.putText(img, '4034', (2, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+        screen_h = 1080
+
+    recognizer = DigitRecognizer(screen_h)
+    digits_ms = bench(recognizer.recognize, img, 1000)
+    print('digits:    {:9.3f} ms/frame -> {}'.format(digits_ms, recognizer.recognize(img)))
+
+    # Tesseract may not be installed: skip it in that case
+    try:
+        import pytesseract
+        config = '--psm 10 --oem 3 -c tessedit_char_whitelist=0123456789'
+        ocr = lambda im: pytesseract.image_to_string(im, lang='eng', config=config)
+        tess_ms = bench(ocr, img, 20)
+        print('tesseract: {:9.3f} ms/frame -> {!r}'.format(tess_ms, ocr(img)))
+        print('speedup:   {:9.1f}x'.format(tess_ms / digits_ms))
+    except Exception as e:
+        print('tesseract: not available ({})'.format(e))
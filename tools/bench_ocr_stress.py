@@ -0,0 +1,116 @@
+# Script that stress tests the recognition on synthetic queue regions (see
+# core/synutils.py), for every supported resolution: throughput and accuracy of
+# the recognizers alone, of LostArkManager.get_queue_status on pre-rendered frames
+# (with and without the cascade), and of a draining queue stream rendered live.
+# Runs anywhere, no game nor Windows needed.
+# Usage: python tools/bench_ocr_stress.py [--frames N] [--resolutions 720,1080] [--rate FPS] [--seed S]
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.lautils import LostArkManager
+from core.synutils import QueueFrameGenerator
+from core.plugutils import get_backend
+
+class FrameSource():
+
+    def __init__(self, regions, screen_res):
+
+        # Capture source cycling through pre-rendered regions: the rendering is not
+        # part of the timings
+        self.regions = regions
+        self.screen_res = screen_res
+        self.index = -1
+
+    def get_process_region_array(self, name, rect, mode='printwindow'):
+
+        self.index = (self.index + 1) % len(self.regions)
+        return self.regions[self.index]
+
+    def get_screen_size(self):
+
+        return self.screen_res
+
+    def close(self):
+
+        pass
+
+def run(fn, truths):
+
+    # Frames per second and accuracy of fn(i) -> text over the frames
+    correct = 0
+    start = time.perf_counter()
+    for i, truth in enumerate(truths):
+        correct += str(fn(i)) == str(truth)
+    elapsed = time.perf_counter() - start
+
+    return len(truths) / elapsed, correct / len(truths)
+
+def run_batch(lamanager, regions, truths, size=32):
+
+    # Frames per second and accuracy of the batched recognizer (one matrix product
+    # for every batch of binarized regions)
+    texts = []
+    start = time.perf_counter()
+    for i in range(0, len(regions), size):
+        queue_imgs = lamanager.preprocessor.process_batch(regions[i:i+size])
+        texts.extend(text for text, _ in lamanager.recognizer.recognize_batch(list(queue_imgs)))
+    elapsed = time.perf_counter() - start
+
+    return len(regions) / elapsed, sum(t == str(p) for t, p in zip(texts, truths)) / len(truths)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=2000, help='frames rendered for each resolution')
+    parser.add_argument('--resolutions', default='720,1080,1440,2160')
+    parser.add_argument('--rate', type=float, default=1.0, help='frames per second of queue time of the stream')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('{:<7}{:<26}{:>12}{:>10}'.format('height', 'stage', 'frames/s', 'accuracy'))
+    for screen_h in (int(v) for v in args.resolutions.split(',')):
+        screen_res = (screen_h * 16 // 9, screen_h)
+
+        # Frames rendered once: the generation has his own throughput
+        generator = QueueFrameGenerator(screen_h, seed=args.seed)
+        start = time.perf_counter()
+        regions, truths = generator.render_batch(args.frames)
+        print('{:<7}{:<26}{:>12.0f}{:>10}'.format(screen_h, 'generate', args.frames / (time.perf_counter() - start), '-'))
+
+        # Recognizer alone, frame by frame and batched
+        lamanager = LostArkManager(screen_res, ocr_backend='digits', wman=FrameSource(regions, screen_res))
+        recognize = lambda i: lamanager.recognizer.recognize(lamanager.preprocess(regions[i]))[0]
+        print('{:<7}{:<26}{:>12.0f}{:>10.3f}'.format(screen_h, 'digits', *run(recognize, truths)))
+        print('{:<7}{:<26}{:>12.0f}{:>10.3f}'.format(screen_h, 'digits (batch)', *run_batch(lamanager, regions, truths)))
+
+        # Tesseract, on a tenth of the frames, if installed
+        try:
+            pool = get_backend('ocr', 'tesseract')()
+            n = max(len(truths) // 10, 1)
+            recognize = lambda i: pool.recognize(lamanager.preprocess(regions[i]).copy())[0].strip()
+            print('{:<7}{:<26}{:>12.0f}{:>10.3f}'.format(screen_h, 'tesseract', *run(recognize, truths[:n])))
+            pool.close()
+        except (OSError, RuntimeError):
+            print('{:<7}{:<26}{:>12}{:>10}'.format(screen_h, 'tesseract', 'n/a', 'n/a'))
+
+        # Whole reading path (capture -> preprocess -> cache -> recognize), with and
+        # without the cascade
+        for threshold, stage in ((None, 'get_queue_status'), (lamanager.cascade_threshold, 'get_queue_status (cascade)')):
+            lamanager = LostArkManager(screen_res, ocr_backend='digits', wman=FrameSource(regions, screen_res))
+            lamanager.cascade_threshold = threshold
+            print('{:<7}{:<26}{:>12.0f}{:>10.3f}'.format(screen_h, stage,
+                                                         *run(lambda i: lamanager.get_queue_status(), truths)))
+
+        # Draining queue rendered live at every capture, args.rate frames per second
+        # of queue time
+        source = get_backend('capture', 'synthetic')(screen_res, fps=args.rate, seed=args.seed)
+        lamanager = LostArkManager(screen_res, ocr_backend='digits', wman=source)
+        correct, n, start = 0, 0, time.perf_counter()
+        while n < args.frames and not source.is_finished():
+            correct += str(lamanager.get_queue_status()) == str(source.truth)
+            n += 1
+        print('{:<7}{:<26}{:>12.0f}{:>10.3f}'.format(screen_h, 'stream (render + read)',
+                                                     n / (time.perf_counter() - start), correct / n))
@@ -0,0 +1,76 @@
+# Script that compares the rendering cost of the overlay modes: the default one
+# (stylesheet border-image, every label set at every result) and the lite one
+# (cached background pixmap, labels set only when their text changes). A minute of
+# results (one per sec, the queue number changing every 20 sec) is replayed, and
+# the repaints and GUI thread CPU time per minute are reported, with the time of a
+# full repaint of the overlay (ie: when it's exposed or dragged).
+# Usage: python tools/bench_overlay.py [n] (QT_QPA_PLATFORM=offscreen runs it
+# without a display)
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout
+from core.ovlutils import BackgroundFrame, OverlayStats
+
+BACKGROUND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'background.jpg')
+
+def make_overlay(lite):
+
+    # Frame of the overlay at 1080p with his three labels
+    if lite:
+        frame = BackgroundFrame(BACKGROUND)
+    else:
+        frame = QWidget()
+        frame.setObjectName('ExternalFrame')
+        frame.setStyleSheet('QWidget#ExternalFrame { border-image: url("%s"); border-radius: 20px; }'
+                            % BACKGROUND.replace('\\', '/'))
+    frame.resize(300, 150)
+    layout = QVBoxLayout(frame)
+    labels = []
+    for _ in range(3):
+        label = QLabel('')
+        label.setStyleSheet('QLabel { background-color: rgba(187, 194, 194, 220); border-radius: 10px; }')
+        layout.addWidget(label)
+        labels.append(label)
+    frame.show()
+
+    return frame, labels
+
+def run(app, lite, n):
+
+    # Replay 60 results, each followed by the event processing of the GUI thread
+    frame, labels = make_overlay(lite)
+    app.processEvents()
+    stats = OverlayStats([frame] + labels, interval=3600)
+    texts = {}
+    start_cpu = time.thread_time()
+    for second in range(60):
+        queue = 4000 - 34 * (second // 20)
+        for label, text in zip(labels, [' Position in queue: {} '.format(queue), ' Players per minute: 102 ',
+                                         'Time left: {} minutes (31-47)'.format(queue // 102)]):
+            if not lite or texts.get(label) != text:
+                texts[label] = text
+                label.setText(text)
+        app.processEvents()
+    cpu = (time.thread_time() - start_cpu) * 1000
+    repaints = stats.repaints
+
+    # Full repaints, drawn synchronously
+    start = time.perf_counter()
+    for _ in range(n):
+        frame.repaint()
+    repaint_ms = (time.perf_counter() - start) / n * 1000
+    frame.close()
+
+    return repaints, cpu, repaint_ms
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    app = QApplication(sys.argv[:1])
+    print('{:<10}{:>16}{:>14}{:>18}'.format('mode', 'repaints/min', 'CPU ms/min', 'full repaint ms'))
+    for lite in (False, True):
+        repaints, cpu, repaint_ms = run(app, lite, n)
+        print('{:<10}{:>16}{:>14.1f}{:>18.3f}'.format('lite' if lite else 'default', repaints, cpu, repaint_ms))
@@ -0,0 +1,74 @@
+# Script that measures the cold start: the import time of the core modules and of
+# the entry points, each in a fresh interpreter, and the time to the first frame of
+# the headless daemon playing a synthetic session (any OS).
+# Usage: python tools/bench_startup.py [runs]
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Modules timed, from the lightest to the whole manager
+MODULES = ['core.estutils', 'core.schedutils', 'core.trackutils', 'core.lautils', 'core.monutils',
+           'core.pipeutils']
+
+def time_import(module, runs):
+
+    # Best wall time (ms) of a fresh interpreter importing the module, minus the one
+    # of a bare interpreter
+    def run(code):
+        best = float('inf')
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    return (run('import ' + module) - run('pass')) * 1000
+
+def make_session(path, n=5):
+
+    # Synthetic 1080p session: light digits on a dark box, one frame per second
+    import cv2
+    import numpy as np
+    from core.recutils import SessionRecorder
+
+    recorder = SessionRecorder(path, (1920, 1080))
+    for i in range(n):
+        region = np.full((30, 67, 3), 30, dtype=np.uint8)
+        cv2.putText(region, str(4034 - 34*i), (2, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (220, 220, 220), 2)
+        recorder.add(region, timestamp=float(i))
+    recorder.save()
+
+def time_first_frame(session, runs):
+
+    # Best time (ms) from the daemon launch to his first JSON record
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        daemon = subprocess.Popen([sys.executable, 'LostQueueHeadless.py', '--source', session, '--ocr', 'digits'],
+                                  cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        daemon.stdout.readline()
+        best = min(best, time.perf_counter() - start)
+        daemon.kill()
+        daemon.wait()
+
+    return best * 1000
+
+if __name__ == '__main__':
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('{:<22}{:>12}'.format('import', 'ms'))
+    for module in MODULES:
+        try:
+            print('{:<22}{:>12.1f}'.format(module, time_import(module, runs)))
+        except subprocess.CalledProcessError:
+            print('{:<22}{:>12}'.format(module, 'n/a'))
+
+    with tempfile.TemporaryDirectory() as folder:
+        session = os.path.join(folder, 'startup.npz')
+        make_session(session)
+        print('{:<22}{:>12.1f}'.format('first frame (daemon)', time_first_frame(session, runs)))
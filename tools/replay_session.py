@@ -0,0 +1,27 @@
+# Script that replays a recorded session (python LostQueue.py --record session.npz)
+# through the LostArkManager, headlessly, and reports per stage latency, throughput,
+# OCR accuracy and eta error.
+# Usage: python tools/replay_session.py session.npz [--ocr digits|tesseract] [--estimator kalman|legacy]
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.recutils import replay_session
+from core.metutils import METRICS
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('session')
+    parser.add_argument('--ocr', default='auto')
+    parser.add_argument('--estimator', default='kalman')
+    parser.add_argument('--metrics', help='also dump the instrumentation snapshot in this JSON file')
+    args = parser.parse_args()
+
+    METRICS.enabled = args.metrics is not None
+    report = replay_session(args.session, ocr_backend=args.ocr, estimator=args.estimator)
+    print(json.dumps(report, indent=2))
+    if args.metrics:
+        METRICS.dump(args.metrics)
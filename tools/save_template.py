@@ -0,0 +1,27 @@
+# Script that saves the queue dialog template used by the calibrator to locate the
+# queue number on resolutions without a hardcoded crop. Run it while in queue, with
+# the game at one of the supported resolutions (Windows only).
+import os
+import sys
+import cv2
+import numpy as np
+import pyautogui
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.lautils import LostArkManager
+
+if __name__ == '__main__':
+
+    w, h = pyautogui.size()
+    lamanager = LostArkManager(screen_res=(w, h))
+    rect = lamanager.get_queue_rect()
+
+    # Rescale the frame to 1080p, since the template is matched at h/1080 scale
+    im, _, _ = lamanager.wman.get_process_snap('lost ark')
+    frame = cv2.cvtColor(np.array(im), cv2.COLOR_RGB2BGR)[:h, :w]
+    s = 1080 / h
+    frame = cv2.resize(frame, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+    rect = [round(v*s) for v in rect]
+
+    lamanager.calibrator.save_template(frame, rect)
+    print('Template saved in {}'.format(lamanager.calibrator.template_path))
@@ -0,0 +1,73 @@
+# Script that evaluates the legacy estimator on recorded sessions (python
+# LostQueue.py --record session.npz) for every combination of the given parameters,
+# all at once (see core/anautils.py), and prints the eta error of each set from the
+# best one. Used to tune LEGACY_PARAMS in core/lautils.py.
+# Usage: python tools/sweep_sessions.py sessions/ [--tolerance 50,100,200] [--deviations 3,4]
+#        [--window 4,6,8] [--refresh 20] [--source ocr|truth|recognized] [--workers N] [--check]
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.anautils import load_sessions, make_grid, sweep, simulate, simulate_sequential
+
+def parse_values(text, kind):
+
+    # Comma separated values of a parameter (None if not given)
+    return None if text is None else [kind(v) for v in text.split(',')]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sessions', nargs='+', help='session files or folders of sessions')
+    parser.add_argument('--tolerance', help='queue tolerances (players)')
+    parser.add_argument('--deviations', help='outlier cuts (sigma)')
+    parser.add_argument('--window', help='window sizes (samples)')
+    parser.add_argument('--refresh', help='server refresh times (seconds)')
+    parser.add_argument('--source', default='ocr', help='readings: read again (ocr), labels (truth) or live ones (recognized)')
+    parser.add_argument('--ocr', default='digits')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes')
+    parser.add_argument('--top', type=int, default=20, help='parameter sets printed')
+    parser.add_argument('--check', action='store_true', help='compare with the scalar estimator on the first set')
+    parser.add_argument('--json', help='also dump every report in this JSON file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sessions = load_sessions(args.sessions, args.source, args.ocr)
+    print('Loaded {} sessions ({} frames) in {:.1f}s'.format(len(sessions['readings']),
+                                                            int((~np.isnan(sessions['timestamps'])).sum()),
+                                                            time.perf_counter() - start))
+
+    grid = make_grid(tolerance=parse_values(args.tolerance, int), deviations=parse_values(args.deviations, float),
+                     window=parse_values(args.window, int), refresh=parse_values(args.refresh, float))
+
+    # The vectorized simulation must give the same estimates as the estimator
+    if args.check:
+        etas = simulate(sessions, grid[:1])[0]
+        for i, (readings, timestamps) in enumerate(zip(sessions['readings'], sessions['timestamps'])):
+            n = int((~np.isnan(timestamps)).sum())
+            expected = simulate_sequential(readings[:n], timestamps[:n], grid[0])
+            if not np.array_equal(expected, etas[i, :n], equal_nan=True):
+                sys.exit('Session {}: the vectorized estimates differ from the scalar ones'.format(i))
+        print('Check passed: same estimates as the scalar estimator')
+
+    start = time.perf_counter()
+    reports = sweep(sessions, grid, workers=args.workers)
+    print('Evaluated {} parameter sets in {:.1f}s\n'.format(len(grid), time.perf_counter() - start))
+
+    print('{:>10}{:>11}{:>8}{:>9}{:>10}{:>9}{:>9}{:>9}{:>9}{:>9}{:>9}'.format(
+        'tolerance', 'deviations', 'window', 'refresh', 'estimates', 'mae', 'bias', 'rmse', 'p5', 'p95', '<=1min'))
+    for report in reports[:args.top]:
+        if 'mae_min' not in report:
+            print('{tolerance:>10}{deviations:>11}{window:>8}{refresh:>9}{estimates:>10}'.format(**report))
+            continue
+        print('{tolerance:>10}{deviations:>11}{window:>8}{refresh:>9}{estimates:>10}{mae_min:>9.2f}{bias_min:>9.2f}'
+              '{rmse_min:>9.2f}{p5:>9.2f}{p95:>9.2f}{within_1min:>9.1%}'.format(
+                  p5=report['percentiles_min']['5'], p95=report['percentiles_min']['95'], **report))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
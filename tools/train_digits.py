@@ -0,0 +1,33 @@
+# Script that trains the in-process digit recognizer from labelled queue crops.
+# The crops are the binarized images returned by LostArkManager.get_queue_image,
+# saved as <queue number>_<anything>.png inside a folder, one folder for each
+# resolution (ie: python tools/train_digits.py crops/1080 1080).
+import os
+import sys
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.ocrutils import DigitRecognizer
+
+if __name__ == '__main__':
+
+    folder, screen_h = sys.argv[1], int(sys.argv[2])
+
+    # Load every crop alongside with his label taken from the file name
+    crops, labels = [], []
+    for fname in sorted(os.listdir(folder)):
+        label = fname.split('_')[0]
+        if not fname.endswith('.png') or not label.isdigit():
+            continue
+        crops.append(cv2.imread(os.path.join(folder, fname), cv2.IMREAD_UNCHANGED))
+        labels.append(label)
+
+    # Train and persist the templates for the given resolution
+    recognizer = DigitRecognizer(screen_h)
+    n_glyphs = recognizer.fit(crops, labels)
+    recognizer.save()
+
+    # Report the accuracy on the training crops
+    correct = sum(recognizer.recognize(c)[0] == l for c, l in zip(crops, labels))
+    print('Trained on {} glyphs from {} crops: saved in {}'.format(n_glyphs, len(crops), recognizer.templates_path))
+    print('Accuracy on training crops: {}/{}'.format(correct, len(crops)))